@@ -0,0 +1,5 @@
+"""Benchmarks for the bot's hot paths.
+
+Each module in this package is a standalone script, run from the top of the
+source tree with e.g. ``python -m benchmarks.dispatch``.
+"""
@@ -0,0 +1,38 @@
+"""Argument parsing benchmark.
+
+Compares :func:`.util.parse_arguments` with the :mod:`shlex`-based
+implementation it replaced, on typical command arguments.
+"""
+import sys
+import shlex
+
+from csbot.util import parse_arguments
+from benchmarks.common import rate, report
+
+
+def shlex_parse_arguments(raw):
+    lex = shlex.shlex(raw, posix=True)
+    lex.whitespace_split = True
+    lex.quotes = '"'
+    return list(lex)
+
+
+INPUTS = [
+    ('empty', ''),
+    ('single word', 'Alan'),
+    ('sentence', "Haegin you're awesome, don't forget the meeting at 3pm"),
+    ('quoted', '"string grouping" is "really useful" ok'),
+]
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    for label, raw in INPUTS:
+        report('{}, tokenizer'.format(label),
+               rate(lambda: parse_arguments(raw), n), 'parses/sec')
+        report('{}, shlex'.format(label),
+               rate(lambda: shlex_parse_arguments(raw), n), 'parses/sec')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
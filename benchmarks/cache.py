@@ -0,0 +1,64 @@
+"""Command reply cache benchmark.
+
+Measures how many commands per second :meth:`.Bot.fire_command` can answer
+with their replies cached (see :mod:`csbot.cache`) and with the cache turned
+off, for ``!plugins.available``, which discovers plugins every time it runs,
+and ``!get``, which is only a key/value store lookup.  Replies go to a stub
+protocol, so only the bot's own work is measured.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from csbot.core import Bot
+from csbot.events import CommandEvent
+from benchmarks.common import rate, report
+
+
+class Network(object):
+    name = 'default'
+
+
+class Protocol(object):
+    nickname = 'csyorkbot'
+    network = Network()
+
+    def msg(self, target, message, priority=None):
+        pass
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    tmp = tempfile.mkdtemp()
+    bot = Bot('benchmark.cfg')
+    bot.config.set('DEFAULT', 'keyvalstore', os.path.join(tmp, 'keyval.db'))
+    bot.config.set('DEFAULT', 'keyvalfile', os.path.join(tmp, 'keyval.cfg'))
+    bot.load_plugin('pluginmanager')
+    bot.load_plugin('example')
+    bot.plugins['example'].set('foo', 'bar')
+    protocol = Protocol()
+
+    def command(name, raw_data):
+        bot.fire_command(CommandEvent(bot, protocol, name,
+                                      'asker!~user@host', '#cs-york', False,
+                                      raw_data))
+
+    for name, raw_data in (('plugins.available', ''), ('get', 'foo')):
+        handler = bot.commands[name]
+        report('!{} cached'.format(name),
+               rate(lambda: command(name, raw_data), n), 'commands/sec')
+        policy, handler.im_func.cache = handler.cache, None
+        report('!{} uncached'.format(name),
+               rate(lambda: command(name, raw_data), n), 'commands/sec')
+        handler.im_func.cache = policy
+
+    stats = bot.response_cache.stats()
+    report('cache hits', stats['hits'], '')
+    report('cache misses', stats['misses'], '')
+    bot.teardown(save_config=False)
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,50 @@
+"""Channel membership benchmark.
+
+Fills a channel with N users (10,000 by default) from a ``NAMES`` reply, then
+measures how many membership changes per second the bot's
+:class:`.ChannelState` handles, to show that they don't depend on the size
+of the channel::
+
+    python -m benchmarks.channels 10000
+"""
+import sys
+import time
+
+from csbot.channels import ChannelState
+from benchmarks.common import rate, report
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 10000
+    n = 100000
+
+    for users in (100, size):
+        state = ChannelState()
+        state.joined('#cs-york', 'csyorkbot')
+        names = [('user{}'.format(i), 'v' if i % 10 == 0 else '')
+                 for i in xrange(users)]
+        start = time.time()
+        state.set_names('#cs-york', names)
+        report('{} users, NAMES'.format(users),
+               (time.time() - start) * 1000, 'ms')
+
+        def join_part():
+            state.add('Newcomer', '#cs-york')
+            state.remove('newcomer', '#cs-york')
+        report('{} users, join and part'.format(users), rate(join_part, n),
+               'pairs/sec')
+
+        def rename():
+            state.rename('user1', 'user1_')
+            state.rename('user1_', 'user1')
+        report('{} users, nick change'.format(users), rate(rename, n) * 2,
+               'changes/sec')
+
+        def lookup():
+            'USER42' in state['#cs-york']
+        report('{} users, membership check'.format(users), rate(lookup, n),
+               'checks/sec')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,51 @@
+"""Helpers shared by the benchmark scripts.
+"""
+import time
+
+from csbot.core import Bot, Plugin, PluginFeatures
+
+
+def make_bot(plugin_classes=(), config='benchmark.cfg'):
+    """Create a :class:`.Bot` with *plugin_classes* loaded.
+
+    Plugins are made available to :meth:`.Bot.load_plugin` without going
+    through plugin discovery, so synthetic plugin classes can be used.
+    """
+    bot = Bot(config)
+    available = dict((P.plugin_name(), P) for P in plugin_classes)
+    bot.discover_plugins = lambda: available
+    for P in plugin_classes:
+        bot.load_plugin(P.plugin_name())
+    return bot
+
+
+def make_plugin(name, hooks=(), commands=()):
+    """Create a synthetic plugin class called *name* with a no-op handler
+    registered for every event type in *hooks* and every command in
+    *commands*.
+    """
+    features = PluginFeatures()
+
+    def handler(self, event):
+        pass
+
+    for h in hooks:
+        features.hook(h)(handler)
+    for c in commands:
+        features.command(c)(handler)
+
+    return type(name, (Plugin,), {'features': features})
+
+
+def rate(f, n):
+    """Call *f* *n* times and return calls per second.
+    """
+    start = time.time()
+    for _ in xrange(n):
+        f()
+    elapsed = time.time() - start
+    return n / elapsed if elapsed > 0 else float('inf')
+
+
+def report(label, value, unit):
+    print '{:<40} {:>14,.0f} {}'.format(label, value, unit)
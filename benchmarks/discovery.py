@@ -0,0 +1,101 @@
+"""Plugin discovery and startup benchmark.
+
+Generates a package of N synthetic plugin modules (50 by default) and times
+:meth:`.Bot.setup` loading all of them, once discovering plugins before every
+load as :meth:`.Bot.load_plugin` does on its own, and once with
+:meth:`.Bot.load_plugins`.  Also times rediscovery with nothing changed and
+after one module has changed.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from csbot.core import Bot, PluginCache, Plugin
+from benchmarks.common import report
+
+
+PACKAGE = 'csbot_benchmark_plugins'
+
+PLUGIN_SOURCE = """
+from csbot.core import Plugin, PluginFeatures
+
+class Plugin{n}(Plugin):
+    features = PluginFeatures()
+
+    @features.command('command{n}')
+    def command(self, event):
+        pass
+
+    @features.hook('privmsg')
+    def privmsg(self, event):
+        pass
+"""
+
+
+class BenchmarkBot(Bot):
+    PLUGIN_PACKAGE = PACKAGE
+
+    def __init__(self, configpath, tmp):
+        super(BenchmarkBot, self).__init__(configpath)
+        self.config.set('DEFAULT', 'keyvalstore',
+                        os.path.join(tmp, 'keyval.db'))
+
+
+def make_package(path, n):
+    os.mkdir(os.path.join(path, PACKAGE))
+    open(os.path.join(path, PACKAGE, '__init__.py'), 'w').close()
+    for i in xrange(n):
+        with open(os.path.join(path, PACKAGE, 'plugin{}.py'.format(i)),
+                  'w') as f:
+            f.write(PLUGIN_SOURCE.format(n=i))
+
+
+def timed(f):
+    start = time.time()
+    f()
+    return time.time() - start
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 50
+    tmp = tempfile.mkdtemp()
+    sys.path.insert(0, tmp)
+    try:
+        make_package(tmp, n)
+        names = ' '.join('plugin{}'.format(i) for i in xrange(n))
+
+        bot = BenchmarkBot('nonexistent.cfg', tmp)
+        report('first discovery (imports)',
+               timed(bot.discover_plugins) * 1000, 'ms')
+
+        # Without caching, every load scans every module
+        bot = BenchmarkBot('nonexistent.cfg', tmp)
+        bot.config.set('DEFAULT', 'plugins', names)
+        def uncached():
+            bot.plugin_cache = PluginCache(PACKAGE, Plugin)
+            return Bot.discover_plugins(bot)
+        bot.discover_plugins = uncached
+        bot.load_plugins = lambda names: map(bot.load_plugin, names)
+        report('setup, scan per plugin', timed(bot.setup) * 1000, 'ms')
+        bot.keyval.close()
+
+        bot = BenchmarkBot('nonexistent.cfg', tmp)
+        bot.config.set('DEFAULT', 'plugins', names)
+        report('setup, cached discovery', timed(bot.setup) * 1000, 'ms')
+        bot.keyval.close()
+        report('rediscover, no changes',
+               timed(bot.discover_plugins) * 1000000, 'us')
+
+        path = os.path.join(tmp, PACKAGE, 'plugin0.py')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        report('rediscover, one module changed',
+               timed(bot.discover_plugins) * 1000000, 'us')
+    finally:
+        sys.path.remove(tmp)
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
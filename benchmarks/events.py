@@ -0,0 +1,74 @@
+"""Event memory and throughput benchmark.
+
+Replays a flood of ``privmsg`` lines through :func:`.events.proxy`, keeping
+every event alive, and compares the per-type ``__slots__`` event classes with
+the old dictionary-backed :class:`Event` which stored a
+:class:`~datetime.datetime` per event.
+"""
+import sys
+import gc
+from datetime import datetime
+
+from csbot import events
+from csbot.core import BotProtocol
+from benchmarks.common import make_bot, make_plugin, rate, report
+
+
+class LegacyEvent(object):
+    """The event class that :func:`.events.event_class` replaced."""
+    def __init__(self, bot, protocol, event_type, attributes):
+        self.datetime = datetime.now()
+        for attr, value in attributes.iteritems():
+            setattr(self, attr, value)
+        self.bot = bot
+        self.protocol = protocol
+        self.event_type = event_type
+
+
+def event_size(e):
+    """Size in bytes of an event and its attribute storage, not counting the
+    attribute values themselves, which are shared by both implementations.
+    """
+    size = sys.getsizeof(e)
+    if hasattr(e, '__dict__'):
+        size += sys.getsizeof(e.__dict__)
+        if isinstance(e.__dict__.get('datetime'), datetime):
+            size += sys.getsizeof(e.datetime)
+    return size
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 200000
+
+    bot = make_bot([make_plugin('Logger', hooks=['privmsg'])])
+    attrs = ('user', 'channel', 'message')
+    lines = [('nick{}!~user@host'.format(i % 100), '#cs-york',
+              'message number {}'.format(i)) for i in xrange(n)]
+    Privmsg = events.event_class('privmsg', attrs)
+
+    def slotted():
+        return [Privmsg(bot, None, *line) for line in lines]
+
+    def legacy():
+        return [LegacyEvent(bot, None, 'privmsg', dict(zip(attrs, line)))
+                for line in lines]
+
+    for label, create in (('slotted', slotted), ('legacy', legacy)):
+        gc.collect()
+        flood = create()
+        report('{} bytes/event'.format(label),
+               sum(event_size(e) for e in flood) / float(n), 'bytes')
+        del flood
+        gc.collect()
+        report('{} creation'.format(label),
+               rate(create, 1) * n, 'events/sec')
+
+    # The full proxy path, including the hook dispatch
+    protocol = BotProtocol(bot)
+    line = lines[0]
+    report('proxied privmsg', rate(lambda: protocol.privmsg(*line), n),
+           'events/sec')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,297 @@
+"""A fake IRC server populated by simulated users.
+
+:class:`FakeIRCServer` accepts connections from the bot and speaks just
+enough of the protocol for it: registration, ``JOIN`` with a ``NAMES`` reply,
+``PART``, ``PING``/``PONG`` and ``PRIVMSG``.  Every other client on the network
+is simulated: :meth:`FakeIRCServer.tick` makes them chat, run commands, join,
+part, quit and change nick at the configured rates, and tells the bot about
+everything that happens in its channels.
+
+Commands are sent as ``!test <token>``, which the example plugin replies to
+including the token, so the latency of each reply can be measured from the
+clients' side.
+"""
+import re
+import random
+import collections
+
+from twisted.internet import protocol, reactor, task
+from twisted.protocols import basic
+from twisted.words.protocols import irc
+
+
+SERVER = 'fakeircd.example.com'
+TOKEN = re.compile(r'soak-\d+')
+
+WORDS = ('the lecture notes are up for this week has anybody started the '
+         'coursework yet I think the deadline is friday at noon').split()
+
+
+class VirtualClient(object):
+    """A simulated user."""
+    __slots__ = ('nick', 'channels')
+
+    def __init__(self, nick):
+        self.nick = nick
+        self.channels = set()
+
+    @property
+    def hostmask(self):
+        return '{0}!~{0}@sim.example.com'.format(self.nick)
+
+
+class FakeIRCConnection(basic.LineReceiver):
+    """The server side of a connection from the bot."""
+    delimiter = '\r\n'
+
+    def __init__(self, server):
+        self.server = server
+        self.nick = None
+        self.registered = False
+        self.channels = set()
+
+    def connectionMade(self):
+        self.server.connected(self)
+
+    def connectionLost(self, reason):
+        self.server.disconnected(self)
+
+    def send(self, prefix, command, *params):
+        """Send a line, the last parameter of which may contain spaces."""
+        parts = [':' + prefix, command] + list(params[:-1])
+        if params:
+            parts.append(':' + params[-1])
+        self.server.lines_out += 1
+        self.sendLine(' '.join(parts))
+
+    def lineReceived(self, line):
+        self.server.lines_in += 1
+        prefix, command, params = irc.parsemsg(line)
+        handler = getattr(self, 'irc_' + command, None)
+        if handler is not None:
+            handler(params)
+
+    def irc_NICK(self, params):
+        self.nick = params[0]
+
+    def irc_USER(self, params):
+        self.registered = True
+        self.send(SERVER, irc.RPL_WELCOME, self.nick, 'Welcome to fakeircd')
+        self.server.registered(self)
+
+    def irc_PING(self, params):
+        self.send(SERVER, 'PONG', SERVER, params[-1])
+
+    def irc_PONG(self, params):
+        pass
+
+    def irc_JOIN(self, params):
+        for channel in params[0].split(','):
+            self.channels.add(channel)
+            self.send(self.nick + '!~bot@localhost', 'JOIN', channel)
+            names = [c.nick for c in self.server.members(channel)]
+            # Keep NAMES replies to a reasonable line length
+            for i in xrange(0, len(names), 20):
+                self.send(SERVER, irc.RPL_NAMREPLY, self.nick, '=', channel,
+                          ' '.join(names[i:i + 20]))
+            self.send(SERVER, irc.RPL_ENDOFNAMES, self.nick, channel,
+                      'End of /NAMES list')
+
+    def irc_PART(self, params):
+        for channel in params[0].split(','):
+            self.channels.discard(channel)
+            self.send(self.nick + '!~bot@localhost', 'PART', channel)
+
+    def irc_PRIVMSG(self, params):
+        self.server.bot_said(params[0], params[-1])
+
+    def irc_QUIT(self, params):
+        self.transport.loseConnection()
+
+
+class FakeIRCServer(protocol.ServerFactory):
+    """A network of *clients* simulated users in *channels* channels.
+
+    *rates* maps action names (``chat``, ``command``, ``join``, ``part``,
+    ``quit`` and ``rename``) to how many times per second they happen across
+    the whole network.  *clock* provides ``seconds()``, and is normally the
+    reactor.
+    """
+    ACTIONS = ('chat', 'command', 'join', 'part', 'quit', 'rename')
+
+    def __init__(self, clients, channels, rates, seed=None, clock=reactor):
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.rates = rates
+        self.channels = ['#soak{}'.format(i) for i in xrange(channels)]
+        self.clients = []
+        self.next_nick = 0
+        for i in xrange(clients):
+            client = self.new_client()
+            # Start everyone in a few channels
+            client.channels.update(self.random.sample(
+                self.channels, min(3, len(self.channels))))
+
+        self.connection = None
+        self.ticker = None
+        self.last_tick = None
+        self.next_token = 0
+        # Command token -> time sent
+        self.outstanding = dict()
+        # Reply latencies since the last call to take_latencies()
+        self.latencies = []
+        self.actions = collections.Counter()
+        self.lines_in = 0
+        self.lines_out = 0
+        self.connections = 0
+        self.disconnected_at = None
+        self.reconnect_times = []
+
+    def new_client(self):
+        client = VirtualClient('sim{}'.format(self.next_nick))
+        self.next_nick += 1
+        self.clients.append(client)
+        return client
+
+    def members(self, channel):
+        return [c for c in self.clients if channel in c.channels]
+
+    # Connection events
+
+    def buildProtocol(self, addr):
+        return FakeIRCConnection(self)
+
+    def connected(self, connection):
+        self.connection = connection
+        self.connections += 1
+
+    def registered(self, connection):
+        if self.disconnected_at is not None:
+            self.reconnect_times.append(self.clock.seconds() -
+                                        self.disconnected_at)
+            self.disconnected_at = None
+
+    def disconnected(self, connection):
+        if connection is self.connection:
+            self.connection = None
+            self.disconnected_at = self.clock.seconds()
+
+    def disconnect(self):
+        """Drop the bot's connection, to exercise reconnecting."""
+        if self.connection is not None:
+            self.connection.transport.loseConnection()
+
+    def bot_said(self, target, message):
+        for token in TOKEN.findall(message):
+            sent = self.outstanding.pop(token, None)
+            if sent is not None:
+                self.latencies.append(self.clock.seconds() - sent)
+
+    def take_latencies(self):
+        latencies, self.latencies = self.latencies, []
+        return latencies
+
+    def missing_replies(self, timeout):
+        """Count commands that haven't been replied to within *timeout*
+        seconds.
+        """
+        cutoff = self.clock.seconds() - timeout
+        return sum(1 for sent in self.outstanding.itervalues()
+                   if sent < cutoff)
+
+    # Simulation
+
+    def start(self, interval=0.1):
+        self.ticker = task.LoopingCall(self.tick)
+        self.ticker.start(interval, now=False)
+
+    def stop(self):
+        if self.ticker is not None and self.ticker.running:
+            self.ticker.stop()
+
+    def tick(self):
+        """Perform however many actions are due since the last tick."""
+        now = self.clock.seconds()
+        elapsed = now - self.last_tick if self.last_tick is not None else 0
+        self.last_tick = now
+        for action in self.ACTIONS:
+            expected = self.rates.get(action, 0) * elapsed
+            count = int(expected)
+            if self.random.random() < expected - count:
+                count += 1
+            for _ in xrange(count):
+                getattr(self, 'do_' + action)()
+                self.actions[action] += 1
+
+    def tell_bot(self, channel, prefix, command, *params):
+        """Send a line to the bot, if it is in *channel* (or *channel* is
+        None, meaning it's network-wide).
+        """
+        c = self.connection
+        if c is not None and c.registered and \
+                (channel is None or channel in c.channels):
+            c.send(prefix, command, *params)
+
+    def random_member(self):
+        """Pick a random client that is in at least one channel."""
+        for _ in xrange(10):
+            client = self.random.choice(self.clients)
+            if client.channels:
+                return client
+        return None
+
+    def do_chat(self):
+        client = self.random_member()
+        if client is not None:
+            channel = self.random.choice(list(client.channels))
+            text = ' '.join(self.random.sample(WORDS, 6))
+            self.tell_bot(channel, client.hostmask, 'PRIVMSG', channel, text)
+
+    def do_command(self):
+        client = self.random_member()
+        c = self.connection
+        if client is None or c is None:
+            return
+        # Only count commands the bot can see
+        channels = [ch for ch in client.channels if ch in c.channels]
+        if not channels:
+            return
+        channel = self.random.choice(channels)
+        token = 'soak-{}'.format(self.next_token)
+        self.next_token += 1
+        self.outstanding[token] = self.clock.seconds()
+        self.tell_bot(channel, client.hostmask, 'PRIVMSG', channel,
+                      '!test ' + token)
+
+    def do_join(self):
+        client = self.random.choice(self.clients)
+        channel = self.random.choice(self.channels)
+        if channel not in client.channels:
+            client.channels.add(channel)
+            self.tell_bot(channel, client.hostmask, 'JOIN', channel)
+
+    def do_part(self):
+        client = self.random_member()
+        if client is not None:
+            channel = self.random.choice(list(client.channels))
+            client.channels.discard(channel)
+            self.tell_bot(channel, client.hostmask, 'PART', channel,
+                          'bye')
+
+    def do_quit(self):
+        client = self.random_member()
+        if client is not None:
+            if self.connection is not None and \
+                    client.channels & self.connection.channels:
+                self.tell_bot(None, client.hostmask, 'QUIT', 'Quit: bye')
+            client.channels.clear()
+
+    def do_rename(self):
+        client = self.random_member()
+        if client is not None:
+            old = client.hostmask
+            client.nick = 'sim{}'.format(self.next_nick)
+            self.next_nick += 1
+            if self.connection is not None and \
+                    client.channels & self.connection.channels:
+                self.tell_bot(None, old, 'NICK', client.nick)
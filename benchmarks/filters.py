@@ -0,0 +1,60 @@
+"""Hook filter benchmark.
+
+Measures how many ``privmsg`` events per second :meth:`.Bot.fire_hooks` can
+dispatch with different numbers of plugins, each wanting messages that match
+its own regular expression.  Either every plugin's hook checks the regular
+expression itself, or the hooks declare it as a filter (see
+:mod:`csbot.filters`) and the bot checks them all at once.  The messages
+match none of the regular expressions, which is the usual case.
+"""
+import re
+import sys
+
+from csbot.core import Plugin, PluginFeatures
+from csbot.events import event_class
+from benchmarks.common import make_bot, rate, report
+
+
+def checking_plugin(i):
+    """A plugin whose hook checks the message itself."""
+    features = PluginFeatures()
+    regex = re.compile(r'^!?trigger{}\b'.format(i))
+
+    @features.hook('privmsg')
+    def handler(self, event):
+        if regex.search(event.message) is None:
+            return
+
+    return type('Checking{}'.format(i), (Plugin,), {'features': features})
+
+
+def filtered_plugin(i):
+    """A plugin whose hook declares a filter."""
+    features = PluginFeatures()
+
+    @features.hook('privmsg', message=r'^!?trigger{}\b'.format(i))
+    def handler(self, event):
+        pass
+
+    return type('Filtered{}'.format(i), (Plugin,), {'features': features})
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    Privmsg = event_class('privmsg', ('user', 'channel', 'message'))
+
+    for count in (10, 100, 500):
+        for label, make in (('checking', checking_plugin),
+                            ('filters', filtered_plugin)):
+            bot = make_bot([make(i) for i in xrange(count)])
+            # Only measure the plugins' hooks, not looking for commands
+            bot.hooks['privmsg'] = [h for h in bot.hooks['privmsg']
+                                    if h != bot.privmsg]
+            event = Privmsg(bot, None, 'nick!~user@host', '#cs-york',
+                            'has anybody seen the lecture notes?')
+            report('{} plugins, {}'.format(count, label),
+                   rate(lambda: bot.fire_hooks(event), n), 'events/sec')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,95 @@
+"""Channel history search benchmark.
+
+Adds N messages (1,000,000 by default) of words drawn from a Zipf-like
+vocabulary to a :class:`.HistoryStore`, writing segments and merging them as
+it goes, then times queries like the ones ``!grep``, ``!last`` and
+``!quote`` make::
+
+    python -m benchmarks.history 1000000
+
+Background jobs are run synchronously, so the indexing rate includes the
+time spent writing and merging segments.
+"""
+import sys
+import time
+import bisect
+import random
+import shutil
+import tempfile
+import itertools
+
+from twisted.internet import defer
+
+from csbot.history import HistoryStore, Query, TooBroad
+from benchmarks.common import report
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    rng = random.Random(0)
+    vocabulary = ['word{}'.format(i) for i in xrange(50000)]
+    weights = [1.0 / (i + 1) for i in xrange(len(vocabulary))]
+    # Cumulative weights, for picking words by binary search
+    total = 0
+    cumulative = []
+    for w in weights:
+        total += w
+        cumulative.append(total)
+
+    def word():
+        return vocabulary[bisect.bisect(cumulative, rng.random() * total)]
+
+    tmp = tempfile.mkdtemp()
+    store = HistoryStore(tmp, flush_size=100000, merge_factor=4,
+                         run_in_thread=defer.maybeDeferred)
+    start_time = 1350000000
+    messages = [' '.join(word() for _ in xrange(8)) for _ in xrange(10000)]
+    start = time.time()
+    for i in xrange(n):
+        store.add(start_time + i * 0.1, 'default',
+                  '#channel{}'.format(i % 10), 'user{}'.format(i % 500),
+                  messages[i % len(messages)])
+    elapsed = time.time() - start
+    report('indexing', n / elapsed, 'messages/sec')
+    report('segments', len(store.segments), '')
+
+    def timed(label, f, repeat=20):
+        start = time.time()
+        for _ in xrange(repeat):
+            f()
+        report(label, (time.time() - start) / repeat * 1e6, 'us/query')
+
+    def search(query, limit=3):
+        try:
+            return list(itertools.islice(store.search(query), limit))
+        except TooBroad:
+            return None
+
+    middle = start_time + n * 0.05
+    queries = [
+        ('rare word', Query(['word40000'])),
+        ('common word', Query(['word1'])),
+        ('two common words', Query(['word1 word2'])),
+        ('common word in a channel', Query(['word1'], network='default',
+                                           channel='#channel3')),
+        ('phrase', Query(['word1 word0'])),
+        ('nick and time range', Query([], nick='user42',
+                                      start=middle, end=middle + 3600)),
+        ('absent word', Query(['nothing'])),
+        # Gives up after checking SEARCH_SCAN_LIMIT messages
+        ('too broad', Query(['word0 word0 word0 word0'])),
+    ]
+    for label, query in queries:
+        timed('grep, ' + label, lambda: search(query))
+    timed('last, nick', lambda: search(Query([], nick='user7'), 1))
+    timed('quote, nick', lambda: store.random_match(Query([], nick='user7'),
+                                                   rng))
+    timed('quote, nick and word',
+          lambda: store.random_match(Query(['word3'], nick='user7'), rng))
+
+    store.close()
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
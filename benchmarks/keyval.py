@@ -0,0 +1,65 @@
+"""Plugin key/value store benchmark.
+
+Measures :class:`.keyval.LogStore` set and get throughput, syncing, recovery
+time when reopening a log of N keys (1 million by default), and compaction
+of a log where every key has been overwritten.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from twisted.internet import defer
+
+from csbot.keyval import LogStore
+from benchmarks.common import report
+
+
+def timed(f):
+    start = time.time()
+    f()
+    return time.time() - start
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    keys = ['key{}'.format(i) for i in xrange(n)]
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'keyval.db')
+    try:
+        store = LogStore(path, run_in_thread=defer.maybeDeferred)
+
+        def set_all():
+            for i, key in enumerate(keys):
+                store.set('benchmark', key, i)
+        report('set', n / timed(set_all), 'ops/sec')
+        report('sync', timed(store.sync) * 1000, 'ms')
+
+        def get_all():
+            for key in keys:
+                store.get('benchmark', key)
+        report('get', n / timed(get_all), 'ops/sec')
+
+        def set_typed():
+            for key in keys:
+                store.set('benchmark', key, {'nick': key, 'seen': [1, 2.5]})
+        report('set (dict values)', n / timed(set_typed), 'ops/sec')
+        store.close()
+        report('log size', os.path.getsize(path) / 1024.0, 'KiB')
+
+        stores = []
+        report('recovery', timed(lambda: stores.append(LogStore(
+            path, run_in_thread=defer.maybeDeferred))) * 1000, 'ms')
+        store = stores[0]
+        report('compaction', timed(store.compact) * 1000, 'ms')
+        report('compacted log size', os.path.getsize(path) / 1024.0, 'KiB')
+        store.close()
+        report('recovery after compaction', timed(lambda: LogStore(
+            path, run_in_thread=defer.maybeDeferred).close()) * 1000, 'ms')
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,66 @@
+"""Channel logging benchmark.
+
+Replays N ``PRIVMSG`` lines (100,000 by default) spread over ten channels
+through a :class:`.BotProtocol`, with and without the ``logger`` plugin
+loaded, and reports how many lines per second are handled and the longest
+time spent writing out buffers in one go, which is how long the reactor is
+held up by logging::
+
+    python -m benchmarks.logger 100000
+"""
+import sys
+import time
+import shutil
+import tempfile
+
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol
+from benchmarks.common import report
+
+
+def replay(bot, lines):
+    protocol = BotProtocol(bot)
+    protocol.makeConnection(StringTransport())
+    start = time.time()
+    for line in lines:
+        protocol.lineReceived(line)
+    return len(lines) / (time.time() - start)
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    lines = [':user{}!~u@host PRIVMSG #channel{} :message number {}'.format(
+        i % 50, i % 10, i) for i in xrange(n)]
+
+    tmp = tempfile.mkdtemp()
+    bot = Bot('benchmark.cfg')
+    report('without logging', replay(bot, lines), 'lines/sec')
+
+    bot.config.add_section('logger')
+    bot.config.set('logger', 'log_dir', tmp)
+    bot.load_plugin('logger')
+    logs = bot.plugins['logger'].logs
+
+    # Time each write, including the ones forced by full buffers
+    longest = [0]
+    flush_file = logs.flush_file
+
+    def timed_flush_file(f):
+        start = time.time()
+        flush_file(f)
+        longest[0] = max(longest[0], time.time() - start)
+    logs.flush_file = timed_flush_file
+
+    report('with logging', replay(bot, lines), 'lines/sec')
+    start = time.time()
+    logs.flush()
+    report('final flush', (time.time() - start) * 1e6, 'us')
+    report('longest write', longest[0] * 1e6, 'us')
+    report('writes', logs.stats()['flushes'], '')
+    bot.teardown(save_config=False)
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
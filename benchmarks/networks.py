@@ -0,0 +1,81 @@
+"""Multi-network memory and startup benchmark.
+
+Starts a bot with the usual plugins and N networks, each connected to a fake
+transport, signed on and given the names of 200 users in each of 5
+channels.  Each N runs in a fresh process; the startup time and resident
+memory are compared with running N single-network processes.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from twisted.test.proto_helpers import StringTransport
+
+from benchmarks.common import report
+from benchmarks.soak import rss_kib
+
+
+CHANNELS = ['#channel{}'.format(i) for i in xrange(5)]
+USERS = ['user{}'.format(i) for i in xrange(200)]
+
+
+def run(n, tmp):
+    """Start a bot with *n* networks, returning (seconds, RSS in KiB)."""
+    start = time.time()
+    from csbot.core import Bot, BotProtocol
+
+    path = os.path.join(tmp, 'csbot.cfg')
+    with open(path, 'w') as f:
+        f.write('[DEFAULT]\nnetworks = {}\nchannels = {}\n'
+                'plugins = example users tell\nmongodb_host = :memory:\n'
+                'mongodb_threads = 0\nkeyvalstore = {}\n'.format(
+                    ' '.join('net{}'.format(i) for i in xrange(n)),
+                    ' '.join(CHANNELS), os.path.join(tmp, 'keyval.db')))
+    bot = Bot(path)
+    bot.setup()
+    protocols = []
+    for network in bot.networks.itervalues():
+        p = BotProtocol(bot, network)
+        p.makeConnection(StringTransport())
+        p.irc_RPL_WELCOME('server', [p.nickname, 'Welcome'])
+        for channel in CHANNELS:
+            p.names(channel, [(u, set()) for u in USERS], [])
+        protocols.append(p)
+    return time.time() - start, rss_kib(os.getpid())
+
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == '--run':
+        tmp = tempfile.mkdtemp()
+        try:
+            # Keep the bot's output out of the way
+            sys.stdout = open(os.devnull, 'w')
+            elapsed, rss = run(int(argv[2]), tmp)
+            sys.stdout = sys.__stdout__
+            print elapsed, rss
+        finally:
+            shutil.rmtree(tmp)
+        return
+
+    results = dict()
+    for n in (1, 2, 4, 8, 16):
+        out = subprocess.check_output([sys.executable, '-m',
+                                       'benchmarks.networks', '--run',
+                                       str(n)])
+        elapsed, rss = out.split()
+        results[n] = (float(elapsed), int(rss))
+
+    single_time, single_rss = results[1]
+    for n, (elapsed, rss) in sorted(results.iteritems()):
+        report('{} networks startup'.format(n), elapsed * 1000,
+               'ms  ({:,.0f} ms as {} processes)'.format(
+                   single_time * 1000 * n, n))
+        report('{} networks RSS'.format(n), rss,
+               'KiB ({:,.0f} KiB as {} processes)'.format(single_rss * n, n))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
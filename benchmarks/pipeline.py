@@ -0,0 +1,243 @@
+"""Dispatch pipeline benchmark suite.
+
+Drives a :class:`.BotProtocol` connected to an in-memory transport through
+each stage of handling a message, and the whole pipeline end to end:
+
+======================  ==================================================
+``parse``               splitting a raw line into prefix, command and params
+``proxy``               :func:`.events.proxy` creating a privmsg event
+``dispatch``            :meth:`.Bot.post_event` firing privmsg hooks
+``command_create``      :meth:`.CommandEvent.create` matching a command
+``parse_arguments``     :func:`.util.parse_arguments` on command data
+``reply``               :meth:`.CommandEvent.reply` down to the transport
+``end_to_end_message``  a raw line of chat through the protocol
+``end_to_end_command``  a raw command line in, reply out
+======================  ==================================================
+
+For each stage the best of several runs is reported in operations per
+second, along with the number of instances of Python classes (events,
+matches, queued lines and so on) created per operation, so that a stage which
+starts creating more objects shows up even if it hasn't got slower yet.
+
+Results can be saved as JSON with ``--save`` and compared against saved
+results with ``--compare``, which exits with status 1 if any stage is slower
+than the baseline by more than ``--threshold`` or creates more instances::
+
+    python -m benchmarks.pipeline --save baseline.json
+    # ... make changes ...
+    python -m benchmarks.pipeline --compare baseline.json
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import collections
+
+from twisted.words.protocols import irc
+from twisted.test.proto_helpers import StringTransport
+
+from csbot import events
+from csbot.core import BotProtocol, Plugin, PluginFeatures
+from csbot.util import parse_arguments
+from benchmarks.common import make_bot, make_plugin, report
+
+
+USER = 'nick!~user@host.example.com'
+CHANNEL = '#cs-york'
+MESSAGE = 'has anybody seen the lecture notes for this week?'
+COMMAND = '!echo "quoted argument" and some more words'
+LINE = ':{} PRIVMSG {} :{}'.format(USER, CHANNEL, MESSAGE)
+COMMAND_LINE = ':{} PRIVMSG {} :{}'.format(USER, CHANNEL, COMMAND)
+
+
+class Echo(Plugin):
+    features = PluginFeatures()
+
+    @features.command('echo')
+    def echo(self, event):
+        event.reply(' '.join(event.data))
+
+
+def make_protocol():
+    """Create a bot with the echo plugin and a privmsg hook, and a protocol
+    connected to a fake transport with no rate limit.
+    """
+    bot = make_bot([Echo, make_plugin('Listener', hooks=['privmsg'])])
+    bot.config.set('DEFAULT', 'lineRate', '0')
+    protocol = BotProtocol(bot)
+    protocol.transport = StringTransport()
+    return protocol
+
+
+def stages():
+    """Get a list of ``(name, operation)`` pairs."""
+    protocol = make_protocol()
+    bot = protocol.bot
+    transport = protocol.transport
+
+    def sent(f):
+        # Don't let the fake transport's buffer grow without bound
+        def op():
+            f()
+            transport.clear()
+        return op
+
+    # A protocol whose events go nowhere, to time the proxy on its own
+    proxy_protocol = make_protocol()
+    proxy_protocol.bot.post_event = lambda event: None
+
+    Privmsg = events.event_class('privmsg', ('user', 'channel', 'message'))
+    message_event = Privmsg(bot, protocol, USER, CHANNEL, MESSAGE)
+    command_event = Privmsg(bot, protocol, USER, CHANNEL, COMMAND)
+    command = events.CommandEvent.create(command_event)
+    raw_data = command.raw_data
+
+    return [
+        ('parse', lambda: irc.parsemsg(irc.lowDequote(LINE))),
+        ('proxy', lambda: proxy_protocol.privmsg(USER, CHANNEL, MESSAGE)),
+        ('dispatch', lambda: bot.post_event(message_event)),
+        ('command_create',
+         lambda: events.CommandEvent.create(command_event)),
+        ('parse_arguments', lambda: parse_arguments(raw_data)),
+        ('reply', sent(lambda: command.reply(MESSAGE))),
+        ('end_to_end_message',
+         lambda: protocol.dataReceived(LINE + '\r\n')),
+        ('end_to_end_command',
+         sent(lambda: protocol.dataReceived(COMMAND_LINE + '\r\n'))),
+    ]
+
+
+def measure(op, n, repeat):
+    """Get the best rate of *op* over *repeat* runs of *n* calls."""
+    best = 0.0
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(n):
+            op()
+        elapsed = time.time() - start
+        best = max(best, n / elapsed if elapsed > 0 else float('inf'))
+    return best
+
+
+def count_instances(op, n):
+    """Get the number of instances of Python classes created per call of
+    *op*, averaged over *n* calls, and the number of each class by name.
+
+    A call of the ``__init__`` or ``__new__`` that a class uses, rather than
+    of a base class's through it, counts as creating an instance, so classes
+    with neither written in Python aren't counted.  Nor are built-in objects
+    like strings and dicts: CPython 2 has no count of allocations, and the
+    garbage collector's counts are net of objects freed, so they come out as
+    0 for anything that doesn't leak.
+    """
+    created = collections.Counter()
+
+    def profile(frame, event, arg):
+        code = frame.f_code
+        if (event != 'call' or code.co_argcount == 0 or
+                code.co_name not in ('__init__', '__new__')):
+            return
+        first = frame.f_locals.get(code.co_varnames[0])
+        cls = first if code.co_name == '__new__' else type(first)
+        method = getattr(cls, code.co_name, None)
+        method = getattr(method, 'im_func', method)
+        if getattr(method, 'func_code', None) is code:
+            created[cls.__name__] += 1
+
+    sys.setprofile(profile)
+    try:
+        for _ in xrange(n):
+            op()
+    finally:
+        sys.setprofile(None)
+    return (sum(created.itervalues()) / float(n),
+            dict((name, count / float(n))
+                 for name, count in created.iteritems()))
+
+
+def run(n, repeat, only=None):
+    results = dict()
+    for name, op in stages():
+        if only and name not in only:
+            continue
+        ops = measure(op, n, repeat)
+        # Profiling is slow, and the count is the same every call
+        instances, by_class = count_instances(op, min(n, 1000))
+        results[name] = {'ops_per_sec': ops, 'instances_per_op': instances,
+                         'instances_by_class': by_class}
+        report(name, ops, 'ops/sec   {:.2f} instances/op'.format(instances))
+    return {
+        'python': platform.python_version(),
+        'n': n,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print a comparison of *current* results with *baseline*, returning
+    the names of stages that regressed by more than *threshold* (a
+    fraction).
+    """
+    regressions = []
+    print
+    print '{:<24} {:>14} {:>14} {:>8}'.format('stage', 'baseline',
+                                               'current', 'change')
+    for name, result in sorted(current['results'].iteritems()):
+        base = baseline['results'].get(name)
+        if base is None:
+            print '{:<24} {:>14} {:>14,.0f}'.format(name, '-',
+                                                    result['ops_per_sec'])
+            continue
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        # Baselines saved before instances were counted don't have them
+        base_instances = base.get('instances_per_op')
+        if (base_instances is not None and
+                result['instances_per_op'] > base_instances + 0.5):
+            regressions.append(name)
+            flag += '  INSTANCES'
+        print '{:<24} {:>14,.0f} {:>14,.0f} {:>+7.1%}{}'.format(
+            name, base['ops_per_sec'], result['ops_per_sec'], change, flag)
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=20000,
+                        help='Operations per run [default: %(default)s]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs per stage [default: %(default)s]')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Save results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown counted as a regression '
+                             '[default: %(default)s]')
+    parser.add_argument('stages', nargs='*',
+                        help='Stages to run [default: all]')
+    args = parser.parse_args(argv[1:])
+
+    current = run(args.n, args.repeat, args.stages)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print
+            print 'Regressed: ' + ', '.join(sorted(set(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
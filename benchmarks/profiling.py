@@ -0,0 +1,34 @@
+"""Profiling overhead benchmark.
+
+Measures how many events per second :meth:`.Bot.fire_hooks` dispatches to
+ten plugins that hook them, without profiling, while timing handlers (see
+:mod:`csbot.profiling`), and while profiling everything with
+:mod:`cProfile`::
+
+    python -m benchmarks.profiling 200000
+"""
+import sys
+
+from csbot.events import event_class
+from benchmarks.common import make_bot, make_plugin, rate, report
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 200000
+    bot = make_bot([make_plugin('Plugin{}'.format(i), hooks=['userJoined'])
+                    for i in xrange(10)])
+    UserJoined = event_class('userJoined', ('user', 'channel'))
+    event = UserJoined(bot, None, 'nick', '#cs-york')
+    fire = lambda: bot.fire_hooks(event)
+
+    report('not profiling', rate(fire, n), 'events/sec')
+    bot.start_profiling()
+    report('timing handlers', rate(fire, n), 'events/sec')
+    bot.stop_profiling()
+    bot.start_profiling(deterministic=True)
+    report('cProfile', rate(fire, n), 'events/sec')
+    bot.stop_profiling()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,70 @@
+"""Command rate limiting benchmark.
+
+Measures how many commands per second :meth:`.Bot.fire_command` can handle
+without limits, and with a :class:`.CommandLimiter` when:
+
+- a few users stay within their limits
+- one user floods, so almost every command is dropped
+- every command comes from a new hostmask, so the limiter's LRU of users
+  is constantly evicting
+
+The memory used by the limiter stays flat in the last case, since it keeps at
+most ``command_limit_users`` users.
+"""
+import sys
+import itertools
+
+from twisted.internet import task
+
+from csbot.core import Bot
+from csbot.ratelimit import CommandLimiter
+from benchmarks.common import make_plugin, rate, report
+
+
+class Command(object):
+    def __init__(self, user):
+        self.command = 'seen'
+        self.user = user
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 200000
+    bot = Bot('benchmark.cfg')
+    bot.discover_plugins = lambda: {'seen': make_plugin('Seen',
+                                                        commands=['seen'])}
+    bot.load_plugin('seen')
+    clock = task.Clock()
+
+    def limiter():
+        return CommandLimiter(1000, 1000, max_users=1000, clock=clock)
+
+    users = ['nick{}!~user@host'.format(i) for i in xrange(10)]
+    cycle = itertools.cycle(users).next
+    report('no limits', rate(lambda: bot.fire_command(Command(cycle())), n),
+           'commands/sec')
+
+    bot.command_limiter = limiter()
+
+    def within():
+        # Enough time passes for every command to be allowed
+        clock.advance(0.01)
+        bot.fire_command(Command(cycle()))
+    report('limited, within limits', rate(within, n), 'commands/sec')
+
+    bot.command_limiter = limiter()
+    report('limited, one user flooding',
+           rate(lambda: bot.fire_command(Command(users[0])), n),
+           'commands/sec')
+    report('  dropped', bot.command_limiter.stats()['dropped'], 'commands')
+
+    bot.command_limiter = limiter()
+    counter = itertools.count().next
+    report('limited, new user every time',
+           rate(lambda: bot.fire_command(
+               Command('nick{}!~user@host'.format(counter()))), n),
+           'commands/sec')
+    report('  users tracked', bot.command_limiter.stats()['users'], 'users')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
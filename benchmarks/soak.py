@@ -0,0 +1,225 @@
+"""End-to-end soak test against a fake IRC server.
+
+Starts a :class:`.fakeircd.FakeIRCServer` on loopback and runs the real bot
+(``run_csbot.py``) in a subprocess connected to it, with in-memory storage.
+Every ``--interval`` seconds it reports:
+
+- the rate of lines sent to and received from the bot
+- command reply latency as seen by the simulated clients
+- replies still missing after ``--reply-timeout`` seconds
+- the bot's resident memory
+- how many times the bot has reconnected
+
+With ``--disconnect-every`` the server drops the bot's connection
+periodically, and the time taken to reconnect is reported too.  The run
+lasts for ``--duration`` seconds; it can be hours.  ``--output`` saves the
+time series and summary as JSON::
+
+    python -m benchmarks.soak --duration 3600 --output soak.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+
+from twisted.internet import reactor, task
+
+from csbot.replay import percentile
+from benchmarks.fakeircd import FakeIRCServer
+
+
+BOT_CONFIG = """
+[DEFAULT]
+irc_host = 127.0.0.1
+irc_port = {port}
+channels = {channels}
+plugins = {plugins}
+lineRate = {line_rate}
+mongodb_host = :memory:
+keyvalstore = {dir}/keyval.db
+keyvalfile = {dir}/keyval.cfg
+"""
+
+
+def rss_kib(pid):
+    """Get the resident set size of process *pid* in KiB, or None."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+class Soak(object):
+    def __init__(self, args):
+        self.args = args
+        self.server = FakeIRCServer(
+            args.clients, args.channels,
+            dict((action, getattr(args, action + '_rate'))
+                 for action in FakeIRCServer.ACTIONS),
+            seed=args.seed)
+        self.samples = []
+        self.all_latencies = []
+        self.started = None
+        self.last = None
+        self.bot = None
+        self.dir = tempfile.mkdtemp()
+
+    def start(self):
+        port = reactor.listenTCP(0, self.server, interface='127.0.0.1')
+        config = os.path.join(self.dir, 'soak.cfg')
+        with open(config, 'w') as f:
+            f.write(BOT_CONFIG.format(
+                port=port.getHost().port,
+                channels=' '.join(self.server.channels),
+                plugins=self.args.plugins,
+                line_rate=self.args.line_rate,
+                dir=self.dir))
+        log = open(self.args.bot_log or os.devnull, 'w')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.bot = subprocess.Popen(
+            [sys.executable, os.path.join(root, 'run_csbot.py'),
+             '-c', config],
+            stdout=log, stderr=subprocess.STDOUT, cwd=root)
+
+        self.started = self.last = time.time()
+        self.last_lines = (0, 0)
+        self.server.start()
+        task.LoopingCall(self.sample).start(self.args.interval, now=False)
+        if self.args.disconnect_every:
+            task.LoopingCall(self.server.disconnect).start(
+                self.args.disconnect_every, now=False)
+        reactor.callLater(self.args.duration, self.finish)
+
+        print ('{:>8} {:>9} {:>9} {:>7} {:>9} {:>9} {:>9} {:>7} {:>10} '
+               '{:>5}').format('time', 'in/s', 'out/s', 'replies', 'p50 ms',
+                               'p99 ms', 'max ms', 'missing', 'rss KiB',
+                               'conns')
+
+    def sample(self):
+        if self.bot.poll() is not None:
+            print 'Bot exited with status {}'.format(self.bot.returncode)
+            self.finish()
+            return
+
+        now = time.time()
+        elapsed = now - self.last
+        self.last = now
+        latencies = sorted(self.server.take_latencies())
+        self.all_latencies.extend(latencies)
+        lines = (self.server.lines_out, self.server.lines_in)
+        sample = {
+            'time': now - self.started,
+            'to_bot_rate': (lines[0] - self.last_lines[0]) / elapsed,
+            'from_bot_rate': (lines[1] - self.last_lines[1]) / elapsed,
+            'replies': len(latencies),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': percentile(latencies, 100),
+            'missing': self.server.missing_replies(self.args.reply_timeout),
+            'rss_kib': rss_kib(self.bot.pid),
+            'connections': self.server.connections,
+        }
+        self.last_lines = lines
+        self.samples.append(sample)
+        print ('{time:>8.0f} {to_bot_rate:>9.1f} {from_bot_rate:>9.1f} '
+               '{replies:>7} {p50:>9.1f} {p99:>9.1f} {max:>9.1f} '
+               '{missing:>7} {rss_kib:>10} {connections:>5}').format(
+                   p50=sample['latency_p50'] * 1000,
+                   p99=sample['latency_p99'] * 1000,
+                   max=sample['latency_max'] * 1000,
+                   **sample)
+        sys.stdout.flush()
+
+    def summary(self):
+        latencies = sorted(self.all_latencies)
+        rss = [s['rss_kib'] for s in self.samples if s['rss_kib']]
+        hours = (self.samples[-1]['time'] / 3600.0) if self.samples else 0
+        reconnects = self.server.reconnect_times
+        return {
+            'duration': time.time() - self.started,
+            'actions': dict(self.server.actions),
+            'commands': self.server.next_token,
+            'replies': len(latencies),
+            'missing': self.server.missing_replies(self.args.reply_timeout),
+            'latency': dict((p, percentile(latencies, p))
+                            for p in (50, 90, 99, 100)),
+            'rss_start_kib': rss[0] if rss else None,
+            'rss_end_kib': rss[-1] if rss else None,
+            'rss_max_kib': max(rss) if rss else None,
+            'rss_growth_kib_per_hour': ((rss[-1] - rss[0]) / hours
+                                        if len(rss) > 1 and hours else None),
+            'connections': self.server.connections,
+            'reconnect_mean': (sum(reconnects) / len(reconnects)
+                               if reconnects else None),
+            'reconnect_max': max(reconnects) if reconnects else None,
+        }
+
+    def finish(self):
+        self.server.stop()
+        if self.bot.poll() is None:
+            # The bot stops its reactor and tears down cleanly on SIGTERM
+            self.bot.send_signal(signal.SIGTERM)
+        if reactor.running:
+            reactor.stop()
+
+    def run(self):
+        self.start()
+        reactor.run()
+        for _ in xrange(50):
+            if self.bot.poll() is not None:
+                break
+            time.sleep(0.1)
+        else:
+            self.bot.kill()
+
+        summary = self.summary()
+        print
+        for key in sorted(summary):
+            print '{:<26} {}'.format(key, summary[key])
+        if self.args.output:
+            with open(self.args.output, 'w') as f:
+                json.dump({'summary': summary, 'samples': self.samples}, f,
+                          indent=2, sort_keys=True)
+        shutil.rmtree(self.dir)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add = parser.add_argument
+    add('--clients', type=int, default=300, help='Simulated users')
+    add('--channels', type=int, default=20, help='Channels')
+    add('--chat-rate', type=float, default=20, help='Messages/sec')
+    add('--command-rate', type=float, default=1, help='Commands/sec')
+    add('--join-rate', type=float, default=2, help='Joins/sec')
+    add('--part-rate', type=float, default=1, help='Parts/sec')
+    add('--quit-rate', type=float, default=0.5, help='Quits/sec')
+    add('--rename-rate', type=float, default=0.5, help='Nick changes/sec')
+    add('--duration', type=float, default=60, help='Seconds to run for')
+    add('--interval', type=float, default=10,
+        help='Seconds between reports')
+    add('--reply-timeout', type=float, default=10,
+        help='Seconds before a reply counts as missing')
+    add('--disconnect-every', type=float, default=0,
+        help='Seconds between dropping the connection, 0 for never')
+    add('--line-rate', type=float, default=0,
+        help="Bot's lineRate setting, 0 for no limit")
+    add('--plugins', default='example users tell', help='Plugins to load')
+    add('--bot-log', metavar='FILE', help="Save the bot's output")
+    add('--output', metavar='FILE', help='Save results as JSON')
+    add('--seed', type=int, help='Random seed for the simulation')
+    args = parser.parse_args(argv[1:])
+
+    Soak(args).run()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
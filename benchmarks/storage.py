@@ -0,0 +1,74 @@
+"""Reactor stall benchmark for database access.
+
+Issues a stream of queries against a :mod:`.memorydb` connection with
+simulated server latency, once with the synchronous :attr:`.Plugin.db` and
+once with :attr:`.Plugin.async_db`, while a 1ms heartbeat measures how long
+the reactor goes without running.
+"""
+import sys
+import time
+
+from twisted.internet import reactor, task, defer
+
+from csbot.memorydb import Connection
+from csbot.storage import StoragePool, AsyncDatabase
+from benchmarks.common import report
+
+
+def measure(run_query, n, interval):
+    """Run *n* queries, one every *interval* seconds, returning the longest
+    and mean gap between reactor heartbeats in seconds.
+    """
+    gaps = []
+    last = [time.time()]
+
+    def heartbeat():
+        now = time.time()
+        gaps.append(now - last[0])
+        last[0] = now
+    beat = task.LoopingCall(heartbeat)
+    beat.start(0.001)
+
+    queries = []
+    for i in xrange(n):
+        d = task.deferLater(reactor, i * interval, run_query)
+        queries.append(d)
+
+    d = defer.gatherResults(queries)
+    d.addCallback(lambda _: beat.stop())
+    d.addCallback(lambda _: reactor.stop())
+    reactor.run()
+    return max(gaps), sum(gaps) / len(gaps)
+
+
+def main(argv):
+    n = int(argv[1])
+    latency = float(argv[2])
+    mode = argv[3]
+
+    connection = Connection(latency=latency)
+    db = connection['csbot__benchmark']
+    db.messages.insert([{'to': 'nick{}'.format(i)} for i in xrange(100)])
+    adb = AsyncDatabase(db, StoragePool(4))
+
+    if mode == 'sync':
+        worst, mean = measure(lambda: db.messages.find_one({'to': 'nick1'}),
+                              n, 0.005)
+    else:
+        worst, mean = measure(lambda: adb.messages.find_one({'to': 'nick1'}),
+                              n, 0.005)
+        adb.pool.stop()
+    report('{} longest reactor stall'.format(mode), worst * 1000, 'ms')
+    report('{} mean heartbeat gap'.format(mode), mean * 1000, 'ms')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        main(sys.argv)
+    else:
+        # The reactor can't be restarted, so each mode runs in its own process
+        import subprocess
+        args = (sys.argv[1:] + ['200', '0.02'][len(sys.argv) - 1:])[:2]
+        for mode in ('sync', 'async'):
+            subprocess.check_call([sys.executable, '-m', 'benchmarks.storage']
+                                  + args + [mode])
@@ -0,0 +1,160 @@
+"""In-process versus worker process plugin dispatch benchmark.
+
+Runs the example plugin first loaded into the bot and then in a worker
+process (see :mod:`csbot.workers`), and feeds a :class:`.BotProtocol`
+connected to a fake transport with:
+
+- lines of chat, which the plugin hooks, timing how long the bot takes to
+  dispatch them (a worker plugin handles them later, in the worker)
+- ``!test`` commands, timing until the bot has sent every reply
+
+It also times how long a killed worker takes to be restarted and answer a
+command again, including :attr:`.Worker.RESTART_DELAY`::
+
+    python -m benchmarks.workers -n 20000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from twisted.internet import reactor, defer, task
+
+from csbot.core import Bot, BotProtocol
+from csbot.replay import SinkTransport
+from benchmarks.common import report
+
+
+CONFIG = """
+[DEFAULT]
+plugins = example
+worker_plugins = {worker_plugins}
+channels = #cs-york
+lineRate = 0
+mongodb_host = :memory:
+mongodb_threads = 0
+keyvalstore = {dir}/keyval.db
+keyvalfile = {dir}/keyval.cfg
+"""
+
+USER = 'nick!~user@host.example.com'
+CHAT = ':{} PRIVMSG #cs-york :has anybody seen the lecture notes?'.format(
+    USER)
+COMMAND = ':{} PRIVMSG #cs-york :!test {{}}'.format(USER)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send the bot's output, e.g. the example plugin printing every
+    message, to /dev/null.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout = sys.__stdout__
+
+
+def make_protocol(tmp, worker):
+    path = os.path.join(tmp, 'csbot.cfg')
+    with open(path, 'w') as f:
+        f.write(CONFIG.format(worker_plugins='example' if worker else '',
+                              dir=tmp))
+    bot = Bot(path)
+    bot.setup()
+    p = BotProtocol(bot)
+    with quiet():
+        p.makeConnection(SinkTransport())
+    return p
+
+
+def until(condition):
+    """Get a Deferred that fires once *condition()* is true."""
+    def check():
+        if condition():
+            loop.stop()
+    loop = task.LoopingCall(check)
+    return loop.start(0.001)
+
+
+def replies(p):
+    return p.transport.commands['PRIVMSG']
+
+
+def feed(p, lines):
+    with quiet():
+        start = time.time()
+        for line in lines:
+            p.lineReceived(line)
+        return time.time() - start
+
+
+@defer.inlineCallbacks
+def run(n, tmp):
+    commands = [COMMAND.format(i) for i in xrange(n)]
+
+    p = make_protocol(tmp, worker=False)
+    report('in-process chat dispatch', n / feed(p, [CHAT] * n), 'lines/sec')
+    report('in-process commands', n / feed(p, commands), 'commands/sec')
+    p.bot.teardown(save_config=False)
+
+    # Workers' output goes to our stderr, and would be flooded by the example
+    # plugin printing every message
+    stderr = os.dup(2)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+    try:
+        yield run_worker(n, tmp, commands)
+    finally:
+        os.dup2(stderr, 2)
+
+
+@defer.inlineCallbacks
+def run_worker(n, tmp, commands):
+    p = make_protocol(tmp, worker=True)
+    worker = p.bot.workers.workers[0]
+    # Wait for the worker to start up
+    feed(p, [COMMAND.format('warmup')])
+    yield until(lambda: replies(p) == 1)
+
+    report('worker chat dispatch (bot side)', n / feed(p, [CHAT] * n),
+           'lines/sec')
+    start = time.time()
+    feed(p, commands)
+    yield until(lambda: replies(p) == n + 1)
+    report('worker commands', n / (time.time() - start), 'commands/sec')
+
+    start = time.time()
+    worker.transport.signalProcess('KILL')
+    yield until(lambda: worker.restarts and worker.running)
+    feed(p, [COMMAND.format('restarted')])
+    yield until(lambda: replies(p) == n + 2)
+    report('worker restart', (time.time() - start) * 1000, 'ms')
+
+    yield p.bot.workers.stop()
+    p.bot.teardown(save_config=False)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=10000,
+                        help='Lines per measurement [default: %(default)s]')
+    args = parser.parse_args(argv[1:])
+
+    tmp = tempfile.mkdtemp()
+
+    def done(result):
+        reactor.stop()
+        return result
+
+    reactor.callWhenRunning(lambda: run(args.n, tmp).addBoth(done))
+    try:
+        reactor.run()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,184 @@
+"""Caching of command replies.
+
+A command whose answer only depends on its arguments, and which is often
+asked several times in quick succession, can opt in to having its replies
+cached::
+
+    @features.command('seen', cache=CachePolicy(ttl=30))
+    def seen(self, event):
+        ...
+
+The first time the command is run its replies are recorded, and until they
+expire the same replies are sent for the same command without calling the
+handler.  Replies are addressed to whoever asked each time.  Only replies
+sent with :meth:`.CommandEvent.reply` or :meth:`~.CommandEvent.error` are
+recorded, so a command which does anything else, e.g. changes some state or
+sends private messages, shouldn't be cached.
+
+Plugins should call :meth:`.Plugin.invalidate_cache` when something a cached
+answer depends on changes.  Replaying cached replies takes a few
+microseconds, so caching is only worthwhile for commands whose answers take
+longer than that to work out, e.g. ``!plugins.available``.
+"""
+import collections
+
+from twisted.internet import reactor, defer
+
+from csbot.util import LRUCache
+
+
+class CachePolicy(object):
+    """How the replies to a command are cached.
+
+    Replies are kept for *ttl* seconds, for up to *max_size* different
+    questions.  A question is the command's :attr:`~.CommandEvent.raw_data`,
+    with runs of whitespace collapsed, and the network it was asked on; if
+    *per_channel* is True the channel is part of the question too, for
+    answers that depend on the channel.
+    """
+    def __init__(self, ttl, max_size=100, per_channel=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.per_channel = per_channel
+
+    def key(self, command):
+        """Get the cache key for *command*, as the normalised ``raw_data``
+        and the rest of the key.
+        """
+        protocol = command.protocol
+        network = protocol.network.name if protocol is not None else None
+        return (normalise(command.raw_data),
+                (network,
+                 command.channel.lower() if self.per_channel else None))
+
+
+def normalise(raw_data):
+    """Collapse runs of whitespace in *raw_data*.
+
+    >>> normalise('  alan   bob ')
+    'alan bob'
+    """
+    return ' '.join(raw_data.split())
+
+
+class Entry(object):
+    """The recorded replies to a command, and when they expire."""
+    __slots__ = ('replies', 'expires')
+
+    def __init__(self, expires):
+        #: (message, is_verbose) pairs
+        self.replies = []
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """Cached replies of the commands which have a :class:`CachePolicy`.
+
+    *clock* provides ``seconds()``, and is normally the reactor.
+    """
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        # Command name -> LRUCache of normalised raw_data -> {rest of the
+        # key -> Entry}, so that everything for some raw_data can be
+        # invalidated at once
+        self.commands = dict()
+        # Command name -> number of invalidations, so that replies recorded
+        # from before one aren't cached
+        self.generations = collections.Counter()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the counters reported by :meth:`stats`."""
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    def entries(self, name, policy):
+        entries = self.commands.get(name)
+        if entries is None or entries.maxsize != policy.max_size:
+            entries = self.commands[name] = LRUCache(policy.max_size)
+        return entries
+
+    def dispatch(self, command, handler, policy):
+        """Send the cached replies to *command* if there are any, and
+        otherwise call *handler* with it, recording its replies.
+        """
+        entries = self.entries(command.command, policy)
+        raw_data, rest = policy.key(command)
+        now = self.clock.seconds()
+        variants = entries.get(raw_data)
+        entry = variants.get(rest) if variants is not None else None
+        if entry is not None:
+            if entry.expires > now:
+                self.hits += 1
+                for msg, is_verbose in entry.replies:
+                    command.reply(msg, is_verbose)
+                return
+            del variants[rest]
+            self.expired += 1
+
+        self.misses += 1
+        entry = Entry(now + policy.ttl)
+        command.recorder = entry.replies
+        generation = self.generations[command.command]
+        result = handler(command)
+        if isinstance(result, defer.Deferred):
+            # The replies aren't complete until the Deferred fires
+            def done(result):
+                if self.generations[command.command] == generation:
+                    self.store(entries, raw_data, rest, entry)
+                return result
+            result.addCallback(done)
+        else:
+            self.store(entries, raw_data, rest, entry)
+
+    def store(self, entries, raw_data, rest, entry):
+        variants = entries.get(raw_data)
+        if variants is None:
+            variants = entries[raw_data] = dict()
+        variants[rest] = entry
+
+    def invalidate(self, name, raw_data=None):
+        """Forget the cached replies to command *name*, either all of them
+        or only those for *raw_data*.
+        """
+        entries = self.commands.get(name)
+        if entries is None:
+            return
+        self.generations[name] += 1
+        if raw_data is None:
+            self.invalidated += sum(len(v) for v in entries.values())
+            entries.clear()
+            return
+        variants = entries.get(normalise(raw_data))
+        if variants is not None:
+            self.invalidated += len(variants)
+            del entries[normalise(raw_data)]
+
+    def clear(self):
+        """Forget every cached reply."""
+        for name in self.commands.keys():
+            self.invalidate(name)
+
+    def stats(self):
+        """Get a dictionary of counters.
+
+        ``hits`` and ``misses`` count commands answered from the cache and
+        not, since the last :meth:`reset_stats`.  ``expired`` and
+        ``invalidated`` count entries thrown away, and ``evicted`` the
+        questions whose entries were forgotten to make room.  ``entries`` is
+        the number of cached entries and ``commands`` maps each command to
+        its number.
+        """
+        sizes = dict((name, sum(len(v) for v in entries.values()))
+                     for name, entries in self.commands.iteritems())
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'invalidated': self.invalidated,
+            'evicted': sum(e.evictions for e in self.commands.itervalues()),
+            'entries': sum(sizes.itervalues()),
+            'commands': sizes,
+        }
@@ -0,0 +1,238 @@
+"""Who is in which channel.
+
+Each :class:`.BotProtocol` keeps a :class:`ChannelState`, as its
+:attr:`~.BotProtocol.channels` attribute, which is kept up to date from
+``NAMES``, ``JOIN``, ``PART``, ``QUIT``, ``KICK``, ``NICK`` and ``MODE``
+messages before any hooks are fired for them.  Plugins can use it to find
+out who is in a channel, what channels a nick is in, and which channel
+modes (e.g. ``o`` for operators) they have, but must treat it as read-only::
+
+    >>> state = ChannelState()
+    >>> state.joined('#cs-york', 'csyorkbot')
+    >>> state.set_names('#cs-york', [('Alan', 'o'), ('bob', '')])
+    >>> 'alan' in state['#CS-York'], state['#cs-york'].modes('Alan')
+    (True, 'o')
+    >>> state.channels_of('bob')
+    ('#cs-york',)
+
+Nicks and channel names are compared case-insensitively, using the RFC 1459
+rules that IRC servers use.  Every lookup is a dictionary lookup, and each
+change only touches the entries for the nicks and channels involved, so even
+a channel with tens of thousands of users costs nothing extra per message.
+To keep the memory used down, each nick's case-folded form is interned, so
+that there is only one copy of it however many channels it's in, and a
+member's modes are a short string shared by everyone with the same modes.
+"""
+import string
+
+
+#: Translation table for :func:`irc_lower`
+RFC1459_LOWER = string.maketrans(string.ascii_uppercase + '[]\\~',
+                                 string.ascii_lowercase + '{}|^')
+
+
+def irc_lower(name):
+    """Case-fold a nick or channel name like IRC servers do.
+
+    >>> irc_lower('Alan[m]')
+    'alan{m}'
+    """
+    return name.translate(RFC1459_LOWER)
+
+
+class Channel(object):
+    """The members of a channel, and their modes.
+
+    Supports ``len()``, ``in`` and iterating over the members' nicks.
+    """
+    __slots__ = ('name', 'key', 'members', 'nicks')
+
+    def __init__(self, name, nicks):
+        #: The channel's name, as we joined it
+        self.name = name
+        # The case-folded name, shared by every nick's set of channels
+        self.key = intern(irc_lower(name))
+        # Case-folded nick -> mode characters
+        self.members = dict()
+        # The ChannelState's case-folded nick -> nick
+        self.nicks = nicks
+
+    def __repr__(self):
+        return '<Channel {} ({} members)>'.format(self.name,
+                                                  len(self.members))
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, nick):
+        return irc_lower(nick) in self.members
+
+    def __iter__(self):
+        nicks = self.nicks
+        return (nicks[key] for key in self.members)
+
+    def modes(self, nick):
+        """Get the mode characters that *nick* has in the channel, e.g.
+        ``'o'`` or ``'ov'``, raising :exc:`KeyError` if they aren't in it.
+        """
+        return self.members[irc_lower(nick)]
+
+    def has_mode(self, nick, mode):
+        """Check if *nick* is in the channel with *mode*."""
+        return mode in self.members.get(irc_lower(nick), '')
+
+
+class ChannelState(object):
+    """The channels the bot is in, and who is in them.
+
+    Index it with a channel name to get a :class:`Channel`, iterate over it
+    for the channels, or use :meth:`channels_of` to find a nick's channels.
+    The other methods update the state as messages arrive, and are called by
+    :class:`.BotProtocol`.
+    """
+    def __init__(self):
+        # Case-folded channel name -> Channel
+        self.channels = dict()
+        # Case-folded nick -> nick, for everyone we share a channel with
+        self.nicks = dict()
+        # Case-folded nick -> set of case-folded channel names
+        self.nick_channels = dict()
+        # Mode strings, so that everyone with the same modes shares one
+        self.mode_strings = dict()
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, channel):
+        return irc_lower(channel) in self.channels
+
+    def __getitem__(self, channel):
+        return self.channels[irc_lower(channel)]
+
+    def __iter__(self):
+        return iter(self.channels.values())
+
+    def get(self, channel, default=None):
+        return self.channels.get(irc_lower(channel), default)
+
+    def channels_of(self, nick):
+        """Get the names of the channels that *nick* is in."""
+        keys = self.nick_channels.get(irc_lower(nick), ())
+        return tuple(self.channels[k].name for k in keys)
+
+    def modes_string(self, modes):
+        modes = ''.join(sorted(modes))
+        return self.mode_strings.setdefault(modes, modes)
+
+    def add(self, nick, channel, modes=''):
+        """Record *nick* as being in *channel* with *modes*."""
+        c = self.channels.get(irc_lower(channel))
+        if c is None:
+            return
+        key = intern(irc_lower(nick))
+        self.nicks[key] = nick
+        c.members[key] = self.modes_string(modes)
+        self.nick_channels.setdefault(key, set()).add(c.key)
+
+    def remove(self, nick, channel):
+        """Record *nick* as having left *channel*."""
+        channel_key = irc_lower(channel)
+        c = self.channels.get(channel_key)
+        if c is None:
+            return
+        key = irc_lower(nick)
+        if c.members.pop(key, None) is not None:
+            self.forget_membership(key, channel_key)
+
+    def forget_membership(self, key, channel_key):
+        """Remove *channel_key* from *key*'s channels, forgetting the nick
+        if it was the last one.
+        """
+        channels = self.nick_channels.get(key)
+        if channels is None:
+            return
+        channels.discard(channel_key)
+        if not channels:
+            del self.nick_channels[key]
+            del self.nicks[key]
+
+    def joined(self, channel, nickname):
+        """Record us, as *nickname*, having joined *channel*."""
+        key = irc_lower(channel)
+        if key not in self.channels:
+            self.channels[key] = Channel(channel, self.nicks)
+        self.add(nickname, channel)
+
+    def left(self, channel):
+        """Forget *channel* and everyone in it, because we left it."""
+        key = irc_lower(channel)
+        c = self.channels.pop(key, None)
+        if c is None:
+            return
+        for nick_key in c.members:
+            self.forget_membership(nick_key, key)
+
+    def quit(self, nick):
+        """Record *nick* as having quit, returning the names of the channels
+        they were in.
+        """
+        key = irc_lower(nick)
+        channel_keys = self.nick_channels.pop(key, ())
+        self.nicks.pop(key, None)
+        for channel_key in channel_keys:
+            del self.channels[channel_key].members[key]
+        return tuple(self.channels[k].name for k in channel_keys)
+
+    def rename(self, oldname, newname):
+        """Record *oldname* as now being *newname*, returning the names of
+        the channels they are in.
+        """
+        old_key = irc_lower(oldname)
+        channel_keys = self.nick_channels.pop(old_key, None)
+        if channel_keys is None:
+            return ()
+        del self.nicks[old_key]
+        new_key = intern(irc_lower(newname))
+        self.nicks[new_key] = newname
+        self.nick_channels[new_key] = channel_keys
+        for channel_key in channel_keys:
+            members = self.channels[channel_key].members
+            members[new_key] = members.pop(old_key)
+        return tuple(self.channels[k].name for k in channel_keys)
+
+    def set_names(self, channel, names):
+        """Replace *channel*'s members with *names*, a list of ``(nick,
+        modes)`` pairs from a ``NAMES`` reply.
+        """
+        key = irc_lower(channel)
+        c = self.channels.get(key)
+        if c is None:
+            return
+        old = c.members
+        c.members = dict()
+        for nick, modes in names:
+            self.add(nick, channel, modes)
+        for nick_key in old:
+            if nick_key not in c.members:
+                self.forget_membership(nick_key, key)
+
+    def set_mode(self, nick, channel, mode, on):
+        """Give *nick* *mode* in *channel* if *on* is True, and otherwise
+        take it away.
+        """
+        c = self.channels.get(irc_lower(channel))
+        key = irc_lower(nick)
+        if c is None or key not in c.members:
+            return
+        modes = set(c.members[key])
+        if on:
+            modes.add(mode)
+        else:
+            modes.discard(mode)
+        c.members[key] = self.modes_string(modes)
+
+    def clear(self):
+        """Forget everything, e.g. when the connection is lost."""
+        self.channels.clear()
+        self.nicks.clear()
+        self.nick_channels.clear()
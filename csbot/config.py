@@ -0,0 +1,102 @@
+"""Precomputed configuration views for plugins.
+
+Looking an option up in a :class:`~ConfigParser.ConfigParser` means checking
+sections and interpolating values every time.  A :class:`ConfigView` does all
+that once, when it is built, and is rebuilt by :meth:`.Bot.reload_config` when
+the configuration changes.
+"""
+import collections
+import ConfigParser
+
+
+def boolean(value):
+    """Convert a configuration string to a boolean, accepting the same
+    values as :meth:`ConfigParser.RawConfigParser.getboolean`.
+
+    >>> boolean('yes'), boolean('Off')
+    (True, False)
+    """
+    if isinstance(value, bool):
+        return value
+    try:
+        return ConfigParser.RawConfigParser._boolean_states[value.lower()]
+    except KeyError:
+        raise ValueError('Not a boolean: {}'.format(value))
+
+
+def words(value):
+    """Convert a configuration string to a list of whitespace-separated
+    words.
+
+    >>> words('#cs-york  #cs-york-dev')
+    ['#cs-york', '#cs-york-dev']
+    """
+    return value.split()
+
+
+class ConfigView(collections.Mapping):
+    """A read-only view of the options for *section* of *config*.
+
+    Options from *section* override those in the ``DEFAULT`` section.
+    *defaults* supplies values for options that are not in *section*, and
+    takes priority over ``DEFAULT``.  *types* maps option names to functions
+    that convert string values, e.g. :func:`int`, :func:`boolean` or
+    :func:`words`; a :exc:`ValueError` from a conversion is re-raised naming
+    the option.
+
+    Looking up a missing option raises :exc:`KeyError`.
+
+    >>> config = ConfigParser.SafeConfigParser({'lines': '5'})
+    >>> config.add_section('tell')
+    >>> config.set('tell', 'verbose', 'yes')
+    >>> view = ConfigView(config, 'tell', {'max': '3'},
+    ...                   {'lines': int, 'max': int, 'verbose': boolean})
+    >>> view['lines'], view['max'], view['verbose']
+    (5, 3, True)
+    """
+    def __init__(self, config, section, defaults=None, types=None):
+        types = types or dict()
+        values = dict()
+
+        for option in config.defaults():
+            values[option] = self._get(config, 'DEFAULT', option)
+        if defaults:
+            values.update(defaults)
+        if config.has_section(section):
+            # ConfigParser.options() includes DEFAULT, which mustn't override
+            # the plugin's own defaults, so look at the section alone
+            for option in config._sections[section]:
+                if option != '__name__':
+                    values[option] = self._get(config, section, option)
+
+        for option, convert in types.iteritems():
+            if isinstance(values.get(option), basestring):
+                try:
+                    values[option] = convert(values[option])
+                except ValueError as e:
+                    raise ValueError('{}.{}: {}'.format(section, option, e))
+
+        self.section = section
+        self.values = values
+
+    @staticmethod
+    def _get(config, section, option):
+        try:
+            return config.get(section, option)
+        except ConfigParser.InterpolationError:
+            return config.get(section, option, raw=True)
+
+    def __getitem__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            raise KeyError('{} is not a valid option.'.format(name))
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, name):
+        return name in self.values
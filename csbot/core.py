@@ -1,16 +1,27 @@
 from functools import wraps
 import types
+import importlib
 import ConfigParser
 import sys
+import os
 import collections
 
 from twisted.words.protocols import irc
-from twisted.internet import reactor, protocol
+from twisted.internet import reactor, protocol, task
 from twisted.python import log
-import straight.plugin
 import pymongo
 
 import csbot.events as events
+import csbot.outbound as outbound
+import csbot.storage as storage
+import csbot.memorydb as memorydb
+import csbot.keyval as keyval
+import csbot.config as config
+import csbot.filters as filters
+import csbot.ratelimit as ratelimit
+import csbot.cache as cache
+import csbot.channels as channels
+import csbot.profiling as profiling
 
 
 class Bot(object):
@@ -27,10 +38,15 @@ class Bot(object):
             'realname': 'cs-york bot',
             'sourceURL': 'http://github.com/csyork/csbot/',
             'lineRate': '1',
+            'lineBurst': '4',
             'keyvalfile': 'keyval.cfg',
+            'keyvalstore': 'keyval.db',
+            'keyval_sync_interval': '1',
+            'networks': 'default',
             'irc_host': 'irc.freenode.net',
             'irc_port': '6667',
             'command_prefix': '!',
+            'nick_aliases': '',
             'channels': ' '.join([
                 '#cs-york-dev',
             ]),
@@ -39,6 +55,18 @@ class Bot(object):
             ]),
             'mongodb_host': 'localhost',
             'mongodb_port': '27017',
+            'mongodb_threads': '4',
+            'mongodb_slow_query': '0.5',
+            'worker_plugins': '',
+            'plugin_workers': '1',
+            'plugin_watch_interval': '0',
+            'command_user_rate': '0',
+            'command_user_burst': '5',
+            'command_rate': '0',
+            'command_burst': '10',
+            'command_limit_users': '1000',
+            'command_limit_action': 'drop',
+            'command_limit_queue': '5',
     }
 
     #: The top-level package for all bot plugins
@@ -49,33 +77,167 @@ class Bot(object):
         self.configpath = configpath
         self.config = ConfigParser.SafeConfigParser(defaults=self.DEFAULTS,
                                                     allow_no_value=True)
-        self.config.read(self.configpath)
-
-        # Load plugin "key-value" store
-        self.plugindata = ConfigParser.SafeConfigParser(allow_no_value=True)
-        self.plugindata.read(self.config.get('DEFAULT', 'keyvalfile'))
-
-        # Make mongodb connection
-        self.mongodb = pymongo.Connection(
-                self.config.get('DEFAULT', 'mongodb_host'),
-                self.config.getint('DEFAULT', 'mongodb_port'))
+        self.read_config()
+
+        # Networks to connect to, by name
+        self.networks = collections.OrderedDict(
+                (name, Network(self, name))
+                for name in self.config.get('DEFAULT', 'networks').split())
+
+        # MongoDB connection and worker pool, created on first use
+        self.mongodb_ = None
+        self.storage_ = None
+        # Plugin key/value store, opened on first use
+        self.keyval_ = None
+        # Worker processes for plugins, started on first use
+        self.workers_ = None
+        # Connected protocol instances
+        self.protocols = set()
 
         self.plugins = dict()
         self.commands = dict()
+        # Plugin classes found by discover_plugins()
+        self.plugin_cache = PluginCache(self.PLUGIN_PACKAGE, Plugin)
+        # Plugin module name -> modification time of its source when it was
+        # last loaded, see reload_changed_plugins()
+        self.plugin_mtimes = dict()
+        # Polls for changed plugin source files, if enabled
+        self.plugin_watcher = None
+        # Hook dispatch index: event type -> list of bound handlers, see
+        # hooks_for()
+        self.hooks = dict()
+        # Event type -> filters.HookMatcher for hooks with filters
+        self.filtered_hooks = dict()
+        # Flood protection for commands, or None if there are no limits
+        self.command_limiter = self.make_command_limiter()
+        # Replies of commands with a cache policy
+        self.response_cache = cache.ResponseCache()
+        # Times handlers while profiling, see start_profiling()
+        self.profiler = None
 
         # Event queue
         self.events = collections.deque()
         # Are we currently processing the event queue?
         self.events_running = False
 
+    @property
+    def default_network(self):
+        """The first configured :class:`Network`."""
+        return next(self.networks.itervalues())
+
+    def read_config(self):
+        """Read the configuration file into :attr:`config`."""
+        self.config.read(self.configpath)
+
+    def reload_config(self):
+        """Re-read the configuration file.
+
+        Plugins' :attr:`~Plugin.config` views, network settings, the
+        command triggers and the command rate limits are rebuilt, including
+        in worker processes.  Other settings, e.g. the servers and the
+        outbound line rate, only take effect on restart, and networks can't
+        be added or removed.  Commands already deferred by the old rate
+        limits still run when those limits allow.
+        """
+        self.read_config()
+        for p in self.plugins.itervalues():
+            p.config_ = None
+        for network in self.networks.itervalues():
+            network.config_ = None
+        for p in self.protocols:
+            p.build_command_matcher()
+        self.command_limiter = self.make_command_limiter()
+        # Cached replies might depend on the old configuration
+        self.response_cache.clear()
+        if self.workers_ is not None:
+            self.workers_.reload_config()
+        self.log_msg('Reloaded configuration')
+
+    @property
+    def mongodb(self):
+        """The :class:`pymongo.Connection` used by plugins, connected on first
+        use.
+
+        If ``mongodb_host`` is ``:memory:`` then a :mod:`.memorydb` stand-in is
+        used instead, and nothing is persisted.
+        """
+        if self.mongodb_ is None:
+            host = self.config.get('DEFAULT', 'mongodb_host')
+            if host == ':memory:':
+                self.mongodb_ = memorydb.Connection()
+            else:
+                self.mongodb_ = pymongo.Connection(
+                        host, self.config.getint('DEFAULT', 'mongodb_port'))
+        return self.mongodb_
+
+    @property
+    def storage(self):
+        """The :class:`.StoragePool` that runs database operations for
+        :attr:`Plugin.async_db`, created on first use.
+        """
+        if self.storage_ is None:
+            self.storage_ = storage.StoragePool(
+                    self.config.getint('DEFAULT', 'mongodb_threads'),
+                    self.config.getfloat('DEFAULT', 'mongodb_slow_query'))
+        return self.storage_
+
+    @property
+    def keyval(self):
+        """The :class:`.keyval.LogStore` behind :meth:`Plugin.get` and
+        :meth:`Plugin.set`, opened on first use.
+
+        If the store doesn't exist yet, the contents of the old ``keyvalfile``
+        are imported into it.
+        """
+        if self.keyval_ is None:
+            path = self.config.get('DEFAULT', 'keyvalstore')
+            existed = os.path.exists(path)
+            self.keyval_ = keyval.LogStore(path)
+            if not existed:
+                old = ConfigParser.SafeConfigParser(allow_no_value=True)
+                if old.read(self.config.get('DEFAULT', 'keyvalfile')):
+                    self.keyval_.import_config(old)
+                    self.keyval_.sync()
+        return self.keyval_
+
+    @property
+    def workers(self):
+        """The :class:`.workers.WorkerPool` that runs the plugins named in
+        ``worker_plugins``, created on first use and stopped when the reactor
+        shuts down.
+        """
+        if self.workers_ is None:
+            import csbot.workers as workers
+            self.workers_ = workers.WorkerPool(
+                    self, self.config.getint('DEFAULT', 'plugin_workers'))
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                                          self.workers_.stop)
+        return self.workers_
+
     def setup(self):
         """Load plugins defined in configuration.
         """
-        map(self.load_plugin, self.config.get('DEFAULT', 'plugins').split())
-
-    def teardown(self):
+        # Sync plugin data to disk periodically
+        self.keyval.start(self.config.getfloat('DEFAULT',
+                                               'keyval_sync_interval'))
+        self.load_plugins(self.config.get('DEFAULT', 'plugins').split())
+
+        # Reload plugins when their source changes, if asked to
+        interval = self.config.getfloat('DEFAULT', 'plugin_watch_interval')
+        if interval > 0:
+            self.plugin_watcher = task.LoopingCall(
+                    self.reload_changed_plugins)
+            self.plugin_watcher.start(interval, now=False)
+
+    def teardown(self, save_config=True):
         """Unload plugins and save data.
+
+        The configuration file is rewritten with the currently loaded plugins,
+        unless *save_config* is False.
         """
+        if self.plugin_watcher is not None and self.plugin_watcher.running:
+            self.plugin_watcher.stop()
+
         # Save currently loaded plugins
         self.config.set('DEFAULT', 'plugins', ' '.join(self.plugins))
 
@@ -83,26 +245,36 @@ class Bot(object):
         for name in self.plugins.keys():
             self.unload_plugin(name)
 
-        # Save the plugin data
-        with open(self.config.get('DEFAULT', 'keyvalfile'), 'wb') as kvf:
-            self.plugindata.write(kvf)
+        # Stop database workers, now that nothing will use them
+        if self.storage_ is not None:
+            self.storage_.stop()
+
+        # Make sure the plugin data is on disk
+        if self.keyval_ is not None:
+            self.keyval_.close()
+            self.keyval_ = None
 
         # Save configuration
-        with open(self.configpath, 'wb') as cfg:
-            self.config.write(cfg)
+        if save_config:
+            with open(self.configpath, 'wb') as cfg:
+                self.config.write(cfg)
 
-    @classmethod
-    def discover_plugins(cls):
+    def discover_plugins(self):
         """Discover available plugins, returning a dictionary mapping from
         plugin name to plugin class.
+
+        Only new plugin modules are imported and scanned; modules that have
+        already been imported are not reloaded, see :class:`PluginCache`.
         """
-        plugins = straight.plugin.load(cls.PLUGIN_PACKAGE, subclasses=Plugin)
         available = dict()
 
         # Build dict of available plugins, error if there are multple plugins
-        # with the same name
-        for P in plugins:
-            if P.plugin_name() in available:
+        # with the same name.  A class imported into several modules is still
+        # the same plugin.
+        for P in self.plugin_cache.classes():
+            if available.get(P.plugin_name()) is P:
+                continue
+            elif P.plugin_name() in available:
                 existing = available[P.plugin_name()]
                 raise PluginError(('Duplicate plugin name: '
                         '{e.__module__}.{e.__name__} and '
@@ -125,13 +297,31 @@ class Bot(object):
 
         return self.plugins[name]
 
-    def load_plugin(self, name):
+    def load_plugins(self, names):
+        """Load several named plugins, discovering available plugins only
+        once.
+        """
+        available_plugins = self.discover_plugins()
+        for name in names:
+            self.load_plugin(name, available_plugins)
+
+    def is_worker_plugin(self, name):
+        """Check if the named plugin should run in a worker process, see
+        :mod:`.workers`.
+        """
+        return name in self.config.get('DEFAULT', 'worker_plugins').split()
+
+    def load_plugin(self, name, available_plugins=None):
         """Load a named plugin and register all of its commands.
 
         When a plugin is loaded, it is added to the bot, all of its defined
         commands are registered, and then its :meth:`~Plugin.setup` is run.
+        *available_plugins* is the result of :meth:`discover_plugins`, which
+        is called if it isn't given.  If :meth:`is_worker_plugin` says so, a
+        :class:`.workers.RemotePlugin` is loaded in place of the plugin.
         """
-        available_plugins = self.discover_plugins()
+        if available_plugins is None:
+            available_plugins = self.discover_plugins()
 
         if name not in available_plugins:
             raise PluginError('{} does not exist'.format(name))
@@ -139,8 +329,12 @@ class Bot(object):
         if name in self.plugins:
             raise PluginError('{} already loaded'.format(name))
 
-        p = available_plugins[name](self)
+        P = available_plugins[name]
+        if self.is_worker_plugin(name):
+            P = self.workers.remote_class(P)
+        p = P(self)
         self.plugins[name] = p
+        self.record_plugin_source(p.__module__)
         self.log_msg('Loaded plugin {}'.format(name))
 
         for command, handler in p.features.commands.iteritems():
@@ -151,6 +345,8 @@ class Bot(object):
                 self.log_msg('Registering command {}'.format(command))
                 self.commands[command] = handler
 
+        self.register_hooks(p)
+
         p.setup()
 
     def unload_plugin(self, name):
@@ -171,6 +367,9 @@ class Bot(object):
         for cmd in delcmds:
             self.log_msg('Unregistering command {}'.format(cmd))
             del self.commands[cmd]
+            self.response_cache.invalidate(cmd)
+
+        self.unregister_hooks(p)
 
         del self.plugins[name]
         self.log_msg('Unloaded plugin {}'.format(name))
@@ -178,24 +377,197 @@ class Bot(object):
     def reload_plugin(self, name):
         """Reload a named plugin, re-reading its source file.
 
-        Attempts to :func:`reload` the source file containing the named plugin
-        before unloading it and loading it again.
+        See :meth:`reload_plugins`.
         """
-        if name not in self.plugins:
-            raise PluginError('{} not loaded'.format(name))
+        self.reload_plugins([name])
+
+    def reload_plugins(self, names):
+        """Reload several named plugins, re-reading the source file of each
+        of their modules once.
+
+        Only the plugins' own modules are reloaded.  Each plugin is replaced
+        by a new instance of its class from the reloaded module: the new
+        instance is set up first, given the old one's state if it hands any
+        over (see :meth:`Plugin.snapshot`), and then the old instance's
+        commands and hooks are swapped for the new one's in one step, so
+        every event is handled by one or the other.
+
+        If anything goes wrong a :exc:`PluginError` is raised, and plugins
+        that haven't been replaced yet are left running as they were.
+        """
+        modules = collections.OrderedDict()
+        for name in names:
+            if name not in self.plugins:
+                raise PluginError('{} not loaded'.format(name))
+            modules.setdefault(self.plugins[name].__module__, []).append(name)
+
+        for module_name, module_plugins in modules.iteritems():
+            try:
+                classes = self.plugin_cache.reload(module_name)
+            except Exception as e:
+                raise PluginError('reload failed', e)
+            self.record_plugin_source(module_name)
+            available = dict((P.plugin_name(), P) for P in classes)
+            for name in module_plugins:
+                self.replace_plugin(name, available)
+
+    def replace_plugin(self, name, available_plugins):
+        """Replace the loaded plugin *name* with a new instance of its class
+        from *available_plugins*, see :meth:`reload_plugins`.
+        """
+        old = self.plugins[name]
+        if name not in available_plugins:
+            raise PluginError('{} does not exist'.format(name))
+        P = available_plugins[name]
+        if self.is_worker_plugin(name):
+            P = self.workers.remote_class(P)
+
+        for command in P.features.commands:
+            if (command in self.commands and
+                    self.commands[command].im_self is not old):
+                raise PluginError('{} command already provided by {}'.format(
+                    command, self.commands[command].im_class.plugin_name()))
 
-        # Reload the module this plugin came from, so that the next call to
-        # discover_plugins() will get the newest code
-        p = self.plugins[name]
         try:
-            reload(sys.modules[p.__module__])
+            state = old.snapshot()
+            p = P(self)
+            if state is None:
+                p.setup()
+            else:
+                p.restore(state)
         except Exception as e:
-            raise PluginError('reload failed', e)
+            raise PluginError('{} failed to start'.format(name), e)
+
+        # Build the new command table and hook index, then swap them in
+        # together
+        commands = dict((c, h) for c, h in self.commands.iteritems()
+                        if h.im_self is not old)
+        commands.update(p.features.commands)
+        hooks, filtered_hooks = self.build_hook_index(remove=old, add=p)
+        self.commands, self.hooks, self.filtered_hooks = \
+            commands, hooks, filtered_hooks
+        for command in old.features.commands:
+            self.response_cache.invalidate(command)
+        self.plugins[name] = p
+        self.log_msg('Reloaded plugin {}'.format(name))
+
+        # A plugin that handed its state over has nothing left to tear down
+        if state is None:
+            try:
+                old.teardown()
+            except Exception:
+                log.err(None, 'Error tearing down old {} plugin'.format(name))
+
+    def record_plugin_source(self, module_name):
+        """Remember the modification time of a plugin module's source, see
+        :meth:`reload_changed_plugins`.
+        """
+        try:
+            self.plugin_mtimes[module_name] = os.stat(
+                    source_file(sys.modules[module_name])).st_mtime
+        except (KeyError, AttributeError, OSError):
+            pass
+
+    def reload_changed_plugins(self):
+        """Reload the loaded plugins whose source files have changed since
+        they were loaded.
+
+        Run every ``plugin_watch_interval`` seconds if that is set.  Failures
+        are logged, and the plugins aren't tried again until their source
+        changes again.
+        """
+        changed = collections.defaultdict(list)
+        for name, p in self.plugins.iteritems():
+            try:
+                mtime = os.stat(source_file(sys.modules[p.__module__])
+                                ).st_mtime
+            except (KeyError, AttributeError, OSError):
+                continue
+            if mtime != self.plugin_mtimes.get(p.__module__, mtime):
+                changed[p.__module__].append(name)
+
+        for module_name, names in changed.iteritems():
+            try:
+                self.reload_plugins(names)
+            except PluginError:
+                log.err(None, 'Failed to reload {}'.format(module_name))
+                self.record_plugin_source(module_name)
+
+    def hooks_for(self, event_type):
+        """Get the list of handlers to fire for *event_type*.
+
+        The first time an event type is seen its entry in the hook index is
+        created, containing the :class:`Bot`'s own method for the event type if
+        there is one.  Plugin hooks are added to and removed from the index as
+        plugins are loaded and unloaded, so the index always reflects the
+        currently loaded plugins.
+        """
+        handlers = self.hooks.get(event_type)
+        if handlers is None:
+            method = getattr(self, event_type, None)
+            handlers = [method] if method is not None else []
+            self.hooks[event_type] = handlers
+        return handlers
+
+    def has_hooks(self, event_type):
+        """Check if anything will handle an event of type *event_type*.
+
+        Used by :func:`.events.proxy` to avoid creating events that nothing is
+        listening for.  Always reflects the currently loaded plugins.
+        """
+        handlers = self.hooks.get(event_type)
+        if handlers is None:
+            handlers = self.hooks_for(event_type)
+        return len(handlers) > 0 or event_type in self.filtered_hooks
+
+    def build_hook_index(self, remove=None, add=None):
+        """Build a new hook index, and index of filtered hooks, without the
+        hooks of plugin *remove* and with those of plugin *add*.
+
+        Hooks with filters (see :meth:`PluginFeatures.hook`) go in a
+        :class:`.filters.HookMatcher` for their event type rather than in the
+        list of handlers.  Returns ``(hooks, filtered_hooks)``.
+        """
+        hooks = dict(self.hooks)
+        filtered_hooks = dict(self.filtered_hooks)
+        event_types = set()
+        for plugin in (remove, add):
+            if plugin is not None:
+                event_types.update(plugin.features.hooks)
+
+        for event_type in event_types:
+            handlers = [h for h in self.hooks_for(event_type)
+                        if remove is None or
+                        getattr(h, 'im_self', None) is not remove]
+            matcher = self.filtered_hooks.get(event_type)
+            entries = [(f, h) for f, h in (matcher.entries if matcher else [])
+                       if remove is None or h.im_self is not remove]
+            if add is not None:
+                for h, f in add.features.hook_filters(event_type):
+                    if f is None:
+                        handlers.append(h)
+                    else:
+                        entries.append((f, h))
+            hooks[event_type] = handlers
+            if entries:
+                filtered_hooks[event_type] = filters.HookMatcher(entries)
+            else:
+                filtered_hooks.pop(event_type, None)
+        return hooks, filtered_hooks
 
-        # Unload the plugin, unregistering all its commands etc.
-        self.unload_plugin(name)
-        # Load the plugin
-        self.load_plugin(name)
+    def register_hooks(self, plugin):
+        """Add all of *plugin*'s hooks to the hook index.
+
+        The index is replaced rather than modified so that an event which is
+        currently being dispatched isn't affected.
+        """
+        self.hooks, self.filtered_hooks = self.build_hook_index(add=plugin)
+
+    def unregister_hooks(self, plugin):
+        """Remove all of *plugin*'s hooks from the hook index.
+        """
+        self.hooks, self.filtered_hooks = \
+            self.build_hook_index(remove=plugin)
 
     def post_event(self, event):
         """Post *event* into the bot event queue.
@@ -214,30 +586,108 @@ class Bot(object):
                 self.fire_hooks(e)
             self.events_running = False
 
+    def make_command_limiter(self):
+        """Create the :class:`.ratelimit.CommandLimiter` for the configured
+        limits, or None if they are all 0.
+        """
+        user_rate = self.config.getfloat('DEFAULT', 'command_user_rate')
+        command_rate = self.config.getfloat('DEFAULT', 'command_rate')
+        if user_rate <= 0 and command_rate <= 0:
+            return None
+        return ratelimit.CommandLimiter(
+            user_rate if user_rate > 0 else None,
+            self.config.getfloat('DEFAULT', 'command_user_burst'),
+            command_rate if command_rate > 0 else None,
+            self.config.getfloat('DEFAULT', 'command_burst'),
+            max_users=self.config.getint('DEFAULT', 'command_limit_users'),
+            action=self.config.get('DEFAULT', 'command_limit_action'),
+            max_deferred=self.config.getint('DEFAULT',
+                                            'command_limit_queue'))
+
     def fire_command(self, command):
-        """Dispatch *command* to its callback.
+        """Dispatch *command* to its callback, subject to the command rate
+        limits (see :mod:`.ratelimit`).
+        """
+        if self.command_limiter is None:
+            self.dispatch_command(command)
+        else:
+            self.command_limiter.submit(command, self.dispatch_command)
+
+    def dispatch_command(self, command):
+        """Call *command*'s callback, or if it has a cache policy and the
+        answer is cached, send the cached replies (see :mod:`.cache`).
         """
         if command.command not in self.commands:
             command.error('Command "{0.command}" not found'.format(command))
             return
 
         handler = self.commands[command.command]
-        handler(command)
+        policy = getattr(handler, 'cache', None)
+        if self.profiler is not None:
+            if policy is None:
+                self.profiler.call('command', command.command, handler,
+                                   handler, command)
+            else:
+                self.profiler.call('command', command.command, handler,
+                                   self.response_cache.dispatch, command,
+                                   handler, policy)
+        elif policy is None:
+            handler(command)
+        else:
+            self.response_cache.dispatch(command, handler, policy)
 
     def fire_hooks(self, event):
         """Fire hooks associated with ``event.event_type``.
 
         Firstly the :class:`Bot`'s hook for the event type is fired, followed
-        by each plugin's hooks via :meth:`PluginFeatures.fire_hooks`.
-
-        .. note:: The order that different plugins receive an event in is
-                  undefined.
+        by each plugin's hooks in the order the plugins were loaded, and then
+        the hooks with filters that match the event.  The handlers come from
+        the hook index (see :meth:`hooks_for`), so plugins which don't hook
+        the event type cost nothing, and filtered hooks are only called for
+        events they want.
+
+        .. note:: The order that different plugins receive an event in should
+                  not be relied upon.
         """
-        method = getattr(self, event.event_type, None)
-        if method is not None:
-            method(event)
-        for plugin in self.plugins.itervalues():
-            plugin.features.fire_hooks(event)
+        handlers = self.hooks.get(event.event_type)
+        if handlers is None:
+            handlers = self.hooks_for(event.event_type)
+        profiler = self.profiler
+        if profiler is None:
+            for h in handlers:
+                h(event)
+        else:
+            for h in handlers:
+                profiler.call('hook', event.event_type, h, h, event)
+        matcher = self.filtered_hooks.get(event.event_type)
+        if matcher is not None:
+            for h in matcher.match(event):
+                if profiler is None:
+                    h(event)
+                else:
+                    profiler.call('hook', event.event_type, h, h, event)
+
+    def start_profiling(self, deterministic=False):
+        """Start timing every hook and command handler, and if
+        *deterministic* is true, profiling everything with :mod:`cProfile`;
+        see :mod:`.profiling`.  Returns the :class:`.profiling.Profiler`.
+
+        Raises :exc:`~exceptions.ValueError` if already profiling.
+        """
+        if self.profiler is not None:
+            raise ValueError('Already profiling')
+        self.profiler = profiling.Profiler(deterministic)
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiling(self):
+        """Stop profiling, returning the :class:`.profiling.Profiler`, or
+        None if not profiling.
+        """
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.stop()
+        return profiler
 
     def log_msg(self, msg):
         """Convenience wrapper around ``twisted.python.log.msg`` for plugins"""
@@ -248,8 +698,7 @@ class Bot(object):
         log.err(err)
 
     def signedOn(self, event):
-        map(event.protocol.join,
-            self.config.get('DEFAULT', 'channels').split())
+        map(event.protocol.join, event.protocol.network.config['channels'])
 
     def privmsg(self, event):
         command = events.CommandEvent.create(event)
@@ -264,31 +713,270 @@ class PluginError(Exception):
     pass
 
 
+class PluginCache(object):
+    """Finds plugin classes in the modules of a package, remembering what
+    was found in each module file.
+
+    A module is only imported and scanned if it hasn't been seen before, if
+    it failed to import and its file has been modified since, or if
+    :meth:`invalidate` has been called for it.  Modules that have already
+    been imported are never reloaded here, since plugins from them may be
+    running; that is left to :meth:`reload`.  Modules whose files have gone
+    away are forgotten.
+    """
+    def __init__(self, package, base):
+        self.package = package
+        self.base = base
+        # Module name -> (file modification time, plugin classes)
+        self.modules = dict()
+
+    def module_files(self):
+        """Get a dictionary mapping from module name to source file for
+        every module in the package.
+        """
+        package = importlib.import_module(self.package)
+        files = dict()
+        for path in package.__path__:
+            try:
+                entries = os.listdir(path)
+            except OSError:
+                continue
+            for entry in entries:
+                full = os.path.join(path, entry)
+                base, ext = os.path.splitext(entry)
+                if ext == '.py' and base != '__init__':
+                    files.setdefault(base, full)
+                elif (not ext and
+                        os.path.exists(os.path.join(full, '__init__.py'))):
+                    files.setdefault(entry, os.path.join(full, '__init__.py'))
+        return dict(('{}.{}'.format(self.package, name), f)
+                    for name, f in files.iteritems())
+
+    def scan(self, module_name, stale):
+        """Import (or if *stale*, reload) a module and find its plugin
+        classes.
+        """
+        module = sys.modules.get(module_name)
+        if module is None:
+            module = importlib.import_module(module_name)
+        elif stale:
+            module = reload(module)
+        return [obj for name, obj in vars(module).iteritems()
+                if not name.startswith('_') and isinstance(obj, type) and
+                issubclass(obj, self.base) and obj is not self.base]
+
+    def classes(self):
+        """Get every plugin class in the package, rescanning modules as
+        necessary.
+
+        Modules that fail to import are logged and skipped until they change.
+        Changes to modules that have been imported are only picked up by
+        :meth:`reload`.
+        """
+        files = self.module_files()
+        for module_name in self.modules.keys():
+            if module_name not in files:
+                del self.modules[module_name]
+
+        classes = []
+        for module_name, path in sorted(files.iteritems()):
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            cached = self.modules.get(module_name)
+            if cached is None or (cached[0] != mtime and
+                                  module_name not in sys.modules):
+                try:
+                    found = self.scan(module_name, False)
+                except Exception:
+                    log.err(None, 'Failed to load plugin module ' +
+                            module_name)
+                    found = []
+                cached = self.modules[module_name] = (mtime, found)
+            classes.extend(cached[1])
+        return classes
+
+    def invalidate(self, module_name):
+        """Forget about a module, so it is scanned again next time."""
+        self.modules.pop(module_name, None)
+
+    def reload(self, module_name):
+        """Reload a module, returning its plugin classes.
+
+        Nothing else is rescanned, and the next :meth:`classes` uses the
+        reloaded module without reloading it again.
+        """
+        found = self.scan(module_name, True)
+        try:
+            mtime = os.stat(source_file(sys.modules[module_name])).st_mtime
+        except (AttributeError, OSError):
+            self.invalidate(module_name)
+        else:
+            self.modules[module_name] = (mtime, found)
+        return found
+
+
+def source_file(module):
+    """Get the path of *module*'s source rather than its compiled file."""
+    path = module.__file__
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return path
+
+
+class Network(object):
+    """An IRC network that the bot connects to.
+
+    The settings for a network, e.g. ``irc_host``, ``nickname`` and
+    ``channels``, come from its ``[network:<name>]`` configuration section,
+    falling back to ``DEFAULT``.  Everything else, including the plugins, is
+    shared by all networks.
+    """
+    #: Conversion of network settings, see :class:`.ConfigView`
+    CONFIG_TYPES = {
+        'irc_port': int,
+        'linerate': float,
+        'lineburst': int,
+        'channels': config.words,
+        'command_prefix': config.words,
+        'nick_aliases': config.words,
+    }
+
+    def __init__(self, bot, name):
+        self.bot = bot
+        self.name = name
+        self.config_ = None
+
+    def __repr__(self):
+        return '<Network {}>'.format(self.name)
+
+    @property
+    def config(self):
+        """The network's settings as a :class:`.ConfigView`, built on first
+        use and rebuilt after :meth:`Bot.reload_config`.
+        """
+        if self.config_ is None:
+            self.config_ = config.ConfigView(self.bot.config,
+                                             'network:' + self.name,
+                                             types=self.CONFIG_TYPES)
+        return self.config_
+
+
 class BotProtocol(irc.IRCClient):
-    def __init__(self, bot):
+    #: :class:`.replay.Recorder` for received lines, if any
+    recorder = None
+
+    def __init__(self, bot, network=None):
         self.bot = bot
-        # Get IRCClient configuration from the Bot
-        self.nickname = bot.config.get('DEFAULT', 'nickname')
-        self.username = bot.config.get('DEFAULT', 'username')
-        self.realname = bot.config.get('DEFAULT', 'realname')
-        self.sourceURL = bot.config.get('DEFAULT', 'sourceURL')
-        self.lineRate = bot.config.getint('DEFAULT', 'lineRate')
+        #: The :class:`Network` this is connected to
+        self.network = network or bot.default_network
+        settings = self.network.config
+        # Get IRCClient configuration from the network
+        self.nickname = settings['nickname']
+        self.username = settings['username']
+        self.realname = settings['realname']
+        self.sourceURL = settings['sourceurl']
+
+        # Rate limiting is done by the outbound scheduler rather than by
+        # IRCClient's single queue.  lineRate is the average number of seconds
+        # between lines, 0 for no limit.
+        self.lineRate = None
+        line_rate = settings['linerate']
+        self.outbound = outbound.OutboundScheduler(
+                lambda line: irc.IRCClient.sendLine(self, line),
+                1.0 / line_rate if line_rate > 0 else None,
+                settings['lineburst'])
 
         # Keeps partial name lists between RPL_NAMREPLY and
         # RPL_ENDOFNAMES events
         self.names_accumulator = dict()
+        #: Who is in the channels we're in, see :mod:`.channels`
+        self.channels = channels.ChannelState()
+
+        # Recognises commands, must be rebuilt when the nick changes
+        self.build_command_matcher()
+
+    def build_command_matcher(self):
+        """(Re)build the :class:`.CommandMatcher` used to recognise commands
+        in messages, from the network's command prefixes and the current
+        nick.
+        """
+        settings = self.network.config
+        self.command_matcher = events.CommandMatcher(
+                settings['command_prefix'],
+                [self.nickname] + settings['nick_aliases'])
+
+    def lineReceived(self, line):
+        if self.recorder is not None:
+            self.recorder.record(line)
+        irc.IRCClient.lineReceived(self, line)
 
     def connectionMade(self):
         irc.IRCClient.connectionMade(self)
+        self.bot.protocols.add(self)
         print "[Connected]"
 
     def connectionLost(self, reason):
         irc.IRCClient.connectionLost(self, reason)
+        self.bot.protocols.discard(self)
+        self.outbound.clear()
+        self.channels.clear()
         print "[Disconnected because {}]".format(reason)
 
+    def sendLine(self, line):
+        """Send a protocol line through the outbound scheduler, ahead of any
+        queued messages.
+        """
+        self.outbound.enqueue(None, [line], outbound.PRIORITY_CONTROL)
+
+    def msg(self, user, message, length=None,
+            priority=outbound.PRIORITY_NORMAL):
+        """Send a message to a user or channel.
+
+        Each line of *message* is split into as many ``PRIVMSG`` commands as
+        necessary to fit the IRC line length limit, see
+        :func:`.outbound.split_message`.  *length* is the maximum number of
+        bytes in each command, including the protocol framing; if it's None
+        then the limit is worked out from the protocol limit and the longest
+        prefix the server could add to the message.  The commands are queued
+        for *user* at *priority* in the :class:`.OutboundScheduler`.
+        """
+        if isinstance(user, unicode):
+            user = user.encode('utf-8')
+        fmt = 'PRIVMSG {} :'.format(user)
+
+        if length is None:
+            length = outbound.MAX_LINE_BYTES - len(self.source_prefix())
+        # Account for the command and line terminator
+        max_bytes = length - len(fmt) - 2
+        if max_bytes <= 0:
+            raise ValueError('Maximum length must exceed {} for message '
+                             'to {}'.format(len(fmt) + 2, user))
+
+        self.outbound.enqueue(user, [fmt + chunk for chunk in
+                                     outbound.split_message(message,
+                                                            max_bytes)],
+                              priority)
+
+    def source_prefix(self):
+        """Get the longest ``:nick!user@host`` prefix (plus separating
+        space) that the server could put on messages we send, when relaying
+        them to other clients.
+        """
+        # The server may prefix our username with "~", and hostnames are at
+        # most 63 characters
+        return ':{}!~{}@{} '.format(self.nickname, self.username, 'h' * 63)
+
     @events.proxy
     def signedOn(self):
-        pass
+        # The server may have given us a different nick
+        self.build_command_matcher()
+
+    def nickChanged(self, nick):
+        self.channels.rename(self.nickname, nick)
+        irc.IRCClient.nickChanged(self, nick)
+        self.build_command_matcher()
 
     @events.proxy
     def privmsg(self, user, channel, message):
@@ -304,29 +992,56 @@ class BotProtocol(irc.IRCClient):
 
     @events.proxy
     def joined(self, channel):
-        pass
+        self.channels.joined(channel, self.nickname)
 
     @events.proxy
     def left(self, channel):
-        pass
+        self.channels.left(channel)
 
     @events.proxy
     def userJoined(self, user, channel):
-        pass
+        self.channels.add(user, channel)
 
     @events.proxy
     def userLeft(self, user, channel):
-        pass
+        self.channels.remove(user, channel)
 
-    @events.proxy
+    @events.proxy('user', 'message', 'channels')
     def userQuit(self, user, message):
-        pass
+        """*channels* are the names of the channels the user was in.
+        """
+        return (user, message, self.channels.quit(user))
+
+    @events.proxy
+    def userKicked(self, kickee, channel, kicker, message):
+        self.channels.remove(kickee, channel)
+
+    @events.proxy
+    def kickedFrom(self, channel, kicker, message):
+        self.channels.left(channel)
+
+    @events.proxy('oldname', 'newname', 'channels')
+    def userRenamed(self, oldname, newname):
+        """*channels* are the names of the channels the user is in.
+        """
+        return (oldname, newname, self.channels.rename(oldname, newname))
+
+    @events.proxy
+    def modeChanged(self, user, channel, added, modes, args):
+        """*added* is True if *modes* were set and False if they were
+        unset, and *args* are the modes' arguments.
+        """
+        prefixes = self.supported.getFeature('PREFIX', {})
+        for mode, arg in zip(modes, args):
+            if mode in prefixes and arg is not None:
+                self.channels.set_mode(arg, channel, mode, added)
 
     @events.proxy
     def names(self, channel, names, raw_names):
         """Called when the NAMES list for a channel has been received.
         """
-        pass
+        self.channels.set_names(channel, [(name, modes)
+                                          for name, modes in names])
 
     def irc_RPL_NAMREPLY(self, prefix, params):
         channel = params[2]
@@ -343,12 +1058,14 @@ class BotProtocol(irc.IRCClient):
         prefixes = self.supported.getFeature('PREFIX')
         inverse_prefixes = dict((v[0], k) for k, v in prefixes.iteritems())
 
-        # Get mode characters from name prefix
+        # Get mode characters from name prefixes, of which there may be
+        # more than one with the multi-prefix extension
         def f(name):
-            if name[0] in inverse_prefixes:
-                return (name[1:], set(inverse_prefixes[name[0]]))
-            else:
-                return (name, set())
+            modes = set()
+            while name[:1] in inverse_prefixes:
+                modes.add(inverse_prefixes[name[0]])
+                name = name[1:]
+            return (name, modes)
         names = map(f, raw_names)
 
         # Fire the event
@@ -364,6 +1081,8 @@ class PluginFeatures(object):
     def __init__(self):
         self.commands = dict()
         self.hooks = dict()
+        # Event type -> list of filters, or None, for each handler in hooks
+        self.filters = dict()
 
     def instantiate(self, inst):
         """Create a duplicate :class:`PluginFeatures` bound to *inst*.
@@ -378,30 +1097,47 @@ class PluginFeatures(object):
                                  for c, f in self.commands.iteritems())
         features.hooks = dict((h, [types.MethodType(f, inst, cls) for f in fs])
                               for h, fs in self.hooks.iteritems())
+        features.filters = self.filters
         return features
 
-    def hook(self, hook):
+    def hook(self, hook, **filter_args):
         """Create a decorator to register a handler for *hook*.
+
+        Keyword arguments, if any, create a :class:`.filters.Filter` so that
+        the handler is only called for matching events, e.g.::
+
+            @features.hook('privmsg', channel='#cs-york', message=r'^hi\b')
         """
         if hook not in self.hooks:
             self.hooks[hook] = list()
+            self.filters[hook] = list()
+        hook_filter = filters.Filter(**filter_args) if filter_args else None
 
         def decorate(f):
             self.hooks[hook].append(f)
+            self.filters[hook].append(hook_filter)
             return f
         return decorate
 
-    def command(self, command, help=None):
+    def hook_filters(self, hook):
+        """Get ``(handler, filter)`` pairs for *hook*, where *filter* is None
+        for handlers without one.
+        """
+        return zip(self.hooks.get(hook, ()), self.filters.get(hook, ()))
+
+    def command(self, command, help=None, cache=None):
         """Create a decorator to register a handler for *command*.
 
-        Raises a :class:`KeyError` if this class has already registered a
-        handler for *command*.
+        *cache* is an optional :class:`.cache.CachePolicy` for caching the
+        command's replies.  Raises a :class:`KeyError` if this class has
+        already registered a handler for *command*.
         """
         if command in self.commands:
             raise KeyError('Duplicate command: {}'.format(command))
 
         def decorate(f):
             f.help = help
+            f.cache = cache
             self.commands[command] = f
             return f
         return decorate
@@ -412,9 +1148,9 @@ class PluginFeatures(object):
         Hook handlers are run in the order they were registered, which should
         correspond to the order they were defined if decorators were used.
         """
-        hooks = self.hooks.get(event.event_type, list())
-        for h in hooks:
-            h(event)
+        for h, f in self.hook_filters(event.event_type):
+            if f is None or f.matches(event):
+                h(event)
 
 
 class Plugin(object):
@@ -423,10 +1159,19 @@ class Plugin(object):
 
     features = PluginFeatures()
 
+    #: Default values for the plugin's configuration options, used if they
+    #: aren't in the plugin's configuration section
+    CONFIG_DEFAULTS = {}
+    #: Conversion functions for configuration options, e.g. :func:`int` or
+    #: :func:`.config.boolean`
+    CONFIG_TYPES = {}
+
     def __init__(self, bot):
         self.bot = bot
         self.features = self.features.instantiate(self)
         self.db_ = None
+        self.async_db_ = None
+        self.config_ = None
 
     @classmethod
     def plugin_name(cls):
@@ -447,48 +1192,77 @@ class Plugin(object):
 
     @property
     def db(self):
+        """The plugin's own :mod:`pymongo` database.
+
+        Operations on this block the whole bot until they finish, so should be
+        avoided in hooks and commands; see :attr:`async_db`.
+        """
         if self.db_ is None:
             self.db_ = self.bot.mongodb['csbot__' + self.plugin_name()]
         return self.db_
 
-    def cfg(self, name):
-        plugin = self.plugin_name()
+    @property
+    def async_db(self):
+        """The plugin's database as a :class:`.storage.AsyncDatabase`.
 
-        # Check plugin config
-        if self.bot.config.has_section(plugin):
-            if self.bot.config.has_option(plugin, name):
-                return self.bot.config.get(plugin, name)
+        Operations run on the bot's worker pool and return
+        :class:`~twisted.internet.defer.Deferred` objects::
 
-        # Check default config
-        if self.bot.config.has_option("DEFAULT", name):
-            return self.bot.config.get("DEFAULT", name)
+            d = self.async_db.messages.find({'to': user})
+            d.addCallback(self.deliver)
+        """
+        if self.async_db_ is None:
+            self.async_db_ = storage.AsyncDatabase(self.db, self.bot.storage)
+        return self.async_db_
 
-        # Raise an exception
-        raise KeyError("{} is not a valid option.".format(name))
+    @property
+    def config(self):
+        """The plugin's configuration as a read-only :class:`.ConfigView`.
 
-    def get(self, key):
-        """Get a value from the plugin key/value store by key. If the key
-        is not found, a KeyError is raised.
+        Options in the plugin's section override :attr:`CONFIG_DEFAULTS`,
+        which override the ``DEFAULT`` section, and are converted according
+        to :attr:`CONFIG_TYPES`.  The view is built on first use and rebuilt
+        after :meth:`Bot.reload_config`.
         """
+        if self.config_ is None:
+            self.config_ = config.ConfigView(self.bot.config,
+                                             self.plugin_name(),
+                                             self.CONFIG_DEFAULTS,
+                                             self.CONFIG_TYPES)
+        return self.config_
 
-        plugin = self.plugin_name()
+    def cfg(self, name):
+        """Get a configuration option, raising :exc:`KeyError` if it isn't
+        set; see :attr:`config`.
+        """
+        return self.config[name]
 
-        if self.bot.plugindata.has_section(plugin):
-            if self.bot.plugindata.has_option(plugin, key):
-                return self.bot.plugindata.get(plugin, key)
+    def get(self, key):
+        """Get a value from the plugin key/value store by key. If the key
+        is not found, a KeyError is raised.
 
-        raise KeyError("{} is not defined.".format(key))
+        Keys are case-insensitive.
+        """
+        try:
+            return self.bot.keyval.get(self.plugin_name(), key.lower())
+        except KeyError:
+            raise KeyError("{} is not defined.".format(key))
 
     def set(self, key, value):
         """Set a value in the plugin key/value store by key.
-        """
-
-        plugin = self.plugin_name()
 
-        if not self.bot.plugindata.has_section(plugin):
-            self.bot.plugindata.add_section(plugin)
+        The value can be a number, string, boolean or None, or a list, tuple,
+        dictionary or set of those, and is written to disk within a second or
+        so (see :mod:`csbot.keyval`).
+        """
+        self.bot.keyval.set(self.plugin_name(), key.lower(), value)
 
-        self.bot.plugindata.set(plugin, key, value)
+    def invalidate_cache(self, command, raw_data=None):
+        """Forget the cached replies to *command*, either all of them or
+        only those for *raw_data*, because something they depend on has
+        changed; see :mod:`.cache`.
+        """
+        self.bot.response_cache.invalidate(command, raw_data)
 
     def setup(self):
         """Run setup actions for the plugin.
@@ -512,44 +1286,175 @@ class Plugin(object):
         """
         pass
 
+    def snapshot(self):
+        """Get the plugin's state to hand over to its replacement when it is
+        reloaded, see :meth:`Bot.reload_plugins`.
+
+        Plugins that keep state in memory can overload this, and
+        :meth:`restore`, to avoid rebuilding it.  If anything other than None
+        (the default) is returned, the replacement's :meth:`restore` is called
+        with it instead of :meth:`setup`, and this plugin's :meth:`teardown`
+        is not run, since its state now belongs to the replacement.
+        """
+        return None
+
+    def restore(self, state):
+        """Set up the plugin from *state*, as returned by :meth:`snapshot` on
+        the instance it is replacing, instead of running :meth:`setup`.
+        """
+        pass
+
 
 class BotFactory(protocol.ClientFactory):
-    def __init__(self, bot):
+    #: Seconds to wait before retrying a failed connection, if there is more
+    #: than one network
+    RETRY_DELAY = 60
+
+    def __init__(self, bot, network, recorder=None):
         self.bot = bot
+        self.network = network
+        self.recorder = recorder
+        # Don't try to reconnect once the reactor is shutting down
+        self.shutting_down = False
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      self.shutdown)
+
+    def shutdown(self):
+        self.shutting_down = True
 
     def buildProtocol(self, addr):
-        p = BotProtocol(self.bot)
+        p = BotProtocol(self.bot, self.network)
         p.factory = self
+        p.recorder = self.recorder
         return p
 
     def clientConnectionLost(self, connector, reason):
-        connector.connect()
+        if not self.shutting_down:
+            connector.connect()
 
     def clientConnectionFailed(self, connector, reason):
-        reactor.stop()
+        if self.shutting_down:
+            return
+        if len(self.bot.networks) == 1:
+            reactor.stop()
+        else:
+            # Don't give up on the other networks
+            log.msg('Connection to {} failed, retrying in {}s'.format(
+                self.network.name, self.RETRY_DELAY))
+            reactor.callLater(self.RETRY_DELAY, connector.connect)
+
+
+def write_profile(bot, path):
+    """Stop profiling *bot*, writing the statistics to *path* and logging
+    a summary.
+    """
+    profiler = bot.stop_profiling()
+    if profiler is not None:
+        profiler.dump(path)
+        for line in profiler.summary(10):
+            log.msg(line)
+        log.msg('Profile written to {}'.format(path))
+
+
+def replay_main(bot, path, speed, profile=None):
+    """Replay the capture at *path* through *bot*, see :mod:`.replay`,
+    profiling it and writing the statistics to *profile* if given.
+
+    The bot's data is kept in memory and a temporary directory so that
+    replays don't affect the real bot, and there is no rate limit.
+    """
+    import shutil
+    import tempfile
+    import csbot.replay as replay
+
+    tmp = tempfile.mkdtemp()
+    bot.config.set('DEFAULT', 'mongodb_host', ':memory:')
+    bot.config.set('DEFAULT', 'keyvalstore', os.path.join(tmp, 'keyval.db'))
+    bot.config.set('DEFAULT', 'keyvalfile', os.path.join(tmp, 'keyval.cfg'))
+    bot.config.set('DEFAULT', 'lineRate', '0')
+    for network in bot.networks:
+        if bot.config.has_section('network:' + network):
+            bot.config.set('network:' + network, 'lineRate', '0')
+    bot.setup()
+
+    p = BotProtocol(bot)
+    p.makeConnection(replay.SinkTransport())
+    if profile:
+        bot.start_profiling(deterministic=True)
+    replayer = replay.Replayer(p, replay.read_capture(path), speed)
+    d = replayer.start()
+    d.addErrback(log.err)
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+
+    print replayer.report()
+    if profile:
+        write_profile(bot, profile)
+    bot.teardown(save_config=False)
+    shutil.rmtree(tmp)
 
 
 def main(argv):
     import sys
+    import signal
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', default='csbot.cfg',
                         help='Configuration file [default: %(default)s]')
+    parser.add_argument('--record', metavar='FILE',
+                        help='Record received lines to FILE')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Replay recorded lines from FILE instead of '
+                             'connecting to a server')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed multiplier, 0 for as fast as '
+                             'possible [default: %(default)s]')
+    parser.add_argument('--profile', metavar='FILE', nargs='?',
+                        const='csbot.prof',
+                        help='Profile the bot, writing the statistics to '
+                             'FILE on exit [default: %(const)s]')
     args = parser.parse_args(argv[1:])
 
     # Start twisted logging
     log.startLogging(sys.stdout)
 
-    # Create bot and run setup functions
+    # Create bot
     bot = Bot(args.config)
-    bot.setup()
 
-    # Connect and enter the reactor loop
-    reactor.connectTCP(bot.config.get('DEFAULT', 'irc_host'),
-                       bot.config.getint('DEFAULT', 'irc_port'),
-                       BotFactory(bot))
+    if args.replay:
+        replay_main(bot, args.replay, args.speed, args.profile)
+        return
+
+    # Run setup functions
+    bot.setup()
+    if args.profile:
+        bot.start_profiling(deterministic=True)
+
+    # Re-read the configuration on SIGHUP
+    signal.signal(signal.SIGHUP,
+                  lambda signum, frame: reactor.callFromThread(
+                      bot.reload_config))
+
+    # Connect to every network and enter the reactor loop
+    recorders = []
+    for network in bot.networks.itervalues():
+        recorder = None
+        if args.record:
+            import csbot.replay as replay
+            path = args.record
+            if len(bot.networks) > 1:
+                path += '.' + network.name
+            recorder = replay.Recorder(path)
+            recorders.append(recorder)
+        reactor.connectTCP(network.config['irc_host'],
+                           network.config['irc_port'],
+                           BotFactory(bot, network, recorder))
     reactor.run()
 
+    if args.profile:
+        write_profile(bot, args.profile)
     # Run teardown functions before exiting
     bot.teardown()
+    for recorder in recorders:
+        recorder.close()
@@ -1,11 +1,13 @@
 from datetime import datetime
-import shlex
+from time import time
 import inspect
+import re
 from functools import wraps
 
 from twisted.words.protocols import irc
 
-from csbot.util import nick, is_channel, parse_arguments
+from csbot.util import nick, is_channel, parse_arguments, ParseError
+from csbot.outbound import PRIORITY_REPLY
 
 
 PROXY_DOC = """
@@ -27,10 +29,12 @@ def proxy(*args, **kwargs):
 
     When the new method is called, the decorated method is called first, as
     normal.  Afterwards an :class:`Event` is created and the arguments are
-    stored in it as attributes.  By default the :attr:`~Event.event_type` is
+    stored in it as attributes, using a class generated by :func:`event_class`
+    for the event type.  By default the :attr:`~Event.event_type` is
     the name of the method being decorated.  This event is passed to
-    :meth:`.Bot.fire_hook`, which is responsible for firing the bot's and
-    plugins' handlers for the event.
+    :meth:`.Bot.post_event`, which is responsible for firing the bot's and
+    plugins' handlers for the event.  If :meth:`.Bot.has_hooks` says that
+    nothing handles the event type, no event is created at all.
 
     If the decorator is used without arguments, the attribute names are defined
     by the parameter names of the decorated method::
@@ -91,17 +95,22 @@ def proxy(*args, **kwargs):
         # attrs=None
         if attrs is None:
             attrs = inspect.getargspec(f).args[1:]
+        # The class of the events created by this method
+        cls = event_class(event_type, attrs)
 
         # Create new function, copying info from f
         @wraps(f)
         def newf(self, *args):
             # Fire the decorated function
             result = f(self, *args)
+            # Don't bother creating an event that nobody is listening for
+            if not self.bot.has_hooks(event_type):
+                return
             # Allow the decorated function to return new arguments, but if it
             # doesn't return anything keep the same arguments
             args = result or args
             # Create an Event
-            event = Event(self.bot, self, event_type, dict(zip(attrs, args)))
+            event = cls(self.bot, self, *args)
             # Put the event into the queue, probably causing it to run
             # immediately (see Bot.post_event())
             self.bot.post_event(event)
@@ -126,93 +135,183 @@ def proxy(*args, **kwargs):
 
 
 class Event(object):
-    #: The :class:`.Bot` for which the message was received.
-    bot = None
-    #: The :class:`.BotProtocol` which received the message.  This subclasses
-    #: Twisted :class:`IRCClient` and so exposes all of the same methods.
-    protocol = None
+    """Base class for events.
+
+    Every event type gets its own subclass, created by :func:`event_class`,
+    which stores the event's attributes in ``__slots__`` rather than a
+    per-instance dictionary.  All events have at least the following
+    attributes:
+
+    .. attribute:: bot
+
+        The :class:`.Bot` for which the message was received.
+
+    .. attribute:: protocol
+
+        The :class:`.BotProtocol` which received the message.  This subclasses
+        Twisted :class:`IRCClient` and so exposes all of the same methods.
+
+    .. attribute:: timestamp
+
+        The value of :func:`time.time` when the message was first received.
+
+    .. attribute:: network
+
+        The name of the :class:`.Network` the message came from.
+    """
+    __slots__ = ('bot', 'protocol', 'timestamp', '_datetime')
+
     #: The name of the event.  This will usually correspond to a method in
     #: :class:`.BotProtocol` marked by the :func:`proxy` decorator.
     event_type = None
-    #: The value of :meth:`datetime.datetime.now()` when the message was
-    #: first received.
-    datetime = None
-
-    def __init__(self, bot, protocol, event_type, attributes):
-        # Set datetime before attributes so it can be forced
-        self.datetime = datetime.now()
-        # Set attributes from dictionary
-        for attr, value in attributes.iteritems():
-            setattr(self, attr, value)
-        # Set attributes from arguments
+    #: The names of the event-specific attributes, in the order they are
+    #: passed to the constructor.
+    attributes = ()
+
+    def __init__(self, bot, protocol):
         self.bot = bot
         self.protocol = protocol
-        self.event_type = event_type
+        self.timestamp = time()
+        self._datetime = None
+
+    @property
+    def network(self):
+        # Looked up through the protocol, so events don't get any bigger
+        return self.protocol.network.name
+
+    @property
+    def datetime(self):
+        """:attr:`timestamp` as a :class:`datetime.datetime` in local time,
+        only created if a handler asks for it.
+        """
+        if self._datetime is None:
+            self._datetime = datetime.fromtimestamp(self.timestamp)
+        return self._datetime
+
+
+#: Template for the constructor of a generated :class:`Event` subclass.
+#: Defining it with :keyword:`exec` means each attribute is stored with a
+#: single assignment, in the same way as :func:`collections.namedtuple`.
+EVENT_INIT_TEMPLATE = """def __init__(self, bot, protocol, {params}):
+    self.bot = bot
+    self.protocol = protocol
+    self.timestamp = time()
+    self._datetime = None
+{assignments}
+"""
+
+#: Cache of generated :class:`Event` subclasses, see :func:`event_class`.
+_event_classes = dict()
+
+
+def event_class(event_type, attributes):
+    """Get the :class:`Event` subclass for *event_type* events with
+    *attributes*.
+
+    Classes are generated on first use and cached, so every event of the same
+    type shares a class.  Attributes are stored in ``__slots__``, and any
+    attribute not passed to the constructor is ``None``.
+
+    >>> Privmsg = event_class('privmsg', ('user', 'channel', 'message'))
+    >>> e = Privmsg(None, None, 'nick!~user@host', '#cs-york', 'hello')
+    >>> e.event_type, e.channel, e.message
+    ('privmsg', '#cs-york', 'hello')
+    >>> Privmsg is event_class('privmsg', ('user', 'channel', 'message'))
+    True
+    """
+    attributes = tuple(attributes)
+    key = (event_type, attributes)
+    if key in _event_classes:
+        return _event_classes[key]
+
+    for attr in attributes:
+        if attr.startswith('_') or hasattr(Event, attr):
+            raise ValueError('invalid event attribute name: ' + attr)
+
+    namespace = {'time': time}
+    if attributes:
+        exec EVENT_INIT_TEMPLATE.format(
+                params=', '.join(a + '=None' for a in attributes),
+                assignments='\n'.join('    self.{0} = {0}'.format(a)
+                                      for a in attributes)) in namespace
+    else:
+        namespace['__init__'] = Event.__init__.im_func
+
+    cls = type(event_type[:1].upper() + event_type[1:] + 'Event', (Event,), {
+        '__slots__': attributes,
+        '__init__': namespace['__init__'],
+        'event_type': event_type,
+        'attributes': attributes,
+    })
+    _event_classes[key] = cls
+    return cls
 
 
 class CommandEvent(Event):
-    #: The command invoked (minus any trigger characters).
-    command = None
-    #: User string for the source of the command.
-    user = None
-    #: Channel that the command was received on.
-    channel = None
-    #: Was the bot addressed directly, either by nick or in private chat?
-    #: This will be False if the command was triggered by just the command
-    #: prefix in a public channel.
-    direct = False
-    #: The rest of the line after the command name.
-    raw_data = None
-    #: Cached argument list, see :attr:`data`.
-    data_ = None
+    """A command invoked by a user, fired as a ``command`` event.
+
+    As well as the attributes of all events, these have the following:
+
+    .. attribute:: command
+
+        The command invoked (minus any trigger characters).
+
+    .. attribute:: user
+
+        User string for the source of the command.
+
+    .. attribute:: channel
+
+        Channel that the command was received on.
+
+    .. attribute:: direct
+
+        Was the bot addressed directly, either by nick or in private chat?
+        This will be False if the command was triggered by just the command
+        prefix in a public channel.
+
+    .. attribute:: raw_data
+
+        The rest of the line after the command name.
+    """
+    __slots__ = ('command', 'user', 'channel', 'direct', 'raw_data', 'data_',
+                 'recorder')
+
+    event_type = 'command'
+    attributes = ('command', 'user', 'channel', 'direct', 'raw_data')
+
+    def __init__(self, bot, protocol, command, user, channel, direct,
+                 raw_data):
+        Event.__init__(self, bot, protocol)
+        self.command = command
+        self.user = user
+        self.channel = channel
+        self.direct = direct
+        self.raw_data = raw_data
+        # Cached argument list, see data
+        self.data_ = None
+        # List that replies are recorded in, see .cache.ResponseCache
+        self.recorder = None
 
     @staticmethod
     def create(event):
         """Attempt to create a :class:`CommandEvent` from an :class:`Event`.
 
         Returns None if *event* does not contain a command, otherwise returns a
-        :class:`CommandEvent`.
+        :class:`CommandEvent`.  Commands are recognised by the
+        :class:`CommandMatcher` of the protocol that received *event*.
         """
-        command_prefix = event.bot.config.get('DEFAULT', 'command_prefix')
-        own_nick = event.protocol.nickname
-        msg = event.message
-        channel = event.channel
-
-        command = None
-        direct = False
-
-        if is_channel(channel):
-            # In channel, must be triggered explicitly
-            if msg.startswith(command_prefix):
-                # Triggered by command prefix: "<prefix><cmd> <args>"
-                command = msg[len(command_prefix):]
-            elif msg.startswith(own_nick):
-                # Addressing the bot by name: "<nick>, <cmd> <args>"
-                msg = msg[len(own_nick):].lstrip()
-                # Check that the bot was specifically addressed, rather than
-                # a similar nick or just talking about the bot
-                if len(msg) > 0 and msg[0] in ',:;.':
-                    command = msg.lstrip(',:;.')
-                    direct = True
-        else:
-            command = msg
-            direct = True
-
-        if command is None or command.strip() == '':
+        match = event.protocol.command_matcher.match(
+                event.message, not is_channel(event.channel))
+        if match is None:
             return None
 
-        command = command.split(None, 1)
-        cmd = command[0]
-        data = command[1] if len(command) == 2 else ''
-        return CommandEvent(event.bot, event.protocol, 'command', {
-            'command': command,
-            'datetime': event.datetime,
-            'user': event.user,
-            'channel': event.channel,
-            'command': cmd,
-            'direct': direct,
-            'raw_data': data,
-        })
+        cmd, data, direct = match
+        command = CommandEvent(event.bot, event.protocol, cmd, event.user,
+                               event.channel, direct, data)
+        # The command was received at the same time as the message
+        command.timestamp = event.timestamp
+        return command
 
     @property
     def data(self):
@@ -222,13 +321,13 @@ class CommandEvent(Event):
         The parsed argument list is cached on first use so repeatedly accessing
         elements of this attribute is cheap.  If :attr:`raw_data` couldn't be
         parsed then accessing this attribute might raise a
-        :exc:`~exceptions.ValueError`.
+        :exc:`.util.ParseError`, which is a :exc:`~exceptions.ValueError`.
         """
         if self.data_ is None:
             try:
                 self.data_ = parse_arguments(self.raw_data)
-            except ValueError as e:
-                self.error('Unmatched quotation marks')
+            except ParseError as e:
+                self.error('{} at character {}'.format(e, e.position + 1))
                 raise e
         return self.data_
 
@@ -237,15 +336,88 @@ class CommandEvent(Event):
 
         All plugin responses should be via this method.  The :attr:`user` is
         addressed by name if the response is in a channel rather than a private
-        chat.  If *is_verbose* is True, the reply is suppressed unless the bot
-        was addressed directly, i.e. in private chat or by name in a channel.
+        chat.  Replies are sent ahead of other queued messages, see
+        :class:`.OutboundScheduler`.  If *is_verbose* is True, the reply is
+        suppressed unless the bot was addressed directly, i.e. in private chat
+        or by name in a channel.
         """
+        if self.recorder is not None:
+            self.recorder.append((msg, is_verbose))
         if self.channel == self.protocol.nickname:
-            self.protocol.msg(nick(self.user), msg)
+            self.protocol.msg(nick(self.user), msg, priority=PRIORITY_REPLY)
         elif self.direct or not is_verbose:
-            self.protocol.msg(self.channel,
-                              nick(self.user) + ': ' + msg)
+            self.protocol.msg(self.channel, nick(self.user) + ': ' + msg,
+                              priority=PRIORITY_REPLY)
 
     def error(self, err):
         """Send an error message."""
         self.reply('Error: ' + err, is_verbose=True)
+
+
+class CommandMatcher(object):
+    """Recognises commands in messages.
+
+    In a channel a command must be triggered explicitly, either by one of the
+    command *prefixes* (``"<prefix><cmd> <args>"``) or by addressing the bot by
+    one of its *nicks* (``"<nick>, <cmd> <args>"``, where the nick is followed
+    by one or more of ``,:;.``).  In a private chat the whole message is the
+    command.  The rules are compiled into a single regular expression, so
+    messages that aren't commands are rejected in one pass whatever the number
+    of prefixes and nicks.
+
+    >>> m = CommandMatcher(['!'], ['csyorkbot'])
+    >>> m.match('!seen Alan')
+    ('seen', 'Alan', False)
+    >>> m.match('csyorkbot: seen  Alan ')
+    ('seen', 'Alan ', True)
+    >>> m.match('seen Alan', private=True)
+    ('seen', 'Alan', True)
+    >>> m.match('csyorkbot is great') is None
+    True
+    """
+    #: Matches the command and its arguments at the end of a message
+    COMMAND = r'\s*(?P<command>\S+)(?:\s+(?P<data>.*))?\Z'
+
+    def __init__(self, prefixes, nicks):
+        self.prefixes = tuple(prefixes)
+        self.nicks = tuple(nicks)
+
+        triggers = []
+        if self.prefixes:
+            triggers.append(self._alternatives(self.prefixes))
+        if self.nicks:
+            triggers.append(r'(?P<nick>{})\s*[,:;.]+'.format(
+                self._alternatives(self.nicks)))
+        if triggers:
+            self.channel_re = re.compile(
+                    '(?:{})'.format('|'.join(triggers)) + self.COMMAND,
+                    re.DOTALL)
+        else:
+            self.channel_re = None
+        self.private_re = re.compile(self.COMMAND, re.DOTALL)
+
+    @staticmethod
+    def _alternatives(strings):
+        # Longest first, so that a prefix which starts with another prefix
+        # still gets matched
+        return '|'.join(re.escape(s)
+                        for s in sorted(set(strings), key=len, reverse=True))
+
+    def match(self, message, private=False):
+        """Match *message* against the command rules.
+
+        Returns None if *message* isn't a command, otherwise returns a
+        ``(command, raw_data, direct)`` tuple.  *private* indicates the message
+        was received in a private chat.
+        """
+        if private:
+            m = self.private_re.match(message)
+        elif self.channel_re is not None:
+            m = self.channel_re.match(message)
+        else:
+            return None
+
+        if m is None:
+            return None
+        return (m.group('command'), m.group('data') or '',
+                private or m.group('nick') is not None)
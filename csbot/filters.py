@@ -0,0 +1,281 @@
+"""Declarative filters for plugin hooks.
+
+A hook can say which events it is interested in when it is registered::
+
+    @features.hook('privmsg', channel='#cs-york', message=r'https?://')
+    def link(self, event):
+        ...
+
+rather than being called for every event and checking for itself.  The bot
+compiles the filters of every plugin's hooks for an event type into a single
+:class:`HookMatcher`, which works out which handlers want each event without
+calling any of the others:
+
+- channels are looked up in a dictionary
+- nick and hostmask patterns are combined into a few regular expressions
+- message regular expressions are combined into a few regular expressions,
+  so that a message which matches none of them, the usual case, is rejected
+  with a single search
+
+Each handler is represented by a bit in an integer mask, and the matching
+handlers are those whose bit survives each of the checks.
+"""
+import re
+import sre_parse
+import sre_constants
+
+
+def glob_to_regex(pattern):
+    """Convert a ``*`` and ``?`` wildcard pattern for a nick or hostmask into
+    a regular expression.  A pattern without a ``!`` only has to match the
+    nick.
+
+    >>> re.match(glob_to_regex('alan*'), 'alanb!~alan@example.com') is None
+    False
+    >>> re.match(glob_to_regex('*!*@*.york.ac.uk'), 'alan!~a@example.com')
+    """
+    regex = ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c)
+                    for c in pattern)
+    if '!' not in pattern:
+        regex += '(?:!.*)?'
+    return regex + r'\Z'
+
+
+def starts_at_beginning(regex):
+    """Check if compiled *regex* can only match at the start of a string, so
+    that ``regex.match`` finds the same matches as ``regex.search``.
+
+    >>> starts_at_beginning(re.compile('^!?hello')), \\
+    ...     starts_at_beginning(re.compile('^hello|bye'))
+    (True, False)
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (re.error, sre_constants.error):
+        return False
+    if len(parsed) == 0:
+        return False
+    op, arg = parsed[0]
+    return op == sre_constants.AT and (
+        arg == sre_constants.AT_BEGINNING_STRING or
+        (arg == sre_constants.AT_BEGINNING and
+         not regex.flags & re.MULTILINE))
+
+
+def _strings(value):
+    """Make a tuple of strings from a string or an iterable of strings."""
+    if isinstance(value, basestring):
+        return (value,)
+    return tuple(value)
+
+
+class Filter(object):
+    """Conditions on an event that a hook is interested in; an event must
+    meet all of them.
+
+    *channel* is a channel name or list of names, compared
+    case-insensitively with the event's ``channel``.  *user* is a wildcard
+    pattern or list of patterns (see :func:`glob_to_regex`) for the event's
+    ``user``, also case-insensitive.  *message* is a regular expression,
+    either a string or compiled, that must be found in the event's
+    ``message``.  Events without the attribute being filtered on never match.
+
+    >>> from csbot.events import event_class
+    >>> Privmsg = event_class('privmsg', ('user', 'channel', 'message'))
+    >>> f = Filter(channel='#cs-york', message='^!?hello')
+    >>> f.matches(Privmsg(None, None, 'alan!~a@host', '#CS-York', 'hello'))
+    True
+    >>> f.matches(Privmsg(None, None, 'alan!~a@host', '#cs-york', 'hi'))
+    False
+    """
+    def __init__(self, channel=None, user=None, message=None):
+        #: The arguments the filter was created with
+        arguments = (('channel', channel), ('user', user),
+                     ('message', message))
+        self.arguments = dict((k, v) for k, v in arguments if v is not None)
+        self.channels = None
+        if channel is not None:
+            self.channels = frozenset(c.lower() for c in _strings(channel))
+        self.user = None
+        if user is not None:
+            self.user = re.compile('|'.join(
+                '(?:{})'.format(glob_to_regex(p)) for p in _strings(user)),
+                re.IGNORECASE)
+        self.message = None
+        if message is not None:
+            self.message = re.compile(message)
+
+    def __repr__(self):
+        return 'Filter({})'.format(', '.join(
+            '{}={!r}'.format(k, v) for k, v in sorted(self.arguments.items())))
+
+    def matches(self, event):
+        """Check *event* against the filter on its own, without a
+        :class:`HookMatcher`.
+        """
+        if self.channels is not None:
+            channel = getattr(event, 'channel', None)
+            if channel is None or channel.lower() not in self.channels:
+                return False
+        if self.user is not None:
+            user = getattr(event, 'user', None)
+            if user is None or self.user.match(user) is None:
+                return False
+        if self.message is not None:
+            message = getattr(event, 'message', None)
+            if message is None or self.message.search(message) is None:
+                return False
+        return True
+
+
+class RegexSet(object):
+    """Finds which of a set of regular expressions match a string.
+
+    *regexes* is a list of ``(bit, regex)`` pairs, where *regex* is a string
+    or a compiled regular expression.  Regular expressions that can be are
+    combined into alternations, which are searched first, so that only the
+    expressions in an alternation that matched need to be tried separately.
+    *flags* are used to compile the strings.  If *anchored* is True the
+    expressions must match at the start of the string rather than anywhere
+    in it.  Expressions which begin with ``^`` are kept apart from the
+    others, since an alternation of them only has to be tried at the start
+    of the string.
+
+    >>> s = RegexSet([(1, 'foo'), (2, 'ba[rz]'), (4, re.compile('BAZ', re.I))])
+    >>> s.match('baz'), s.match('qux')
+    (6, 0)
+    """
+    #: Python's regular expressions can't have more groups than this
+    MAX_GROUPS = 99
+    #: Backreferences by number, which would be wrong in an alternation
+    BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, regexes, flags=0, anchored=False):
+        # (alternation, bits in it, [(bit, regex)], use match)
+        self.groups = []
+        # Use match -> (batch, number of groups in it)
+        batches = {False: ([], 0), True: ([], 0)}
+        for bit, regex in regexes:
+            if isinstance(regex, basestring):
+                regex = re.compile(regex, flags)
+            use_match = anchored or starts_at_beginning(regex)
+            if regex.flags != flags or regex.groupindex or \
+                    self.BACKREFERENCE.search(regex.pattern):
+                # Can't be combined with the others
+                self.add_group([(bit, regex)], use_match=use_match)
+                continue
+            batch, batch_groups = batches[use_match]
+            if batch and batch_groups + regex.groups >= self.MAX_GROUPS:
+                self.add_group(batch, flags, use_match)
+                batch, batch_groups = [], 0
+            batch.append((bit, regex))
+            batches[use_match] = (batch, batch_groups + regex.groups)
+        for use_match, (batch, batch_groups) in sorted(batches.items()):
+            if batch:
+                self.add_group(batch, flags, use_match)
+
+    def add_group(self, regexes, flags=0, use_match=False):
+        mask = 0
+        for bit, regex in regexes:
+            mask |= bit
+        if len(regexes) == 1:
+            alternation = regexes[0][1]
+        else:
+            try:
+                alternation = re.compile('|'.join(
+                    '(?:{})'.format(r.pattern) for bit, r in regexes), flags)
+            except re.error:
+                for regex in regexes:
+                    self.add_group([regex], use_match=use_match)
+                return
+        self.groups.append((alternation, mask, regexes, use_match))
+
+    def match(self, text, candidates=-1):
+        """Get the bits of the regular expressions which are found in
+        *text*, only trying those whose bits are in *candidates*.
+        """
+        result = 0
+        for alternation, mask, regexes, use_match in self.groups:
+            if not mask & candidates:
+                continue
+            find = alternation.match if use_match else alternation.search
+            if find(text) is None:
+                continue
+            if len(regexes) == 1:
+                result |= mask
+                continue
+            for bit, regex in regexes:
+                if not bit & candidates:
+                    continue
+                find = regex.match if use_match else regex.search
+                if find(text) is not None:
+                    result |= bit
+        return result
+
+
+class HookMatcher(object):
+    """Works out which of a list of filtered hooks an event should go to.
+
+    *entries* is a list of ``(filter, handler)`` pairs, and :meth:`match`
+    returns the handlers whose :class:`Filter` matches an event, in the same
+    order.
+    """
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.handlers = [h for f, h in self.entries]
+        # Handlers which don't filter on each attribute
+        self.any_channel = 0
+        self.any_user = 0
+        self.any_message = 0
+        # Lowercase channel name -> mask of handlers for it
+        self.channels = dict()
+        users = []
+        messages = []
+
+        for i, (f, handler) in enumerate(self.entries):
+            bit = 1 << i
+            if f.channels is None:
+                self.any_channel |= bit
+            else:
+                for channel in f.channels:
+                    self.channels[channel] = \
+                        self.channels.get(channel, 0) | bit
+            if f.user is None:
+                self.any_user |= bit
+            else:
+                users.append((bit, f.user))
+            if f.message is None:
+                self.any_message |= bit
+            else:
+                messages.append((bit, f.message))
+
+        self.users = RegexSet(users, re.IGNORECASE, anchored=True)
+        self.messages = RegexSet(messages)
+
+    def match(self, event):
+        """Get the handlers that want *event*."""
+        mask = self.any_channel
+        if self.channels:
+            channel = getattr(event, 'channel', None)
+            if channel is not None:
+                mask |= self.channels.get(channel.lower(), 0)
+        if mask & ~self.any_user:
+            user = getattr(event, 'user', None)
+            allowed = self.any_user
+            if user is not None:
+                allowed |= self.users.match(user, mask & ~self.any_user)
+            mask &= allowed
+        if mask & ~self.any_message:
+            message = getattr(event, 'message', None)
+            allowed = self.any_message
+            if message is not None:
+                allowed |= self.messages.match(message,
+                                               mask & ~self.any_message)
+            mask &= allowed
+
+        handlers = []
+        while mask:
+            low = mask & -mask
+            handlers.append(self.handlers[low.bit_length() - 1])
+            mask ^= low
+        return handlers
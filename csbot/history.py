@@ -0,0 +1,853 @@
+"""An indexed, searchable store of channel messages.
+
+Messages are indexed by the words in them, and by who said them and where,
+in an inverted index: for each of these *terms*, the list of messages that
+have it, in the order they were added.  A query looks up the lists for its
+terms and walks them backwards together, so the newest matches are found
+first and only as many messages are read as there are results wanted.
+
+New messages go into an in-memory :class:`MemTable`, and are appended to a
+journal so they survive a restart.  Once the memtable has *flush_size*
+messages, it is written out in the background as an immutable
+:class:`Segment` file, which is memory-mapped for queries, so segments cost
+no memory until they are used and looking a term up reads only the pages it
+needs.  Segments of similar size are merged in the background, *merge_factor*
+at a time, to keep their number down to a few per order of magnitude.  The
+live segments are listed in a ``MANIFEST`` file, replaced atomically after
+each flush and merge, so an interrupted one just leaves files that are
+cleaned up next time the store is opened.
+
+Segment files start with a header (see :data:`HEADER`) giving the number of
+messages and terms, the range of timestamps, and the offsets of these
+sections:
+
+``doc_offsets``
+    Offset in ``docs`` of each message, and of the end of the last one.
+``timestamps``
+    Each message's timestamp, never less than the previous one's, so that a
+    time range can be found by binary search.
+``docs``
+    The messages, each :mod:`marshal`-ed as a :class:`Message` tuple.
+``term_offsets``
+    Offset in ``terms`` of each term, sorted, and of the end of the last.
+``posting_offsets``
+    Index in ``postings`` of each term's messages, and of the end.
+``terms``
+    The terms.
+``postings``
+    Each term's messages, as ascending 32-bit message numbers.
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import heapq
+import struct
+import random
+import marshal
+import itertools
+import collections
+from array import array
+from bisect import bisect_left, bisect_right
+
+from twisted.internet import task, threads
+from twisted.python import log
+
+from csbot.channels import irc_lower
+from csbot.keyval import encode_record, read_records
+
+
+#: A message in the store
+Message = collections.namedtuple(
+    'Message', 'timestamp network channel nick text action')
+
+#: Segment file format identifier
+MAGIC = 'CSHS'
+#: Segment file format version
+VERSION = 1
+#: Segment header: magic, version, message count, term count, earliest and
+#: latest timestamp, then the offsets of the sections
+HEADER = struct.Struct('<4sIQQdd7Q')
+#: Segment sections, in the order they are stored
+SECTIONS = ('doc_offsets', 'timestamps', 'docs', 'term_offsets',
+            'posting_offsets', 'terms', 'postings')
+
+#: Matches the words that messages are indexed by
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def words(text):
+    """Get the set of words in *text*, a UTF-8 string, case-folded.
+
+    >>> sorted(words('Anybody seen the lecture notes? The LECTURE notes!'))
+    ['anybody', 'lecture', 'notes', 'seen', 'the']
+    """
+    return set(w.encode('utf-8') for w in
+               WORD.findall(text.decode('utf-8', 'replace').lower()))
+
+
+def nick_term(nick):
+    """Get the term that messages from *nick* are indexed by."""
+    return '\x01' + irc_lower(nick)
+
+
+def channel_term(network, channel):
+    """Get the term that messages in *channel* on *network* are indexed
+    by.
+    """
+    return '\x02{}\x00{}'.format(network, irc_lower(channel))
+
+
+def message_terms(message):
+    terms = words(message.text)
+    terms.add(nick_term(message.nick))
+    terms.add(channel_term(message.network, message.channel))
+    return terms
+
+
+def pack_ids(ids):
+    """Pack an ``array('I')`` of message numbers as little-endian bytes."""
+    if sys.byteorder == 'big':
+        ids = array('I', ids)
+        ids.byteswap()
+    return ids.tostring()
+
+
+def unpack_ids(data):
+    ids = array('I')
+    ids.fromstring(data)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def contains(ids, i):
+    """Check if *i* is in *ids*, a sorted sequence."""
+    j = bisect_left(ids, i)
+    return j < len(ids) and ids[j] == i
+
+
+def intersect_descending(lists, lo, hi):
+    """Yield the numbers in every one of *lists*, sorted sequences, that are
+    at least *lo* and less than *hi*, in descending order.
+
+    Each list in turn is searched for the largest number no greater than the
+    current candidate, so runs of numbers that can't match are skipped over.
+
+    >>> list(intersect_descending([[1, 3, 5, 7, 9], [2, 3, 4, 9], [3, 9]],
+    ...                           0, 10))
+    [9, 3]
+    """
+    n = len(lists)
+    if n == 1:
+        # Nothing to skip over
+        ids = lists[0]
+        for j in xrange(bisect_left(ids, hi) - 1,
+                        bisect_left(ids, lo) - 1, -1):
+            yield ids[j]
+        return
+    bounds = [len(postings) for postings in lists]
+    target = hi - 1
+    agreed = 0
+    k = 0
+    while True:
+        ids = lists[k]
+        j = bisect_right(ids, target, 0, bounds[k]) - 1
+        if j < 0:
+            return
+        bounds[k] = j + 1
+        value = ids[j]
+        if value < lo:
+            return
+        if value == target:
+            agreed += 1
+        else:
+            target = value
+            agreed = 1
+        if agreed == n:
+            yield target
+            target -= 1
+            agreed = 0
+        k = (k + 1) % n
+
+
+class Query(object):
+    """What to look for in a :class:`HistoryStore`.
+
+    Matching messages contain every one of *phrases* (case-insensitively),
+    are from *nick* and in *channel* on *network* if given, and are from no
+    earlier than *start* and before *end* if given.
+    """
+    def __init__(self, phrases=(), nick=None, network=None, channel=None,
+                 start=None, end=None):
+        self.phrases = [p.decode('utf-8', 'replace').lower().strip()
+                        for p in phrases]
+        self.phrases = [p for p in self.phrases if p]
+        #: The indexed words in the phrases
+        self.words = set()
+        for phrase in phrases:
+            self.words.update(words(phrase))
+        terms = set(self.words)
+        if nick is not None:
+            terms.add(nick_term(nick))
+        if channel is not None:
+            terms.add(channel_term(network, channel))
+        self.terms = sorted(terms)
+        self.start = start
+        self.end = end
+
+    def matches(self, message):
+        """Check the phrases against *message*, which has every term."""
+        if not self.phrases:
+            return True
+        text = message.text.decode('utf-8', 'replace').lower()
+        return all(p in text for p in self.phrases)
+
+
+class PackedArray(object):
+    """A read-only sequence of *length* numbers packed in *buf* at *start*,
+    in :mod:`struct` format *fmt*, little-endian.
+    """
+    __slots__ = ('buf', 'start', 'length', 'unpack', 'size')
+
+    def __init__(self, buf, start, length, fmt):
+        packer = struct.Struct('<' + fmt)
+        self.buf = buf
+        self.start = start
+        self.length = length
+        self.unpack = packer.unpack_from
+        self.size = packer.size
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return self.unpack(self.buf, self.start + i * self.size)[0]
+
+
+class MemTable(object):
+    """The newest messages, indexed in memory until they are written out as
+    a segment.  *generation* numbers the memtable, and its journal.
+    """
+    def __init__(self, generation):
+        self.generation = generation
+        self.docs = []
+        # Timestamps, never less than the previous one
+        self.timestamps = []
+        # Term -> list of message numbers
+        self.index = dict()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, message):
+        i = len(self.docs)
+        self.docs.append(message)
+        timestamps = self.timestamps
+        if timestamps and message.timestamp < timestamps[-1]:
+            timestamps.append(timestamps[-1])
+        else:
+            timestamps.append(message.timestamp)
+        index = self.index
+        for term in message_terms(message):
+            postings = index.get(term)
+            if postings is None:
+                index[term] = [i]
+            else:
+                postings.append(i)
+
+    def doc(self, i):
+        return self.docs[i]
+
+    def postings(self, term):
+        return self.index.get(term, ())
+
+    def time_range(self, start, end):
+        """Get the range of message numbers from *start* up to *end*."""
+        return (0 if start is None else bisect_left(self.timestamps, start),
+                len(self) if end is None else
+                bisect_left(self.timestamps, end))
+
+
+class Segment(object):
+    """A memory-mapped segment file; see the module documentation."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.map)
+        if fields[:2] != (MAGIC, VERSION):
+            self.map.close()
+            raise ValueError('Not a history segment: {}'.format(path))
+        (self.doc_count, self.term_count,
+         self.min_time, self.max_time) = fields[2:6]
+        sections = dict(zip(SECTIONS, fields[6:]))
+        self.doc_offsets = PackedArray(self.map, sections['doc_offsets'],
+                                       self.doc_count + 1, 'Q')
+        self.timestamps = PackedArray(self.map, sections['timestamps'],
+                                      self.doc_count, 'd')
+        self.term_offsets = PackedArray(self.map, sections['term_offsets'],
+                                        self.term_count + 1, 'Q')
+        self.posting_offsets = PackedArray(self.map,
+                                           sections['posting_offsets'],
+                                           self.term_count + 1, 'Q')
+        self.docs_start = sections['docs']
+        self.terms_start = sections['terms']
+        self.postings_start = sections['postings']
+
+    def __len__(self):
+        return self.doc_count
+
+    def close(self):
+        self.map.close()
+
+    def raw_doc(self, i):
+        start = self.docs_start
+        return self.map[start + self.doc_offsets[i]:
+                        start + self.doc_offsets[i + 1]]
+
+    def doc(self, i):
+        return Message(*marshal.loads(self.raw_doc(i)))
+
+    def term(self, i):
+        start = self.terms_start
+        return self.map[start + self.term_offsets[i]:
+                        start + self.term_offsets[i + 1]]
+
+    def find(self, term):
+        """Get the index of *term*, or None if no message has it."""
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.term_count and self.term(lo) == term:
+            return lo
+        return None
+
+    def postings(self, term):
+        i = self.find(term)
+        if i is None:
+            return ()
+        start = self.posting_offsets[i]
+        return PackedArray(self.map, self.postings_start + 4 * start,
+                           self.posting_offsets[i + 1] - start, 'I')
+
+    def postings_array(self, i):
+        """Read the postings of the *i*'th term into an array."""
+        start = self.postings_start
+        return unpack_ids(self.map[start + 4 * self.posting_offsets[i]:
+                                   start + 4 * self.posting_offsets[i + 1]])
+
+    def time_range(self, start, end):
+        """Get the range of message numbers from *start* up to *end*."""
+        if ((start is not None and start > self.max_time) or
+                (end is not None and end <= self.min_time)):
+            return 0, 0
+        return (0 if start is None else bisect_left(self.timestamps, start),
+                len(self) if end is None else
+                bisect_left(self.timestamps, end))
+
+    def iter_terms(self, n):
+        """Yield ``(term, n, index)`` for each term, in order."""
+        for i in xrange(self.term_count):
+            yield self.term(i), n, i
+
+
+class SegmentWriter(object):
+    """Writes a segment file to *path*.
+
+    Messages must be added in order, then terms in sorted order.  Each
+    section is written to its own temporary file as it goes, so that
+    merging large segments doesn't need them in memory, and the sections
+    are put together by :meth:`finish`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parts = dict((s, open('{}.{}.tmp'.format(path, s), 'w+b'))
+                          for s in SECTIONS)
+        self.doc_count = 0
+        self.term_count = 0
+        self.docs_size = 0
+        self.terms_size = 0
+        self.postings_size = 0
+        self.min_time = None
+        self.max_time = None
+        self.parts['doc_offsets'].write(struct.pack('<Q', 0))
+        self.parts['term_offsets'].write(struct.pack('<Q', 0))
+        self.parts['posting_offsets'].write(struct.pack('<Q', 0))
+
+    def add_doc(self, timestamp, data):
+        """Add a message, already :mod:`marshal`-ed as *data*."""
+        if self.max_time is not None and timestamp < self.max_time:
+            timestamp = self.max_time
+        if self.min_time is None:
+            self.min_time = timestamp
+        self.max_time = timestamp
+        self.parts['docs'].write(data)
+        self.docs_size += len(data)
+        self.parts['doc_offsets'].write(struct.pack('<Q', self.docs_size))
+        self.parts['timestamps'].write(struct.pack('<d', timestamp))
+        self.doc_count += 1
+
+    def add_segment_docs(self, segment):
+        """Add all of *segment*'s messages, copying the sections in bulk."""
+        n = len(segment)
+        if not n:
+            return
+        timestamps = array('d')
+        timestamps.fromstring(segment.map[segment.timestamps.start:
+                                          segment.timestamps.start + 8 * n])
+        if sys.byteorder == 'big':
+            timestamps.byteswap()
+        i = 0
+        while (self.max_time is not None and i < n and
+               timestamps[i] < self.max_time):
+            timestamps[i] = self.max_time
+            i += 1
+        if self.min_time is None:
+            self.min_time = timestamps[0]
+        self.max_time = timestamps[-1]
+        if sys.byteorder == 'big':
+            timestamps.byteswap()
+        self.parts['timestamps'].write(timestamps.tostring())
+
+        offsets = struct.unpack_from('<{}Q'.format(n + 1), segment.map,
+                                     segment.doc_offsets.start)
+        base = self.docs_size
+        self.parts['doc_offsets'].write(struct.pack(
+            '<{}Q'.format(n), *[o + base for o in offsets[1:]]))
+        start = segment.docs_start
+        end = start + offsets[-1]
+        chunk = 1 << 20
+        while start < end:
+            self.parts['docs'].write(segment.map[start:min(start + chunk,
+                                                           end)])
+            start += chunk
+        self.docs_size += offsets[-1]
+        self.doc_count += n
+
+    def add_term(self, term, ids):
+        """Add *term*, found in the messages numbered *ids*, an
+        ``array('I')``.
+        """
+        self.parts['terms'].write(term)
+        self.terms_size += len(term)
+        self.parts['term_offsets'].write(struct.pack('<Q', self.terms_size))
+        self.parts['postings'].write(pack_ids(ids))
+        self.postings_size += len(ids)
+        self.parts['posting_offsets'].write(struct.pack('<Q',
+                                                        self.postings_size))
+        self.term_count += 1
+
+    def finish(self):
+        """Put the sections together and move the file into place."""
+        offsets = []
+        position = HEADER.size
+        for s in SECTIONS:
+            offsets.append(position)
+            position += self.parts[s].tell()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.doc_count,
+                                self.term_count, self.min_time or 0,
+                                self.max_time or 0, *offsets))
+            for s in SECTIONS:
+                part = self.parts[s]
+                part.seek(0)
+                while True:
+                    data = part.read(1 << 20)
+                    if not data:
+                        break
+                    f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.discard()
+        os.rename(tmp, self.path)
+
+    def discard(self):
+        for part in self.parts.itervalues():
+            part.close()
+            os.remove(part.name)
+
+
+def write_memtable(path, memtable):
+    """Write *memtable* out as a segment at *path*."""
+    writer = SegmentWriter(path)
+    try:
+        for message, timestamp in itertools.izip(memtable.docs,
+                                                 memtable.timestamps):
+            writer.add_doc(timestamp, marshal.dumps(tuple(message), 2))
+        for term in sorted(memtable.index):
+            writer.add_term(term, array('I', memtable.index[term]))
+        writer.finish()
+    except Exception:
+        writer.discard()
+        raise
+
+
+def merge_segments(path, segments):
+    """Merge *segments*, oldest first, into a new segment at *path*."""
+    writer = SegmentWriter(path)
+    try:
+        bases = []
+        for segment in segments:
+            bases.append(writer.doc_count)
+            writer.add_segment_docs(segment)
+        merged = heapq.merge(*[s.iter_terms(n)
+                               for n, s in enumerate(segments)])
+        for term, group in itertools.groupby(merged, lambda t: t[0]):
+            ids = array('I')
+            for _, n, i in group:
+                postings = segments[n].postings_array(i)
+                base = bases[n]
+                if base:
+                    postings = array('I', [x + base for x in postings])
+                ids.extend(postings)
+            writer.add_term(term, ids)
+        writer.finish()
+    except Exception:
+        writer.discard()
+        raise
+
+
+class TooBroad(Exception):
+    """Raised by :meth:`HistoryStore.search` when it has checked as many
+    messages against a query as it's allowed to.
+    """
+
+
+class HistoryStore(object):
+    """A searchable store of messages, kept in the directory *path*.
+
+    Messages are journalled straight away but only synced to disk by
+    :meth:`sync`, which :meth:`start` arranges to happen every *interval*
+    seconds.  Memtables are written out once they hold *flush_size*
+    messages, and segments merged *merge_factor* at a time, by
+    *run_in_thread*, one job at a time.
+    """
+    #: How many matches :meth:`random_match` considers, at most, when the
+    #: candidates it samples rarely match
+    RANDOM_SCAN_LIMIT = 1000
+    #: How many messages :meth:`search` checks against a query, by default,
+    #: before giving up
+    SEARCH_SCAN_LIMIT = 1000
+
+    def __init__(self, path, flush_size=50000, merge_factor=4,
+                 run_in_thread=threads.deferToThread):
+        self.path = path
+        self.flush_size = flush_size
+        self.merge_factor = merge_factor
+        self.run_in_thread = run_in_thread
+        # Segments, oldest first
+        self.segments = []
+        # Memtables waiting to be written out, oldest first
+        self.frozen = []
+        # Next memtable or segment number
+        self.generation = 0
+        # Newest memtable written out
+        self.flushed = -1
+        self.busy = False
+        self.closed = False
+        self.dirty = False
+        self.timer = None
+        self.reset_stats()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.load()
+        self.memtable = MemTable(self.next_generation())
+        self.journal = open(self.journal_path(self.memtable.generation), 'ab')
+        self.work()
+
+    def next_generation(self):
+        self.generation += 1
+        return self.generation - 1
+
+    def journal_path(self, generation):
+        return os.path.join(self.path, 'journal-{:08d}.log'.format(generation))
+
+    def segment_path(self, generation):
+        return os.path.join(self.path, 'segment-{:08d}.seg'.format(generation))
+
+    def load(self):
+        """Open the segments in the manifest, tidy up after interrupted
+        flushes and merges, and replay journals that weren't written out.
+        """
+        manifest = os.path.join(self.path, 'MANIFEST')
+        names = []
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                state = json.load(f)
+            self.generation = state['generation']
+            self.flushed = state['flushed']
+            names = state['segments']
+        self.segments = [Segment(os.path.join(self.path, name))
+                         for name in names]
+
+        journals = []
+        for filename in os.listdir(self.path):
+            path = os.path.join(self.path, filename)
+            if filename.endswith('.tmp') or (filename.endswith('.seg') and
+                                             filename not in names):
+                os.remove(path)
+            elif filename.startswith('journal-'):
+                generation = int(filename[8:-4])
+                if generation <= self.flushed:
+                    os.remove(path)
+                else:
+                    journals.append(generation)
+
+        for generation in sorted(journals):
+            memtable = MemTable(generation)
+            with open(self.journal_path(generation), 'rb') as f:
+                for record, item in read_records(f.read()):
+                    memtable.add(Message(*item))
+            if len(memtable):
+                self.frozen.append(memtable)
+            else:
+                os.remove(self.journal_path(generation))
+            self.generation = max(self.generation, generation + 1)
+
+    def save_manifest(self):
+        manifest = os.path.join(self.path, 'MANIFEST')
+        with open(manifest + '.tmp', 'w') as f:
+            json.dump({'generation': self.generation,
+                       'flushed': self.flushed,
+                       'segments': [os.path.basename(s.path)
+                                    for s in self.segments]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(manifest + '.tmp', manifest)
+
+    def add(self, timestamp, network, channel, nick, text, action=False):
+        """Add a message."""
+        message = Message(timestamp, network, channel, nick, text, action)
+        self.journal.write(encode_record(tuple(message)))
+        self.dirty = True
+        self.memtable.add(message)
+        self.added += 1
+        if len(self.memtable) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Start writing out the current memtable in the background."""
+        if not len(self.memtable):
+            return
+        self.sync()
+        self.journal.close()
+        self.frozen.append(self.memtable)
+        self.memtable = MemTable(self.next_generation())
+        self.journal = open(self.journal_path(self.memtable.generation), 'ab')
+        self.work()
+
+    def work(self):
+        """Start the next background job, if there is one and nothing else
+        is running: writing out the oldest memtable, or merging segments.
+        """
+        if self.busy or self.closed:
+            return
+        if self.frozen:
+            memtable = self.frozen[0]
+            path = self.segment_path(memtable.generation)
+            self.busy = True
+            d = self.run_in_thread(write_memtable, path, memtable)
+            d.addCallback(self.memtable_written, memtable, path)
+        else:
+            segments = self.merge_candidates()
+            if segments is None:
+                return
+            path = self.segment_path(self.next_generation())
+            self.busy = True
+            d = self.run_in_thread(merge_segments, path, segments)
+            d.addCallback(self.segments_merged, segments, path)
+        d.addErrback(self.work_failed)
+
+    def memtable_written(self, result, memtable, path):
+        self.busy = False
+        if self.closed:
+            return
+        self.segments.append(Segment(path))
+        self.frozen.remove(memtable)
+        self.flushed = memtable.generation
+        self.save_manifest()
+        os.remove(self.journal_path(memtable.generation))
+        self.flushes += 1
+        self.work()
+
+    def segments_merged(self, result, segments, path):
+        self.busy = False
+        if self.closed:
+            return
+        i = self.segments.index(segments[0])
+        self.segments[i:i + len(segments)] = [Segment(path)]
+        self.save_manifest()
+        for segment in segments:
+            segment.close()
+            os.remove(segment.path)
+        self.merges += 1
+        self.work()
+
+    def work_failed(self, failure):
+        self.busy = False
+        log.err(failure, 'History store background job failed')
+
+    def level(self, size):
+        level = 0
+        limit = self.flush_size * self.merge_factor
+        while size >= limit:
+            level += 1
+            limit *= self.merge_factor
+        return level
+
+    def merge_candidates(self):
+        """Find the oldest *merge_factor* adjacent segments of similar size,
+        or None.
+        """
+        levels = [self.level(len(s)) for s in self.segments]
+        for i in xrange(len(levels) - self.merge_factor + 1):
+            if len(set(levels[i:i + self.merge_factor])) == 1:
+                return self.segments[i:i + self.merge_factor]
+        return None
+
+    def sources(self):
+        """The memtables and segments, newest first."""
+        return [self.memtable] + self.frozen[::-1] + self.segments[::-1]
+
+    def __len__(self):
+        return sum(len(s) for s in self.sources())
+
+    def search(self, query, max_scan=None):
+        """Yield the messages matching *query*, a :class:`Query`, newest
+        first.
+
+        Raises :exc:`TooBroad` on trying to check more than *max_scan*
+        messages, or :attr:`SEARCH_SCAN_LIMIT` if it's None, against the
+        query's phrases, e.g. for a query with no indexed terms or a phrase
+        made of common words.
+        """
+        if max_scan is None:
+            max_scan = self.SEARCH_SCAN_LIMIT
+        for source in self.sources():
+            lo, hi = source.time_range(query.start, query.end)
+            if lo >= hi:
+                continue
+            if query.terms:
+                lists = [source.postings(t) for t in query.terms]
+                if not all(lists):
+                    continue
+                ids = intersect_descending(lists, lo, hi)
+            else:
+                ids = xrange(hi - 1, lo - 1, -1)
+            for i in ids:
+                if max_scan <= 0:
+                    raise TooBroad()
+                max_scan -= 1
+                message = source.doc(i)
+                if query.matches(message):
+                    yield message
+
+    def random_match(self, query, rng=random, attempts=50):
+        """Get a message chosen at random from those matching *query*, or
+        None if there aren't any.
+
+        Candidates with the query's rarest term are sampled until one
+        matches.  If none of *attempts* does, one of the newest
+        :attr:`RANDOM_SCAN_LIMIT` matches is picked instead, or if the search
+        for them raises :exc:`TooBroad`, of those found before then.
+        """
+        candidates = []
+        total = 0
+        for source in self.sources():
+            lo, hi = source.time_range(query.start, query.end)
+            if lo >= hi:
+                continue
+            lists = sorted((source.postings(t) for t in query.terms),
+                           key=len)
+            if lists:
+                a, b = bisect_left(lists[0], lo), bisect_left(lists[0], hi)
+            else:
+                a, b = lo, hi
+            if a < b:
+                candidates.append((source, lists, a, b))
+                total += b - a
+        if not total:
+            return None
+
+        for _ in xrange(attempts):
+            r = rng.randrange(total)
+            for source, lists, a, b in candidates:
+                if r < b - a:
+                    break
+                r -= b - a
+            i = lists[0][a + r] if lists else a + r
+            if all(contains(postings, i) for postings in lists[1:]):
+                message = source.doc(i)
+                if query.matches(message):
+                    return message
+
+        matches = []
+        try:
+            for message in self.search(query):
+                matches.append(message)
+                if len(matches) == self.RANDOM_SCAN_LIMIT:
+                    break
+        except TooBroad:
+            if not matches:
+                raise
+        return rng.choice(matches) if matches else None
+
+    def sync(self):
+        """Flush journalled messages and sync them to disk."""
+        if self.dirty:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.dirty = False
+
+    def start(self, interval):
+        """Start syncing every *interval* seconds."""
+        if self.timer is None:
+            self.timer = task.LoopingCall(self.sync)
+            self.timer.start(interval, now=False)
+
+    def close(self):
+        """Stop the timer, sync and close the journal and segments.
+
+        Memtables aren't written out, since their journals are replayed
+        when the store is next opened.
+        """
+        if self.timer is not None:
+            if self.timer.running:
+                self.timer.stop()
+            self.timer = None
+        self.sync()
+        self.journal.close()
+        self.closed = True
+        for segment in self.segments:
+            segment.close()
+
+    def stats(self):
+        """Get the number of messages and segments in the store, and counts
+        of messages added, memtables written out and merges done since the
+        last :meth:`reset_stats`.
+        """
+        return {
+            'messages': len(self),
+            'segments': len(self.segments),
+            'memtable': len(self.memtable),
+            'added': self.added,
+            'flushes': self.flushes,
+            'merges': self.merges,
+        }
+
+    def reset_stats(self):
+        self.added = 0
+        self.flushes = 0
+        self.merges = 0
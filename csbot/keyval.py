@@ -0,0 +1,253 @@
+"""A log-structured key/value store for plugin data.
+
+Every change is appended to a log file as a record, and an index of the
+latest record for each key is kept in memory.  Writes are buffered and synced
+to disk in batches by a timer, and the log is compacted in the background once
+most of it is superseded records.  Values can be anything :mod:`marshal` can
+serialise: numbers, strings, booleans, None, and lists, tuples, dictionaries
+and sets of those.
+
+Each record is an 8 byte header, holding the length and CRC-32 of the payload,
+followed by the payload: a marshalled ``(section, key, value)`` tuple, or
+``(section, key)`` for a deletion.  When the log is read, a truncated or
+corrupted record at the end (as left by a crash part-way through a write) is
+discarded along with anything after it.
+"""
+import os
+import struct
+import marshal
+import zlib
+
+from twisted.internet import task, threads
+from twisted.python import log
+
+
+#: Record header: payload length, payload CRC-32
+HEADER = struct.Struct('<II')
+
+
+def encode_record(item):
+    payload = marshal.dumps(item, 2)
+    return HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + \
+        payload
+
+
+def read_records(data):
+    """Parse the records in *data*, yielding ``(record, item)`` pairs, where
+    *record* is the encoded record and *item* its decoded payload.
+
+    Stops at the first incomplete or corrupted record.
+    """
+    pos = 0
+    end = len(data)
+    header_size = HEADER.size
+    while pos + header_size <= end:
+        length, crc = HEADER.unpack_from(data, pos)
+        start = pos + header_size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return
+        try:
+            item = marshal.loads(payload)
+        except (EOFError, ValueError, TypeError):
+            return
+        yield data[pos:start + length], item
+        pos = start + length
+
+
+class LogStore(object):
+    """A persistent key/value store, with keys grouped into sections.
+
+    The log at *path* is read, creating it if necessary, when the store is
+    created.  Changes are written to the log straight away but only synced to
+    disk by :meth:`sync`, which :meth:`start` arranges to happen every
+    *interval* seconds.  *run_in_thread* is used to run compaction in the
+    background.
+    """
+    #: Don't bother compacting logs with fewer records than this
+    COMPACT_MIN_RECORDS = 1000
+    #: Compact once this proportion of the log is superseded records
+    COMPACT_GARBAGE_RATIO = 0.5
+
+    def __init__(self, path, run_in_thread=threads.deferToThread):
+        self.path = path
+        self.run_in_thread = run_in_thread
+        # section -> key -> latest encoded record
+        self.index = dict()
+        # Number of records in the log file
+        self.records = 0
+        # Records written while a compaction is running, or None
+        self.compacting = None
+        self.closed = False
+        self.dirty = False
+        self.timer = None
+
+        self.recover()
+        self.file = open(self.path, 'ab')
+
+    def recover(self):
+        """Rebuild the index from the log, discarding any damaged records at
+        the end.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        valid = 0
+        for record, item in read_records(data):
+            self.apply(record, item)
+            self.records += 1
+            valid += len(record)
+
+        if valid < len(data):
+            log.msg('Discarding {} damaged bytes at end of {}'.format(
+                len(data) - valid, self.path))
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+
+    def apply(self, record, item):
+        """Update the index with a decoded record."""
+        if len(item) == 3:
+            self.index.setdefault(item[0], dict())[item[1]] = record
+        else:
+            section = self.index.get(item[0])
+            if section is not None:
+                section.pop(item[1], None)
+
+    def write(self, item):
+        """Append a record for *item* to the log and update the index."""
+        record = encode_record(item)
+        self.file.write(record)
+        self.records += 1
+        self.dirty = True
+        if self.compacting is not None:
+            self.compacting.append(record)
+        self.apply(record, item)
+
+    def get(self, section, key):
+        """Get the value of *key* in *section*, raising :exc:`KeyError` if
+        there isn't one.
+        """
+        return marshal.loads(self.index[section][key][HEADER.size:])[2]
+
+    def set(self, section, key, value):
+        """Set the value of *key* in *section*.
+
+        Raises :exc:`~exceptions.ValueError` if *value* can't be stored.
+        """
+        self.write((section, key, value))
+
+    def delete(self, section, key):
+        """Remove *key* from *section*, raising :exc:`KeyError` if it isn't
+        there.
+        """
+        if key not in self.index.get(section, ()):
+            raise KeyError(key)
+        self.write((section, key))
+
+    def sections(self):
+        return self.index.keys()
+
+    def keys(self, section):
+        return self.index.get(section, dict()).keys()
+
+    def __len__(self):
+        return sum(len(s) for s in self.index.itervalues())
+
+    def sync(self):
+        """Flush buffered writes and sync them to disk."""
+        if self.dirty:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def start(self, interval):
+        """Start syncing (and compacting, if needed) every *interval*
+        seconds.
+        """
+        if self.timer is None:
+            self.timer = task.LoopingCall(self.tick)
+            self.timer.start(interval, now=False)
+
+    def tick(self):
+        self.sync()
+        if self.should_compact():
+            self.compact()
+
+    def close(self):
+        """Stop the timer, sync and close the log.
+
+        A compaction still running is abandoned when it finishes, leaving
+        the log as it is.
+        """
+        if self.timer is not None:
+            if self.timer.running:
+                self.timer.stop()
+            self.timer = None
+        self.sync()
+        self.file.close()
+        self.closed = True
+
+    def should_compact(self):
+        if self.compacting is not None:
+            return False
+        garbage = self.records - len(self)
+        return (self.records >= self.COMPACT_MIN_RECORDS and
+                garbage >= self.records * self.COMPACT_GARBAGE_RATIO)
+
+    def compact(self):
+        """Rewrite the log with only the latest record for each key.
+
+        The live records are written to a new file by *run_in_thread*.  Any
+        changes made in the meantime are appended to the new file before it
+        replaces the old log.  Returns a Deferred that fires when done.
+        """
+        self.compacting = []
+        live = [record for section in self.index.itervalues()
+                for record in section.itervalues()]
+        tmp_path = self.path + '.compact'
+
+        def write_compacted():
+            with open(tmp_path, 'wb') as f:
+                for record in live:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+        def finish(_):
+            if self.closed:
+                # Everything is already in the old log
+                os.remove(tmp_path)
+                return
+            with open(tmp_path, 'ab') as f:
+                for record in self.compacting:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self.file.close()
+            os.rename(tmp_path, self.path)
+            self.file = open(self.path, 'ab')
+            self.records = len(live) + len(self.compacting)
+            self.dirty = False
+            log.msg('Compacted {} to {} records'.format(self.path,
+                                                        self.records))
+
+        def done(result):
+            self.compacting = None
+            return result
+
+        d = self.run_in_thread(write_compacted)
+        d.addCallback(finish)
+        d.addBoth(done)
+        d.addErrback(log.err)
+        return d
+
+    def import_config(self, config):
+        """Import every option of every section of a
+        :class:`~ConfigParser.ConfigParser` as a string value.
+        """
+        for section in config.sections():
+            for key, value in config.items(section):
+                self.set(section, key, value)
@@ -0,0 +1,265 @@
+"""An in-process stand-in for a MongoDB server.
+
+Implements the small part of the :mod:`pymongo` API that plugins use, keeping
+everything in memory.  The bot uses it instead of a real server if
+``mongodb_host`` is set to ``:memory:``, which is useful for tests, benchmarks
+and replaying traffic without any outside services.  Nothing is persisted.
+"""
+import copy
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+
+#: Marker for a missing field
+_MISSING = object()
+
+
+def _compare(op, value, arg):
+    if op == '$in':
+        return value in arg
+    elif op == '$nin':
+        return value not in arg
+    elif op == '$ne':
+        return value != arg
+    elif op == '$exists':
+        return (value is not _MISSING) == bool(arg)
+    elif value is _MISSING:
+        return False
+    elif op == '$gt':
+        return value > arg
+    elif op == '$gte':
+        return value >= arg
+    elif op == '$lt':
+        return value < arg
+    elif op == '$lte':
+        return value <= arg
+    else:
+        raise ValueError('unsupported query operator: ' + op)
+
+
+def matches(document, spec):
+    """Check if *document* matches the query *spec*.
+
+    >>> matches({'to': 'Alan', 'n': 3}, {'to': 'Alan', 'n': {'$gt': 2}})
+    True
+    >>> matches({'to': ['Alan', 'Bob']}, {'to': 'Bob'})
+    True
+    >>> matches({'to': 'Alan'}, {'to': {'$in': ['Bob']}})
+    False
+    """
+    for key, cond in spec.iteritems():
+        value = document.get(key, _MISSING)
+        if isinstance(cond, dict) and cond and all(k.startswith('$')
+                                                   for k in cond):
+            if not all(_compare(op, value, arg)
+                       for op, arg in cond.iteritems()):
+                return False
+        elif value != cond and not (isinstance(value, list) and
+                                    cond in value):
+            return False
+    return True
+
+
+def _apply_update(document, update):
+    if not any(k.startswith('$') for k in update):
+        # Replace the whole document, keeping its id
+        _id = document.get('_id')
+        document.clear()
+        document.update(copy.deepcopy(update))
+        if _id is not None:
+            document['_id'] = _id
+        return
+
+    for op, fields in update.iteritems():
+        for key, arg in fields.iteritems():
+            if op == '$set':
+                document[key] = copy.deepcopy(arg)
+            elif op == '$unset':
+                document.pop(key, None)
+            elif op == '$inc':
+                document[key] = document.get(key, 0) + arg
+            elif op == '$push':
+                document.setdefault(key, []).append(copy.deepcopy(arg))
+            else:
+                raise ValueError('unsupported update operator: ' + op)
+
+
+def _project(document, fields):
+    if fields is None:
+        return copy.deepcopy(document)
+    result = dict((k, copy.deepcopy(document[k]))
+                  for k in fields if k in document)
+    result['_id'] = document['_id']
+    return result
+
+
+class Cursor(object):
+    """The results of :meth:`Collection.find`."""
+    def __init__(self, documents):
+        self.documents = documents
+        self.skip_ = 0
+        self.limit_ = 0
+        self.iterator = None
+
+    def count(self, with_limit_and_skip=False):
+        if not with_limit_and_skip:
+            return len(self.documents)
+        return len(self.results())
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, basestring) else key
+        for k, d in reversed(keys):
+            self.documents.sort(key=lambda doc: doc.get(k), reverse=d < 0)
+        return self
+
+    def skip(self, n):
+        self.skip_ = n
+        return self
+
+    def limit(self, n):
+        self.limit_ = n
+        return self
+
+    def results(self):
+        end = self.skip_ + self.limit_ if self.limit_ else None
+        return self.documents[self.skip_:end]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.iterator is None:
+            self.iterator = iter(self.results())
+        return next(self.iterator)
+
+
+class Collection(object):
+    """An in-memory collection of documents."""
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.documents = []
+
+    def _operation(self):
+        # Simulate a slow server if required
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        return self.connection.lock
+
+    def _matching(self, spec):
+        if spec is None:
+            spec = {}
+        elif not isinstance(spec, dict):
+            spec = {'_id': spec}
+        return [d for d in self.documents if matches(d, spec)]
+
+    def insert(self, doc_or_docs, **kwargs):
+        with self._operation():
+            docs = doc_or_docs if isinstance(doc_or_docs, list) \
+                else [doc_or_docs]
+            for doc in docs:
+                doc.setdefault('_id', ObjectId())
+                self.documents.append(copy.deepcopy(doc))
+            ids = [doc['_id'] for doc in docs]
+            return ids if isinstance(doc_or_docs, list) else ids[0]
+
+    def save(self, document, **kwargs):
+        if '_id' not in document:
+            return self.insert(document)
+        self.update({'_id': document['_id']}, document, upsert=True)
+        return document['_id']
+
+    def update(self, spec, document, upsert=False, multi=False, **kwargs):
+        with self._operation():
+            found = self._matching(spec)
+            if not multi:
+                found = found[:1]
+            for doc in found:
+                _apply_update(doc, document)
+            if not found and upsert:
+                doc = dict((k, v) for k, v in spec.iteritems()
+                           if not isinstance(v, dict))
+                _apply_update(doc, document)
+                doc.setdefault('_id', spec.get('_id', ObjectId()))
+                self.documents.append(doc)
+
+    def remove(self, spec_or_id=None, **kwargs):
+        with self._operation():
+            found = set(id(d) for d in self._matching(spec_or_id))
+            self.documents = [d for d in self.documents
+                              if id(d) not in found]
+
+    def find(self, spec=None, fields=None, **kwargs):
+        with self._operation():
+            return Cursor([_project(d, fields)
+                           for d in self._matching(spec)])
+
+    def find_one(self, spec_or_id=None, fields=None, **kwargs):
+        for doc in self.find(spec_or_id, fields).limit(1):
+            return doc
+        return None
+
+    def count(self):
+        with self._operation():
+            return len(self.documents)
+
+    def drop(self):
+        with self._operation():
+            self.documents = []
+
+
+class Database(object):
+    """A named group of :class:`Collection` objects."""
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.collections = dict()
+
+    def __getitem__(self, name):
+        with self.connection.lock:
+            if name not in self.collections:
+                self.collections[name] = Collection(self.connection, name)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def collection_names(self):
+        return self.collections.keys()
+
+    def drop_collection(self, name):
+        self.collections.pop(name, None)
+
+
+class Connection(object):
+    """Stands in for :class:`pymongo.Connection`.
+
+    Every operation sleeps for *latency* seconds first, to simulate a slow
+    server.  Operations are serialised by a lock, so the connection can be
+    used from several threads.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.databases = dict()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.databases:
+                self.databases[name] = Database(self, name)
+            return self.databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def database_names(self):
+        return self.databases.keys()
+
+    def drop_database(self, name):
+        self.databases.pop(name, None)
@@ -0,0 +1,195 @@
+import collections
+
+from twisted.internet import reactor
+
+from csbot.util import TokenBucket
+
+
+#: Priority of protocol lines other than messages, e.g. ``PONG`` and ``JOIN``
+PRIORITY_CONTROL = 0
+#: Priority of replies to commands, see :meth:`.CommandEvent.reply`
+PRIORITY_REPLY = 1
+#: Priority of other messages, e.g. announcements
+PRIORITY_NORMAL = 2
+
+#: Maximum length of an IRC protocol line, including the trailing CR-LF
+MAX_LINE_BYTES = 512
+
+
+def split_message(message, max_bytes):
+    """Split *message* into chunks of at most *max_bytes* bytes.
+
+    Unicode messages are encoded as UTF-8 first.  Each line of the message is
+    split separately, preferring to break at a space (which is dropped), and
+    otherwise breaking between characters rather than in the middle of a
+    multi-byte UTF-8 sequence.  Empty lines are dropped, since they can't be
+    sent.
+
+    >>> split_message('hello world', 7)
+    ['hello', 'world']
+    >>> split_message('one\\ntwo', 100)
+    ['one', 'two']
+    >>> split_message(u'caf\\xe9s', 4)
+    ['caf', '\\xc3\\xa9s']
+    """
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+
+    chunks = []
+    for line in message.split('\n'):
+        line = line.rstrip('\r')
+        while len(line) > max_bytes:
+            cut = line.rfind(' ', 0, max_bytes + 1)
+            if cut > 0:
+                chunk, line = line[:cut], line[cut + 1:]
+            else:
+                cut = max_bytes
+                # Back up over UTF-8 continuation bytes
+                while cut > 0 and ord(line[cut]) & 0xC0 == 0x80:
+                    cut -= 1
+                if cut == 0:
+                    cut = max_bytes
+                chunk, line = line[:cut], line[cut:]
+            if chunk:
+                chunks.append(chunk)
+        if line:
+            chunks.append(line)
+    return chunks
+
+
+class OutboundScheduler(object):
+    """Rate-limited, fair scheduling of outbound protocol lines.
+
+    Lines are sent by calling *send* at no more than *rate* lines per second,
+    with bursts of up to *burst* lines, using a :class:`.TokenBucket`.  If
+    *rate* is None there is no limit.  *clock* provides ``seconds()`` and
+    ``callLater()``, and is normally the reactor.
+
+    Lines are queued per target (channel or nick) and per priority level.
+    Lines at a lower priority level are always sent first; within a priority
+    level targets take turns, so a long reply to one channel doesn't hold up
+    messages to every other target.  Lines for the same target are always sent
+    in the order they were queued.
+
+    :meth:`stats` reports queue depth and how long lines waited to be sent, for
+    tuning the rate under load.
+    """
+    #: How many recent waiting times are kept for :meth:`stats`
+    WAIT_SAMPLES = 1000
+
+    def __init__(self, send, rate, burst, clock=reactor):
+        self.send = send
+        self.clock = clock
+        if rate is None:
+            self.bucket = None
+        else:
+            self.bucket = TokenBucket(rate, burst, clock.seconds)
+
+        # Per priority level: target -> deque of (line, queued time)
+        self.queues = collections.defaultdict(dict)
+        # Per priority level: deque of targets waiting their turn
+        self.rotations = collections.defaultdict(collections.deque)
+        # Total number of queued lines
+        self.depth = 0
+        # Pending call to run(), if waiting for the token bucket
+        self.pending = None
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the counters reported by :meth:`stats`."""
+        self.queued_count = 0
+        self.sent_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits = collections.deque(maxlen=self.WAIT_SAMPLES)
+
+    def enqueue(self, target, lines, priority=PRIORITY_NORMAL):
+        """Queue *lines* for *target* at *priority*, and send as many queued
+        lines as the rate limit allows.
+        """
+        now = self.clock.seconds()
+        queues = self.queues[priority]
+        queue = queues.get(target)
+        if queue is None:
+            queue = queues[target] = collections.deque()
+            self.rotations[priority].append(target)
+        for line in lines:
+            queue.append((line, now))
+            self.depth += 1
+            self.queued_count += 1
+        if self.pending is None:
+            self.run()
+
+    def run(self):
+        """Send queued lines until the queues are empty or the rate limit is
+        reached, in which case another run is scheduled.
+        """
+        self.pending = None
+        while self.depth > 0:
+            if self.bucket is not None and not self.bucket.consume():
+                self.pending = self.clock.callLater(self.bucket.delay(),
+                                                    self.run)
+                return
+            self.send_next()
+
+    def send_next(self):
+        """Send the next line according to priority and target rotation."""
+        priority = min(p for p, r in self.rotations.iteritems() if r)
+        rotation = self.rotations[priority]
+        queues = self.queues[priority]
+
+        target = rotation.popleft()
+        queue = queues[target]
+        line, queued = queue.popleft()
+        if queue:
+            rotation.append(target)
+        else:
+            del queues[target]
+        self.depth -= 1
+
+        wait = self.clock.seconds() - queued
+        self.sent_count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.waits.append(wait)
+
+        self.send(line)
+
+    def clear(self):
+        """Drop all queued lines, e.g. when the connection is lost."""
+        if self.pending is not None and self.pending.active():
+            self.pending.cancel()
+        self.pending = None
+        self.queues.clear()
+        self.rotations.clear()
+        self.depth = 0
+
+    def target_depths(self):
+        """Get a dictionary mapping from target to number of queued lines."""
+        depths = collections.Counter()
+        for queues in self.queues.itervalues():
+            for target, queue in queues.iteritems():
+                depths[target] += len(queue)
+        return dict(depths)
+
+    def stats(self):
+        """Get a dictionary of queue statistics.
+
+        ``depth`` is the number of queued lines and ``targets`` the number of
+        targets they are for.  ``queued`` and ``sent`` count lines since the
+        last :meth:`reset_stats`.  ``mean_wait`` and ``max_wait`` are the
+        times in seconds that sent lines spent queued, and ``recent_wait`` is
+        the mean over the last :attr:`WAIT_SAMPLES` lines.
+        """
+        return {
+            'depth': self.depth,
+            'targets': sum(len(q) for q in self.queues.itervalues()),
+            'queued': self.queued_count,
+            'sent': self.sent_count,
+            'mean_wait': (self.total_wait / self.sent_count
+                          if self.sent_count else 0.0),
+            'max_wait': self.max_wait,
+            'recent_wait': (sum(self.waits) / len(self.waits)
+                            if self.waits else 0.0),
+        }
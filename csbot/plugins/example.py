@@ -1,4 +1,5 @@
 from csbot.core import Plugin, PluginFeatures
+from csbot.cache import CachePolicy
 from csbot.util import nick
 
 
@@ -15,7 +16,7 @@ class Example(Plugin):
                      '{0.data}').format(event))
         event.reply('raw data: ' + event.raw_data, is_verbose=True)
 
-    @features.command('cfg')
+    @features.command('cfg', cache=CachePolicy(ttl=60))
     def test_cfg(self, event):
         if len(event.data) == 0:
             event.error("You need to tell me what to look for!")
@@ -33,12 +34,15 @@ class Example(Plugin):
             val = event.data[1]
 
             self.set(key, val)
+            # Keys are case-insensitive, and !get ignores anything after the
+            # key, so any cached !get could be for this key
+            self.invalidate_cache('get')
 
             event.reply("{} has been set to {}.".format(key, val))
         except IndexError:
             event.error("You need to tell me the name and the value to store!")
 
-    @features.command('get')
+    @features.command('get', cache=CachePolicy(ttl=60))
     def test_get(self, event):
         key = event.data[0]
 
@@ -0,0 +1,206 @@
+"""Searching what's been said in channels.
+
+Every message and action in a channel, other than commands to the bot, is
+added to a :class:`.HistoryStore`, which these commands search:
+
+``!grep <text>...``
+    The most recent messages containing all of the quoted or unquoted
+    pieces of text.
+``!last <nick>``
+    The last thing *nick* said.
+``!quote [<nick>] [<text>...]``
+    Something *nick* said, picked at random, containing the text if any.
+
+All of them can be narrowed down with ``nick:<nick>``, ``channel:<channel>``,
+``after:<time>`` and ``before:<time>``, where a time is a date like
+``2012-10-15``, a date and time like ``2012-10-15T13:37``, or a length of
+time ago like ``30m``, ``6h``, ``2d`` or ``1w``.  The ``#`` of a channel can
+be left out, e.g. ``channel:cs-york``, since an unquoted ``#`` starts a
+comment.  When used in a channel only that channel is searched, unless
+``channel:*`` is given.  Searches which would take too long, e.g. for text
+made up of very common words, are refused as too broad.
+"""
+import re
+import time
+import random
+import itertools
+
+from csbot.core import Plugin, PluginFeatures
+from csbot.history import HistoryStore, Query, TooBroad
+from csbot.util import nick, is_channel
+
+
+#: Matches a length of time ago, e.g. ``6h``
+TIME_AGO = re.compile(r'(\d+)([smhdw])\Z')
+#: Seconds in each unit of :data:`TIME_AGO`
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60,
+              'w': 7 * 24 * 60 * 60}
+#: Accepted formats of absolute times
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M')
+#: The reply to searches that raise :exc:`.TooBroad`
+TOO_BROAD = "That's too broad, try narrowing it down."
+
+
+def parse_time(value, now):
+    """Parse a time for ``after:`` or ``before:`` as a timestamp, raising
+    :exc:`ValueError` if it isn't valid.
+
+    >>> parse_time('2h', 100000)
+    92800
+    """
+    m = TIME_AGO.match(value)
+    if m is not None:
+        return now - int(m.group(1)) * TIME_UNITS[m.group(2)]
+    for fmt in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError("I don't understand the time {}".format(value))
+
+
+class History(Plugin):
+    """Keeps channel history searchable; see :mod:`csbot.plugins.history`.
+    """
+    features = PluginFeatures()
+
+    CONFIG_DEFAULTS = {
+        'history_dir': 'history',
+        'flush_size': '50000',
+        'merge_factor': '4',
+        'sync_interval': '1',
+        'max_results': '3',
+    }
+    CONFIG_TYPES = {
+        'flush_size': int,
+        'merge_factor': int,
+        'sync_interval': float,
+        'max_results': int,
+    }
+
+    def setup(self):
+        self.store = HistoryStore(self.config['history_dir'],
+                                  self.config['flush_size'],
+                                  self.config['merge_factor'])
+        self.store.start(self.config['sync_interval'])
+
+    def snapshot(self):
+        return self.store
+
+    def restore(self, store):
+        self.store = store
+
+    def teardown(self):
+        self.store.close()
+
+    def add(self, event, action):
+        if not is_channel(event.channel):
+            return
+        # Don't fill the history with people searching it
+        if (not action and
+                event.protocol.command_matcher.match(event.message)):
+            return
+        self.store.add(event.timestamp, event.network, event.channel,
+                       nick(event.user), event.message, action)
+
+    @features.hook('privmsg')
+    def privmsg(self, event):
+        self.add(event, False)
+
+    @features.hook('action')
+    def action(self, event):
+        self.add(event, True)
+
+    def query(self, event, args):
+        """Build a :class:`.Query` from *args*, the command's arguments
+        other than those specific to it.
+        """
+        filters = {'channel': event.channel if is_channel(event.channel)
+                   else None}
+        phrases = []
+        for arg in args:
+            name, sep, value = arg.partition(':')
+            if sep and value and name in ('nick', 'channel', 'after',
+                                          'before'):
+                filters[name] = value
+            else:
+                phrases.append(arg)
+        if filters['channel'] == '*':
+            filters['channel'] = None
+        elif (filters['channel'] is not None and
+                not is_channel(filters['channel'])):
+            filters['channel'] = '#' + filters['channel']
+        now = time.time()
+        return Query(phrases,
+                     nick=filters.get('nick'),
+                     network=event.network,
+                     channel=filters['channel'],
+                     start=(parse_time(filters['after'], now)
+                            if 'after' in filters else None),
+                     end=(parse_time(filters['before'], now)
+                          if 'before' in filters else None))
+
+    def format_message(self, message):
+        when = time.strftime('%Y-%m-%d %H:%M',
+                             time.localtime(message.timestamp))
+        if message.action:
+            text = '* {} {}'.format(message.nick, message.text)
+        else:
+            text = '<{}> {}'.format(message.nick, message.text)
+        return '[{}] {} {}'.format(when, message.channel, text)
+
+    @features.command('grep')
+    def grep(self, event):
+        """Find the newest messages containing some text."""
+        try:
+            query = self.query(event, event.data)
+        except ValueError as e:
+            return event.error(str(e))
+        if not query.phrases:
+            return event.error('What should I look for?')
+        if not query.words:
+            return event.error('I can only look for text with words in it.')
+        try:
+            messages = list(itertools.islice(self.store.search(query),
+                                             self.config['max_results']))
+        except TooBroad:
+            return event.error(TOO_BROAD)
+        if not messages:
+            return event.reply('Nothing found.')
+        for message in messages:
+            event.reply(self.format_message(message))
+
+    @features.command('last')
+    def last(self, event):
+        """Show the last thing somebody said."""
+        if not event.data:
+            return event.error('Whose last message?')
+        try:
+            query = self.query(event, ['nick:' + event.data[0]] +
+                               event.data[1:])
+        except ValueError as e:
+            return event.error(str(e))
+        try:
+            for message in self.store.search(query):
+                return event.reply(self.format_message(message))
+        except TooBroad:
+            return event.error(TOO_BROAD)
+        event.reply("I haven't seen {} say anything.".format(event.data[0]))
+
+    @features.command('quote')
+    def quote(self, event):
+        """Show something somebody said, picked at random."""
+        args = event.data
+        if args and ':' not in args[0]:
+            args = ['nick:' + args[0]] + args[1:]
+        try:
+            query = self.query(event, args)
+        except ValueError as e:
+            return event.error(str(e))
+        try:
+            message = self.store.random_match(query, random)
+        except TooBroad:
+            return event.error(TOO_BROAD)
+        if message is None:
+            return event.reply('Nothing to quote.')
+        event.reply(self.format_message(message))
@@ -0,0 +1,321 @@
+"""Channel logs, one file per channel per day.
+
+Logs are written to ``<log_dir>/<network>/<channel>/<YYYY-MM-DD>.log``, with
+lines like ``[13:37:00] <Alan> hello``.  Each line is formatted as its
+message arrives and added to an in-memory buffer for its file.  The buffer is
+written out when it reaches ``buffer_size`` bytes, or every
+``flush_interval`` seconds, so a busy channel costs one write every so often
+instead of one per line.  Timestamps are only formatted once per second,
+because a busy channel logs many lines in the same second.
+
+When the day changes, the previous day's file is closed and, if ``compress``
+is on, gzipped in the background to ``<YYYY-MM-DD>.log.gz``.  Files left
+behind by earlier runs are compressed when the plugin starts.
+"""
+import os
+import gzip
+import time
+import shutil
+import urllib
+
+from twisted.internet import task, threads
+from twisted.python import log
+
+from csbot.core import Plugin, PluginFeatures
+from csbot.channels import irc_lower
+from csbot import config
+from csbot.util import nick, is_channel
+
+
+#: Characters left alone when turning a network or channel name into a
+#: directory name
+SAFE_CHARS = '#&+!-_.'
+
+
+def log_dir_name(name):
+    """Turn a network or channel name into a directory name.
+
+    >>> log_dir_name('#CS-York/dev')
+    '#cs-york%2Fdev'
+    """
+    return urllib.quote(irc_lower(name), safe=SAFE_CHARS)
+
+
+def compress_file(path):
+    """Gzip *path* to ``path + '.gz'``, then remove it.
+
+    If the compressed file already exists, the data is added to it as a new
+    gzip member, which :mod:`gzip` and ``zcat`` read as one file.
+    """
+    with open(path, 'rb') as src:
+        dst = gzip.open(path + '.gz', 'ab')
+        try:
+            shutil.copyfileobj(src, dst)
+        finally:
+            dst.close()
+    os.remove(path)
+
+
+def compress_stale(root, today):
+    """Compress every log file under *root* from before *today*, e.g. after
+    the bot was stopped overnight.  Returns how many files were compressed.
+    """
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.log') and filename[:-4] < today:
+                compress_file(os.path.join(dirpath, filename))
+                count += 1
+    return count
+
+
+class Timestamps(object):
+    """Formats timestamps as a time of day and a date in local time,
+    remembering the result for the last second formatted.
+    """
+    def __init__(self):
+        self.second = None
+        self.clock = None
+        self.date = None
+
+    def __call__(self, timestamp):
+        """Get ``(time, date)`` strings for *timestamp*."""
+        second = int(timestamp)
+        if second != self.second:
+            t = time.localtime(second)
+            self.clock = time.strftime('%H:%M:%S', t)
+            self.date = time.strftime('%Y-%m-%d', t)
+            self.second = second
+        return self.clock, self.date
+
+
+class LogFile(object):
+    """One day's log for a channel, and the lines waiting to be written."""
+    __slots__ = ('path', 'date', 'file', 'lines', 'size')
+
+    def __init__(self, path, date):
+        self.path = path
+        self.date = date
+        self.file = None
+        self.lines = []
+        self.size = 0
+
+
+class ChannelLogs(object):
+    """Buffered writer for the logs under *root*.
+
+    Lines for a file are buffered until there are *buffer_size* bytes of
+    them, or until :meth:`flush`, which :meth:`start` arranges to happen
+    every *interval* seconds.  If *compress* is true, finished days are
+    gzipped by *run_in_thread*.
+    """
+    def __init__(self, root, buffer_size=65536, compress=True,
+                 run_in_thread=threads.deferToThread):
+        self.root = root
+        self.buffer_size = buffer_size
+        self.compress = compress
+        self.run_in_thread = run_in_thread
+        self.timestamps = Timestamps()
+        # (network, case-folded channel) -> LogFile
+        self.files = dict()
+        self.timer = None
+        self.reset_stats()
+
+    def write(self, network, channel, timestamp, text):
+        """Log *text* in *channel* on *network* at *timestamp*."""
+        clock, date = self.timestamps(timestamp)
+        key = (network, irc_lower(channel))
+        f = self.files.get(key)
+        # Lines that arrive out of order around midnight go in the newer file
+        # rather than reopening one that may already be compressed
+        if f is None or date > f.date:
+            f = self.open(key, date)
+        line = '[{}] {}\n'.format(clock, text)
+        f.lines.append(line)
+        f.size += len(line)
+        self.lines += 1
+        if f.size >= self.buffer_size:
+            self.flush_file(f)
+
+    def open(self, key, date):
+        """Start *date*'s file for *key*, rotating the previous one."""
+        old = self.files.get(key)
+        if old is not None:
+            self.rotate(old)
+        directory = os.path.join(self.root, *map(log_dir_name, key))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        f = self.files[key] = LogFile(
+            os.path.join(directory, date + '.log'), date)
+        return f
+
+    def rotate(self, f):
+        """Write out and close *f*, then compress it in the background."""
+        self.close_file(f)
+        self.rotated += 1
+        if self.compress and os.path.exists(f.path):
+            d = self.run_in_thread(compress_file, f.path)
+            d.addErrback(log.err)
+            return d
+
+    def compress_stale(self, today=None):
+        """Compress files from before *today* (a ``YYYY-MM-DD`` string,
+        defaulting to the current date) in the background.
+        """
+        if today is None:
+            today = time.strftime('%Y-%m-%d')
+        d = self.run_in_thread(compress_stale, self.root, today)
+        d.addErrback(log.err)
+        return d
+
+    def flush_file(self, f):
+        if not f.lines:
+            return
+        if f.file is None:
+            f.file = open(f.path, 'ab')
+        f.file.write(''.join(f.lines))
+        f.file.flush()
+        self.flushes += 1
+        self.bytes += f.size
+        del f.lines[:]
+        f.size = 0
+
+    def close_file(self, f):
+        self.flush_file(f)
+        if f.file is not None:
+            f.file.close()
+            f.file = None
+
+    def flush(self):
+        """Write out every file's buffered lines."""
+        for f in self.files.itervalues():
+            self.flush_file(f)
+
+    def start(self, interval):
+        """Start flushing every *interval* seconds."""
+        if self.timer is None:
+            self.timer = task.LoopingCall(self.flush)
+            self.timer.start(interval, now=False)
+
+    def close(self):
+        """Stop the timer, then write out and close every file.
+
+        Files aren't compressed, since logging for the day carries on in
+        them if the bot starts up again.
+        """
+        if self.timer is not None:
+            if self.timer.running:
+                self.timer.stop()
+            self.timer = None
+        for f in self.files.itervalues():
+            self.close_file(f)
+        self.files.clear()
+
+    def stats(self):
+        """Get counts of lines logged, bytes and writes made, and files
+        rotated since the last :meth:`reset_stats`, and the number of bytes
+        currently buffered.
+        """
+        return {
+            'lines': self.lines,
+            'bytes': self.bytes,
+            'flushes': self.flushes,
+            'rotated': self.rotated,
+            'buffered': sum(f.size for f in self.files.itervalues()),
+        }
+
+    def reset_stats(self):
+        self.lines = 0
+        self.bytes = 0
+        self.flushes = 0
+        self.rotated = 0
+
+
+class Logger(Plugin):
+    """Logs what happens in every channel the bot is in; see
+    :mod:`csbot.plugins.logger`.
+    """
+    features = PluginFeatures()
+
+    CONFIG_DEFAULTS = {
+        'log_dir': 'logs',
+        'buffer_size': '65536',
+        'flush_interval': '1',
+        'compress': 'true',
+    }
+    CONFIG_TYPES = {
+        'buffer_size': int,
+        'flush_interval': float,
+        'compress': config.boolean,
+    }
+
+    def setup(self):
+        self.logs = ChannelLogs(self.config['log_dir'],
+                                self.config['buffer_size'],
+                                self.config['compress'])
+        self.logs.start(self.config['flush_interval'])
+        if self.logs.compress:
+            self.logs.compress_stale()
+
+    def snapshot(self):
+        return self.logs
+
+    def restore(self, logs):
+        self.logs = logs
+
+    def teardown(self):
+        self.logs.close()
+
+    def log_line(self, event, channel, text):
+        self.logs.write(event.network, channel, event.timestamp, text)
+
+    @features.hook('privmsg')
+    def privmsg(self, event):
+        if is_channel(event.channel):
+            self.log_line(event, event.channel, '<{}> {}'.format(
+                nick(event.user), event.message))
+
+    @features.hook('action')
+    def action(self, event):
+        if is_channel(event.channel):
+            self.log_line(event, event.channel, '* {} {}'.format(
+                nick(event.user), event.message))
+
+    @features.hook('joined')
+    def joined(self, event):
+        self.log_line(event, event.channel, '-!- {} has joined {}'.format(
+            event.protocol.nickname, event.channel))
+
+    @features.hook('userJoined')
+    def userJoined(self, event):
+        self.log_line(event, event.channel, '-!- {} has joined {}'.format(
+            nick(event.user), event.channel))
+
+    @features.hook('userLeft')
+    def userLeft(self, event):
+        self.log_line(event, event.channel, '-!- {} has left {}'.format(
+            nick(event.user), event.channel))
+
+    @features.hook('userQuit')
+    def userQuit(self, event):
+        text = '-!- {} has quit ({})'.format(nick(event.user), event.message)
+        for channel in event.channels:
+            self.log_line(event, channel, text)
+
+    @features.hook('userKicked')
+    def userKicked(self, event):
+        self.log_line(event, event.channel,
+                      '-!- {} was kicked by {} ({})'.format(
+                          event.kickee, nick(event.kicker), event.message))
+
+    @features.hook('userRenamed')
+    def userRenamed(self, event):
+        text = '-!- {} is now known as {}'.format(event.oldname,
+                                                  event.newname)
+        for channel in event.channels:
+            self.log_line(event, channel, text)
+
+    @features.hook('names')
+    def names(self, event):
+        self.log_line(event, event.channel, '-!- Names: {}'.format(
+            ' '.join(event.raw_names)))
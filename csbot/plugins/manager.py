@@ -1,10 +1,11 @@
 from csbot.core import Plugin, PluginFeatures, PluginError
+from csbot.cache import CachePolicy
 
 
 class PluginManager(Plugin):
     features = PluginFeatures()
 
-    @features.command('plugins.available')
+    @features.command('plugins.available', cache=CachePolicy(ttl=60))
     def available(self, event):
         names = sorted(event.bot.discover_plugins())
         event.reply(', '.join(names))
@@ -40,6 +41,8 @@ class PluginManager(Plugin):
             try:
                 operation(name)
                 success.append(name)
+                # Loading or reloading might have found new plugins
+                self.invalidate_cache('plugins.available')
             except PluginError as e:
                 failure.append(name)
                 event.error(str(e))
@@ -0,0 +1,97 @@
+"""Profiling the bot while it runs; see :mod:`csbot.profiling`.
+
+Only users matching one of the hostmask patterns in the ``admins`` option,
+e.g. ``*!*@staff.example.com``, can use these commands:
+
+``!profile.start [full]``
+    Start timing every hook and command handler, or with ``full``,
+    profiling everything with :mod:`cProfile` as well.
+``!profile.stop``
+    Stop, write the statistics to a file in ``profile_dir`` and show the
+    most expensive plugins and handlers.
+``!profile.top [<n>]``
+    Show the *n* most expensive plugins and handlers so far, or from the
+    last time profiling was stopped.
+"""
+import os
+import re
+import time
+
+from csbot.core import Plugin, PluginFeatures
+from csbot.filters import glob_to_regex
+from csbot import config
+
+
+class Profiler(Plugin):
+    features = PluginFeatures()
+
+    CONFIG_DEFAULTS = {
+        'admins': '',
+        'profile_dir': 'profiles',
+        'top': '5',
+    }
+    CONFIG_TYPES = {
+        'admins': config.words,
+        'top': int,
+    }
+
+    def setup(self):
+        # The last profiler stopped, for !profile.top
+        self.last = None
+
+    def snapshot(self):
+        return {'last': self.last}
+
+    def restore(self, state):
+        self.last = state['last']
+
+    def is_admin(self, user):
+        return any(re.match(glob_to_regex(pattern), user, re.IGNORECASE)
+                   for pattern in self.config['admins'])
+
+    def allowed(self, event):
+        if self.is_admin(event.user):
+            return True
+        event.error('Only admins can do that.')
+        return False
+
+    @features.command('profile.start')
+    def start(self, event):
+        if not self.allowed(event):
+            return
+        full = event.data[:1] == ['full']
+        try:
+            self.bot.start_profiling(deterministic=full)
+        except ValueError as e:
+            return event.error(str(e))
+        event.reply('Profiling hooks and commands{}.'.format(
+            ', and everything else with cProfile' if full else ''))
+
+    @features.command('profile.stop')
+    def stop(self, event):
+        if not self.allowed(event):
+            return
+        profiler = self.bot.stop_profiling()
+        if profiler is None:
+            return event.error('Not profiling.')
+        self.last = profiler
+        path = os.path.join(self.config['profile_dir'],
+                            time.strftime('csbot-%Y%m%d-%H%M%S.prof'))
+        profiler.dump(path)
+        for line in profiler.summary(self.config['top']):
+            event.reply(line)
+        event.reply('Profile written to {}'.format(path))
+
+    @features.command('profile.top')
+    def top(self, event):
+        if not self.allowed(event):
+            return
+        profiler = self.bot.profiler or self.last
+        if profiler is None:
+            return event.error('Nothing has been profiled.')
+        try:
+            n = int(event.data[0]) if event.data else self.config['top']
+        except ValueError:
+            return event.error('How many?')
+        for line in profiler.summary(n):
+            event.reply(line)
@@ -1,3 +1,5 @@
+import collections
+
 from csbot.core import Plugin, PluginFeatures
 from csbot.util import nick
 
@@ -5,6 +7,27 @@ from csbot.util import nick
 class Tell(Plugin):
     features = PluginFeatures()
 
+    def setup(self):
+        # Number of undelivered messages for each (network, recipient), so
+        # that joins by users without messages don't need to touch the
+        # database
+        self.pending = collections.Counter()
+        # Messages from before multi-network support
+        d = self.async_db.messages.update(
+            {'network': {'$exists': False}},
+            {'$set': {'network': self.bot.default_network.name}}, multi=True)
+        d.addCallback(lambda _: self.async_db.messages.find(
+            fields=['network', 'to']))
+        d.addCallback(lambda msgs: self.pending.update(
+            (m['network'], m['to']) for m in msgs))
+        d.addErrback(self.bot.log_err)
+
+    def snapshot(self):
+        return self.pending
+
+    def restore(self, pending):
+        self.pending = pending
+
     @features.command('printmsgs')
     def print_messages_command(self, event):
         """
@@ -12,8 +35,10 @@ class Tell(Plugin):
         messages to check things are working. I'll remove it when private
         messages get added probably.
         """
-        for msg in self.db.messages.find():
-            print(msg)
+        def print_messages(msgs):
+            for msg in msgs:
+                print(msg)
+        self.async_db.messages.find().addCallback(print_messages)
 
     @features.command('tell')
     def tell_command(self, event):
@@ -44,59 +69,84 @@ class Tell(Plugin):
         - We need to handle messages which are just long enough to fit in one
           message when saved but too long when the citation and time is added.
         """
-        print(event.data)
         to_user = event.data[0]
         message = " ".join(event.data[1:])
         from_user = nick(event.user)
         # TODO: this should probably do some i18n but being as the channel is
         # largely in the UK...
         time = event.datetime
-        if (self.bot.get_plugin("users.Users").is_online(to_user)):
+        if (self.bot.has_plugin('users') and
+                self.bot.get_plugin('users').is_online(to_user,
+                                                       event.network)):
             event.reply("{} is here, you can tell them yourself."
                     .format(to_user))
         else:
             msg = {'message': message,
                    'from': from_user,
                    'to': to_user,
+                   'network': event.network,
                    'time': time}
-            self.db.messages.insert(msg)
+            # Only count the message as pending once it's been stored, so
+            # that it can't be missed by a delivery
+            d = self.async_db.messages.insert(msg)
+            d.addCallback(lambda _: self.pending.update(
+                [(event.network, to_user)]))
+            d.addErrback(self.bot.log_err)
             event.reply("{}, I'll let {} know.".format(from_user, to_user))
 
     @features.hook('userJoined')
     def userJoined(self, event):
-        print("user {} has joined the channel {}".format(event.user,
-            event.channel))
-        msgs = self.getMessages(event.user)
-        if msgs.count() > 1:
+        # Almost everyone who joins has no messages
+        count = self.pending.get((event.network, event.user), 0)
+        if count == 0:
+            return
+        if count > 1:
             deliver_to = event.user
             event.protocol.msg(event.channel,
                     "{}, several people left messages for you. \
                     Please check the PMs I'm sending you.".format(event.user))
         else:
             deliver_to = event.channel
-        for msg in msgs:
-            from_user = msg['from']
-            time = msg['time'].strftime('%H:%M')
-            message = msg['message']
-            self.sendMessage(event.protocol, deliver_to,
-                    from_user, event.user, message, time)
-            # Remove the message now we've delivered it
-            self.db.messages.remove(msg['_id'])
+        self.deliverMessages(event.protocol, event.network, event.user,
+                             deliver_to)
+
+    def deliverMessages(self, bot, network, user, deliver_to):
+        """
+        Send all of *user*'s messages on *network* to *deliver_to*, and then
+        remove them from the database in one go.
+        """
+        # They won't be pending by the time anyone else could ask
+        del self.pending[network, user]
+
+        def deliver(msgs):
+            for msg in msgs:
+                from_user = msg['from']
+                time = msg['time'].strftime('%H:%M')
+                message = msg['message']
+                self.sendMessage(bot, deliver_to,
+                        from_user, user, message, time)
+            # Remove the messages now we've delivered them
+            return self.async_db.messages.remove(
+                    {'_id': {'$in': [m['_id'] for m in msgs]}})
+
+        d = self.getMessages(network, user)
+        d.addCallback(deliver)
+        d.addErrback(self.bot.log_err)
 
     def sendMessage(self, bot, channel, from_user, to_user, message, time):
         msg = "{}, \"{}\" - {} (at {})".format(
                 to_user, message, from_user, time)
         bot.msg(channel, msg)
 
-    def getMessages(self, user):
+    def getMessages(self, network, user):
         """
-        Gets a mongodb cursor to allow iterating over all the messages for a
-        user
+        Gets a Deferred that fires with a list of all the messages for a user
+        on a network
         """
-        return self.db.messages.find({'to': user})
+        return self.async_db.messages.find({'to': user, 'network': network})
 
-    def hasMessages(self, user):
-        return (self.db.messages.find({'to': user}).count() > 0)
+    def hasMessages(self, network, user):
+        return self.pending.get((network, user), 0) > 0
 
     def action(self, user, channel, action):
         print "*", action
@@ -113,4 +163,11 @@ class Tell(Plugin):
         If the user has no messages it will tell them
         > Bot       [13:37] | You have no messages. Sorry.
         """
-        # TODO: implement
+        user = nick(event.user)
+        count = self.pending.get((event.network, user), 0)
+        if count == 0:
+            event.reply("You have no messages. Sorry.")
+        else:
+            event.reply("You have {} message{}, please check your PM.".format(
+                count, '' if count == 1 else 's'))
+            self.deliverMessages(event.protocol, event.network, user, user)
@@ -1,5 +1,8 @@
-from csbot.core import Plugin, PluginFeatures
 from datetime import datetime
+import collections
+
+from csbot.core import Plugin, PluginFeatures
+from csbot.util import nick, is_channel
 
 
 class Users(Plugin):
@@ -13,32 +16,89 @@ class Users(Plugin):
     To do this it gets a list of logged in users when it joins the channel and
     then updates this list when users change nick, leave the channel or join
     the channel.
+
+    Everything is kept in memory: a presence record for each online user, keyed
+    by network and nick, holding the channels they are in, when they joined,
+    and when they last spoke and what they said.  Only the records of users
+    who have gone offline are written to the database, in the background, so
+    that !seen and !spoke still work for them after the bot restarts.
     """
 
     def setup(self):
-        # Clear out any previous records as the may be out of date and can't be
-        # trusted any more
-        self.db.offline_users.remove()
-        self.db.online_users.remove()
+        # network -> nick -> presence record of users in a channel with us
+        self.online = collections.defaultdict(dict)
+        # network -> nick -> last known presence record of users who have left
+        self.offline = collections.defaultdict(dict)
 
-    def is_online(self, user):
-        """
-        This checks to see if a user is known to be online.
+        # Records from before multi-network support, then load the offline
+        # history without blocking
+        d = self.async_db.offline_users.update(
+            {'network': {'$exists': False}},
+            {'$set': {'network': self.bot.default_network.name}}, multi=True)
+        d.addCallback(lambda _: self.async_db.offline_users.find())
+        d.addCallback(self.offline_loaded)
+        d.addErrback(self.bot.log_err)
 
-        If they have not done anything since the bot joined it will return a
-        false negative.  This is a known limitation that will be overcome when
-        it becomes possible to query the list of users in the channel.
+    def offline_loaded(self, records):
+        # A user can have more than one record, e.g. one written before
+        # multi-network support and one after, so keep the newest
+        loaded = {}
+        for record in records:
+            record.pop('_id', None)
+            key = (record['network'], record['user'])
+            if key not in loaded or record['time'] > loaded[key]['time']:
+                loaded[key] = record
+        for (network, user), record in loaded.iteritems():
+            # Don't overwrite anything that happened while loading
+            if (user not in self.online[network] and
+                    user not in self.offline[network]):
+                self.offline[network][user] = record
+
+    def snapshot(self):
+        return {'online': self.online, 'offline': self.offline}
+
+    def restore(self, state):
+        # Keep the same dictionaries, so that an offline history load still
+        # in progress fills in the new instance's
+        self.online = state['online']
+        self.offline = state['offline']
+
+    def teardown(self):
+        # Everyone we can see is about to be offline as far as we know.  This
+        # is the one time we write synchronously, since the bot is usually
+        # shutting down and there won't be a reactor to do it in the
+        # background.
+        now = datetime.now()
+        for network, online in self.online.items():
+            for user in online.keys():
+                self.save_offline(self.go_offline(network, user, now))
+
+    def is_online(self, user, network=None):
+        """
+        This checks to see if a user is known to be online, on *network* or
+        if it's None, on any network.
         """
-        return self.db.online_users.find({'user': user}).count() > 0
+        if network is not None:
+            return nick(user) in self.online[network]
+        return any(nick(user) in online for online in self.online.itervalues())
 
-    def get_online_users(self):
+    def get_online_users(self, network=None):
         """
-        This returns a list of all the users currently known to be online.
+        This returns a list of all the users currently known to be online, on
+        *network* or if it's None, on any network.
+        """
+        if network is not None:
+            return self.online[network].keys()
+        return list(set(user for online in self.online.itervalues()
+                        for user in online))
 
-        This is known to be incomplete at the moment as we can not currently
-        get the list of users in the channel.
+    def record(self, network, user):
+        """
+        Get the presence record for *user* on *network*, whether they are
+        online or offline, or None if we don't know about them.
         """
-        return [u['user'] for u in self.db.online_users.find()]
+        return self.online[network].get(user) or \
+            self.offline[network].get(user)
 
     @features.command('spoke')
     def spoke(self, event):
@@ -46,9 +106,12 @@ class Users(Plugin):
         Tells the user who asked when the last time the user they asked about
         spoke.
         """
-        usr = self.db.online_users.find_one({'user': event.data[0]})
+        if len(event.data) == 0:
+            event.error('You need to tell me who to look for!')
+            return
+        usr = self.record(event.network, event.data[0])
         if usr:
-            if 'time_last_spoke' in usr:
+            if usr.get('time_last_spoke') is not None:
                 event.reply("{} last said something {}".format(
                     usr['user'], usr['time_last_spoke']))
             else:
@@ -63,99 +126,141 @@ class Users(Plugin):
         Tells the user who asked when the last time the user they asked about
         was online.
         """
-        usr = self.db.offline_users.find_one({'user': event.data[0]})
-        if usr:
-            event.reply("{} was last seen at {}".format(usr['user'],
-                usr['time']))
+        if len(event.data) == 0:
+            event.error('You need to tell me who to look for!')
+            return
+        user = event.data[0]
+        if user in self.online[event.network]:
+            event.reply("{} is here.".format(user))
+        elif user in self.offline[event.network]:
+            event.reply("{} was last seen at {}".format(
+                user, self.offline[event.network][user]['time']))
         else:
-            usr = self.db.online_users.find_one({'user': event.data[0]})
-            if usr:
-                event.reply("{} is here.".format(usr['user']))
-            else:
-                event.reply("I haven't seen {}".format(event.data[0]))
+            event.reply("I haven't seen {}".format(user))
 
-    @features.hook('userJoined')
-    def userJoined(self, event):
-        usr_matcher = {'user': event.user}
-        # Delete any records of them being offline
-        self.db.offline_users.remove(usr_matcher)
-        # Update any existing records.
-        records = self.db.online_users.find(usr_matcher)
-        if records.count > 1:
-            # if there is more than one record, remove them and re-add them to
-            # be sure we only have one record of it
-            self.db.online_users.remove(usr_matcher)
-            usr_matcher['join_time'] = event.datetime
-            self.db.online_users.insert(usr_matcher)
-            # if there is one record update it
-        elif records.count == 1:
-            usr = records.next()
-            usr['join_time'] = event.datetime
-            self.db.online_users.save(usr)
-        else:
-            # if there is no record create a new one
-            usr_matcher['join_time'] = event.datetime
-            self.db.online_users.insert(usr_matcher)
+    def go_online(self, network, user, channel, time):
+        """
+        Mark *user* as being in *channel* on *network*, returning their
+        presence record.
+        """
+        online = self.online[network]
+        usr = online.get(user)
+        if usr is None:
+            old = self.offline[network].pop(user, {})
+            usr = online[user] = {
+                'user': user,
+                'network': network,
+                'channels': set(),
+                'join_time': time,
+                'time_last_spoke': old.get('time_last_spoke'),
+                'last_said': old.get('last_said'),
+            }
+        usr['channels'].add(channel)
+        return usr
+
+    def go_offline(self, network, user, time):
+        """
+        Mark *user* as offline on *network*, returning their new offline
+        record.
+        """
+        usr = self.online[network].pop(user, None) or \
+            self.offline[network].get(user) or {}
+        record = {
+            'user': user,
+            'network': network,
+            'time': time,
+            'time_last_spoke': usr.get('time_last_spoke'),
+            'last_said': usr.get('last_said'),
+        }
+        self.offline[network][user] = record
+        return record
+
+    def save_offline(self, record):
+        """
+        Write an offline record to the database, blocking until it's done.
+        """
+        self.db.offline_users.update(
+                {'network': record['network'], 'user': record['user']},
+                record, upsert=True)
+
+    def user_offline(self, network, user, time):
+        record = self.go_offline(network, user, time)
+        d = self.async_db.offline_users.update(
+                {'network': network, 'user': user}, record, upsert=True)
+        d.addErrback(self.bot.log_err)
+
+    def leave_channel(self, network, user, channel, time):
+        usr = self.online[network].get(user)
+        if usr is not None:
+            usr['channels'].discard(channel)
+            if not usr['channels']:
+                self.user_offline(network, user, time)
 
     @features.hook('names')
     def names(self, event):
         """
         When we connect to a channel we get a list of the names. This handles
-        that list and updates the lists of users.
+        that list and updates the presence records for that channel.
         """
-        # Remove everyone in the db
-        self.db.online_users.remove()
-        self.db.offline_users.remove()
-        for nick, mode in event.names:
-            self.db.online_users.insert({
-                'user': nick,
-                'join_time': event.datetime,
-                })
+        network = event.network
+        present = set(name for name, mode in event.names)
+        for user, usr in self.online[network].items():
+            if event.channel in usr['channels'] and user not in present:
+                self.leave_channel(network, user, event.channel,
+                                   event.datetime)
+        for user in present:
+            self.go_online(network, user, event.channel, event.datetime)
+
+    @features.hook('userJoined')
+    def userJoined(self, event):
+        self.go_online(event.network, event.user, event.channel,
+                       event.datetime)
 
     @features.hook('privmsg')
     def privmsg(self, event):
-        usr = self.db.online_users.find_one({'user': event.user})
+        user = nick(event.user)
+        if is_channel(event.channel):
+            usr = self.go_online(event.network, user, event.channel,
+                                 event.datetime)
+        else:
+            usr = self.online[event.network].get(user)
         if usr:
-            usr['last_said'] = event.msg
+            usr['last_said'] = event.message
             usr['time_last_spoke'] = event.datetime
-            usr.save()
-#        else:
-#            usr = {'user': event.user,
-#                    'time_last_spoke': event.datetime,
-#                    'join_time': event.datetime}
-#            self.db.online_users.insert(usr)
 
     @features.hook('userRenamed')
     def userRenamed(self, event):
-        usrs = self.db.online_users.find({'user': event.oldname})
-        if usrs.count() > 1:
-            self.db.online_users.remove({'user': event.oldname})
-        elif usrs.count() < 1:
-            usr = {'user': event.newname, 'join_time': event.datetime}
-            self.db.online_users.insert(usr)
-        else:
-            usr = usrs.next()
-            usrs['user'] = event.newname
-            self.db.online_users.save(usr)
-
-    def userOffline(self, event):
-        # Remove any record of being online or offline
-        self.db.online_users.remove({'user': event.user})
-        self.db.offline_users.remove({'user': event.user})
-        # Be offline
-        self.db.offline_users.insert({
-            'user': event.user,
-            'time': datetime.now()
-            })
+        network = event.network
+        usr = self.online[network].get(event.oldname)
+        if usr is None:
+            return
+        # The old nick was last seen now, the new nick carries on
+        self.user_offline(network, event.oldname, event.datetime)
+        self.offline[network].pop(event.newname, None)
+        self.online[network][event.newname] = dict(usr, user=event.newname)
 
     @features.hook('userLeft')
     def userLeft(self, event):
-        self.userOffline(event)
+        self.leave_channel(event.network, event.user, event.channel,
+                           event.datetime)
+
+    @features.hook('userKicked')
+    def userKicked(self, event):
+        self.leave_channel(event.network, event.kickee, event.channel,
+                           event.datetime)
 
     @features.hook('userQuit')
     def userQuit(self, event):
-        self.userOffline(event)
+        self.user_offline(event.network, event.user, event.datetime)
 
-    @features.hook('userKicked')
-    def userKicked(self, event):
-        self.userOffline(event)
+    def bot_left(self, network, channel, time):
+        for user in self.online[network].keys():
+            self.leave_channel(network, user, channel, time)
+
+    @features.hook('left')
+    def left(self, event):
+        self.bot_left(event.network, event.channel, event.datetime)
+
+    @features.hook('kickedFrom')
+    def kickedFrom(self, event):
+        self.bot_left(event.network, event.channel, event.datetime)
@@ -0,0 +1,173 @@
+"""Finding out which plugins, hooks and commands the bot spends its time in.
+
+While :meth:`.Bot.start_profiling` is in effect, :meth:`.Bot.fire_hooks` and
+:meth:`.Bot.dispatch_command` run every handler through a :class:`Profiler`,
+which times each one.  The timings can be summarised, per handler or per
+plugin, and dumped in :mod:`pstats` format, so the usual tools can be used
+on them::
+
+    python -c "import pstats; pstats.Stats('csbot.prof').print_stats(20)"
+
+A profiler can also run :mod:`cProfile` over everything the bot does, which
+shows where time goes inside the handlers but slows the bot down a lot more;
+its statistics are dumped instead of the handler timings.
+"""
+import os
+import inspect
+import marshal
+import cProfile
+from timeit import default_timer
+
+
+def handler_plugin(handler):
+    """Get the name of the plugin that *handler* belongs to, or ``bot`` for
+    the :class:`.Bot`'s own handlers.
+    """
+    owner = getattr(handler, 'im_self', None)
+    plugin_name = getattr(owner, 'plugin_name', None)
+    return plugin_name() if plugin_name is not None else 'bot'
+
+
+def handler_location(handler):
+    """Get the source file and first line of *handler*, for :mod:`pstats`.
+    """
+    func = getattr(handler, 'im_func', handler)
+    try:
+        return (inspect.getsourcefile(func) or '~',
+                func.func_code.co_firstlineno)
+    except (TypeError, AttributeError):
+        return '~', 0
+
+
+class Profiler(object):
+    """Times the handlers called through :meth:`call`, and if *deterministic*
+    is true, profiles everything with :mod:`cProfile` while running.
+    """
+    def __init__(self, deterministic=False, timer=default_timer):
+        self.timer = timer
+        self.profile = cProfile.Profile() if deterministic else None
+        # (kind, name, handler) -> [calls, total time, longest time]
+        self.timings = dict()
+        # Time spent in handlers called by each handler being timed
+        self.nested = []
+        self.running = False
+        self.elapsed = 0.0
+        self.started = None
+
+    @property
+    def deterministic(self):
+        return self.profile is not None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.started = self.timer()
+            if self.profile is not None:
+                self.profile.enable()
+
+    def stop(self):
+        if self.running:
+            if self.profile is not None:
+                self.profile.disable()
+            self.running = False
+            self.elapsed += self.timer() - self.started
+
+    def total_time(self):
+        """Seconds spent running, so far."""
+        if self.running:
+            return self.elapsed + self.timer() - self.started
+        return self.elapsed
+
+    def call(self, kind, name, handler, f, *args):
+        """Call *f* with *args*, timing it as *handler* handling *kind*
+        (``hook`` or ``command``) *name* (the event type or command).
+
+        Handlers called from inside *f*, e.g. a command dispatched by the
+        bot's ``command`` hook, are timed separately, and their time isn't
+        counted as *handler*'s.
+        """
+        self.nested.append(0.0)
+        start = self.timer()
+        try:
+            return f(*args)
+        finally:
+            total = self.timer() - start
+            nested = self.nested
+            elapsed = total - nested.pop()
+            if nested:
+                nested[-1] += total
+            key = (kind, name, handler)
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                if elapsed > timing[2]:
+                    timing[2] = elapsed
+
+    def label(self, kind, name, handler):
+        return '{} {} ({}.{})'.format(kind, name, handler_plugin(handler),
+                                      getattr(handler, '__name__', handler))
+
+    def by_handler(self):
+        """Get ``(label, calls, total time, longest time)`` for each handler,
+        most total time first.
+        """
+        rows = [(self.label(*key), calls, total, longest)
+                for key, (calls, total, longest) in self.timings.iteritems()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def by_plugin(self):
+        """Get ``(plugin, calls, total time)`` for each plugin, most total
+        time first.
+        """
+        plugins = dict()
+        for (kind, name, handler), timing in self.timings.iteritems():
+            totals = plugins.setdefault(handler_plugin(handler), [0, 0.0])
+            totals[0] += timing[0]
+            totals[1] += timing[1]
+        rows = [(plugin, calls, total)
+                for plugin, (calls, total) in plugins.iteritems()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def summary(self, n=5):
+        """Get lines describing the *n* most expensive handlers and plugins.
+        """
+        lines = ['Profiled {:.1f}s: {}'.format(
+            self.total_time(),
+            ', '.join('{} {:.3f}s'.format(plugin, total)
+                      for plugin, calls, total in self.by_plugin()[:n]) or
+            'nothing called')]
+        for label, calls, total, longest in self.by_handler()[:n]:
+            lines.append('{}: {} calls, {:.3f}s, {:.2f}ms mean, {:.2f}ms '
+                         'max'.format(label, calls, total,
+                                      total / calls * 1000, longest * 1000))
+        return lines
+
+    def stats(self):
+        """Get the handler timings as a :mod:`pstats` statistics dictionary.
+        """
+        stats = dict()
+        for (kind, name, handler), timing in self.timings.iteritems():
+            filename, line = handler_location(handler)
+            calls, total = timing[0], timing[1]
+            stats[(filename, line, self.label(kind, name, handler))] = \
+                (calls, calls, total, total, {})
+        return stats
+
+    def dump(self, path):
+        """Write the :mod:`cProfile` statistics, if profiling
+        deterministically, or else the handler timings, to *path* in
+        :mod:`pstats` format.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if self.profile is not None:
+            self.profile.dump_stats(path)
+        else:
+            with open(path, 'wb') as f:
+                marshal.dump(self.stats(), f)
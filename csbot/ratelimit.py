@@ -0,0 +1,205 @@
+"""Flood protection for commands.
+
+:class:`CommandLimiter` sits in front of :meth:`.Bot.fire_command`, so that
+one user repeating a command can't fill the outbound queue or keep the
+database busy.  Each user, identified by their hostmask, has a
+:class:`.TokenBucket`, and so does each command, shared by everyone using
+it.  A command is only run if both buckets have a token; otherwise it is
+dropped, or deferred until the tokens are available.
+
+Users' buckets are kept in a :class:`.LRUCache`, so a flood of different
+hostmasks can't use up memory: the users heard from least recently are
+forgotten, which only loses how much of their limit they have used.
+"""
+import collections
+
+from twisted.internet import reactor
+from twisted.python import log
+
+from csbot.util import TokenBucket, LRUCache
+
+
+#: Over-limit commands are thrown away
+DROP = 'drop'
+#: Over-limit commands are run once the limits allow it
+DEFER = 'defer'
+
+
+class UserState(object):
+    """A user's token bucket and deferred commands."""
+    __slots__ = ('bucket', 'queue', 'pending')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        #: Deferred (command, dispatch) pairs, in the order they were sent
+        self.queue = collections.deque()
+        #: Call to :meth:`CommandLimiter.run`, if commands are deferred
+        self.pending = None
+
+
+class CommandLimiter(object):
+    """Rate limits for commands, per user and per command.
+
+    Each user may run *user_rate* commands per second with bursts of up to
+    *user_burst*, and each command may be run *command_rate* times per second
+    with bursts of up to *command_burst*.  A rate of None means no limit.
+    Buckets are kept for at most *max_users* users and *max_commands*
+    commands.
+
+    *action* is :data:`DROP` or :data:`DEFER`.  When deferring, each user can
+    have up to *max_deferred* commands waiting, after which further commands
+    are dropped.  *clock* provides ``seconds()`` and ``callLater()``, and is
+    normally the reactor.
+
+    :meth:`stats` counts what was throttled.
+    """
+    def __init__(self, user_rate, user_burst, command_rate=None,
+                 command_burst=None, max_users=1000, max_commands=1000,
+                 action=DROP, max_deferred=5, clock=reactor):
+        if action not in (DROP, DEFER):
+            raise ValueError('action must be {!r} or {!r}, not {!r}'.format(
+                DROP, DEFER, action))
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.command_rate = command_rate
+        self.command_burst = command_burst
+        self.action = action
+        self.max_deferred = max_deferred
+        self.clock = clock
+        # Hostmask -> UserState
+        self.users = LRUCache(max_users, on_evict=self.user_evicted)
+        # Command name -> TokenBucket
+        self.commands = LRUCache(max_commands)
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the counters reported by :meth:`stats`."""
+        self.allowed_count = 0
+        self.dropped_count = 0
+        self.deferred_count = 0
+        self.user_limited_count = 0
+        self.command_limited_count = 0
+
+    def bucket(self, rate, burst):
+        if rate is None:
+            return None
+        return TokenBucket(rate, burst, self.clock.seconds)
+
+    def user_state(self, user):
+        state = self.users.get(user)
+        if state is None:
+            state = self.users[user] = UserState(
+                self.bucket(self.user_rate, self.user_burst))
+        return state
+
+    def command_bucket(self, command):
+        if self.command_rate is None:
+            return None
+        bucket = self.commands.get(command)
+        if bucket is None:
+            bucket = self.commands[command] = self.bucket(self.command_rate,
+                                                          self.command_burst)
+        return bucket
+
+    def user_evicted(self, user, state):
+        """Drop the deferred commands of a user who has been forgotten."""
+        if state.pending is not None and state.pending.active():
+            state.pending.cancel()
+        self.dropped_count += len(state.queue)
+
+    def consume(self, state, command):
+        """Take a token from *state*'s and *command*'s buckets if both have
+        one, returning 0, or otherwise the number of seconds until they
+        will.
+        """
+        user_delay = 0.0
+        if state.bucket is not None:
+            user_delay = state.bucket.delay()
+        command_bucket = self.command_bucket(command.command)
+        command_delay = 0.0
+        if command_bucket is not None:
+            command_delay = command_bucket.delay()
+        if user_delay > 0 or command_delay > 0:
+            return max(user_delay, command_delay)
+        if state.bucket is not None:
+            state.bucket.consume()
+        if command_bucket is not None:
+            command_bucket.consume()
+        return 0.0
+
+    def submit(self, command, dispatch):
+        """Call *dispatch* with *command* if it is within the limits, and
+        otherwise drop or defer it.  Returns True if it was dispatched
+        straight away.
+        """
+        state = self.user_state(command.user)
+        # Commands already waiting go first
+        if state.queue:
+            self.defer(state, command, dispatch)
+            return False
+
+        delay = self.consume(state, command)
+        if delay == 0:
+            self.allowed_count += 1
+            dispatch(command)
+            return True
+
+        if state.bucket is not None and state.bucket.delay() > 0:
+            self.user_limited_count += 1
+        else:
+            self.command_limited_count += 1
+        if self.action == DEFER:
+            self.defer(state, command, dispatch, delay)
+        else:
+            self.dropped_count += 1
+        return False
+
+    def defer(self, state, command, dispatch, delay=None):
+        if len(state.queue) >= self.max_deferred:
+            self.dropped_count += 1
+            return
+        state.queue.append((command, dispatch))
+        self.deferred_count += 1
+        if state.pending is None:
+            state.pending = self.clock.callLater(delay or 0.0, self.run,
+                                                 state)
+
+    def run(self, state):
+        """Dispatch as many of *state*'s deferred commands as the limits
+        allow, and wait for the rest.
+        """
+        state.pending = None
+        while state.queue:
+            command, dispatch = state.queue[0]
+            delay = self.consume(state, command)
+            if delay > 0:
+                state.pending = self.clock.callLater(delay, self.run, state)
+                return
+            state.queue.popleft()
+            self.allowed_count += 1
+            try:
+                dispatch(command)
+            except Exception:
+                log.err(None, 'Error running deferred command {!r}'.format(
+                    command.command))
+
+    def stats(self):
+        """Get a dictionary of counters.
+
+        ``allowed`` counts commands that were dispatched, ``dropped`` those
+        that weren't and ``deferred`` those that had to wait, since the last
+        :meth:`reset_stats`.  ``user_limited`` and ``command_limited`` count
+        which limit over-limit commands hit.  ``users`` is the number of
+        users being tracked, ``evictions`` how many have been forgotten, and
+        ``waiting`` the number of deferred commands still waiting.
+        """
+        return {
+            'allowed': self.allowed_count,
+            'dropped': self.dropped_count,
+            'deferred': self.deferred_count,
+            'user_limited': self.user_limited_count,
+            'command_limited': self.command_limited_count,
+            'users': len(self.users),
+            'evictions': self.users.evictions,
+            'waiting': sum(len(s.queue) for s in self.users.values()),
+        }
@@ -0,0 +1,192 @@
+"""Recording and replaying IRC traffic.
+
+A :class:`Recorder` attached to a :class:`.BotProtocol` writes every line
+received from the server to a capture file, one per line, prefixed by the
+time it was received and a tab.  A :class:`Replayer` feeds a capture back
+through a :class:`.BotProtocol` connected to a :class:`SinkTransport`, either
+with the original timing, sped up, or as fast as possible, and measures how
+the bot copes.  This makes it possible to reproduce load spikes, e.g.
+netsplits and floods, without a server::
+
+    python run_csbot.py --record traffic.log
+    python run_csbot.py --replay traffic.log --speed 0
+"""
+import collections
+import time
+
+from twisted.internet import reactor, defer, address
+
+
+class Recorder(object):
+    """Writes received lines to the capture file at *path*, appending if it
+    already exists.
+    """
+    def __init__(self, path):
+        # Line buffered, so a crash loses at most a partial line
+        self.file = open(path, 'ab', 1)
+
+    def record(self, line, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.file.write('{:.6f}\t{}\n'.format(timestamp, line))
+
+    def close(self):
+        self.file.close()
+
+
+def read_capture(path):
+    """Generate ``(timestamp, line)`` pairs from the capture file at *path*.
+    """
+    with open(path, 'rb') as f:
+        for entry in f:
+            timestamp, _, line = entry.rstrip('\n').partition('\t')
+            yield float(timestamp), line
+
+
+class SinkTransport(object):
+    """A transport that throws away everything written to it, counting the
+    lines sent for each IRC command and the total number of bytes.
+    """
+    def __init__(self):
+        self.commands = collections.Counter()
+        self.bytes = 0
+        self.connected = True
+
+    def write(self, data):
+        self.bytes += len(data)
+        for line in data.splitlines():
+            if line:
+                self.commands[line.split(' ', 1)[0]] += 1
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+    def loseConnection(self):
+        self.connected = False
+
+    def getPeer(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 6667)
+
+    def getHost(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 0)
+
+
+def percentile(ordered, p):
+    """Get the *p*\\ th percentile of a sorted list, by nearest rank.
+
+    >>> percentile(range(1, 101), 90)
+    90
+    """
+    if not ordered:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+class Replayer(object):
+    """Feeds the lines from *capture*, an iterable of ``(timestamp, line)``
+    pairs, to *protocol*.
+
+    If *speed* is 0 the lines are fed as fast as possible, otherwise the gaps
+    between them are kept but divided by *speed*.  *clock* provides
+    ``seconds()`` and ``callLater()``, and is normally the reactor.  Control
+    returns to the reactor regularly so that timers, e.g. for the outbound
+    scheduler, still run.
+
+    :attr:`finished` is a :class:`~twisted.internet.defer.Deferred` that
+    fires with the replayer when every line has been fed.
+    """
+    #: Longest time to spend feeding lines before returning to the reactor
+    SLICE = 0.05
+
+    def __init__(self, protocol, capture, speed=1.0, clock=reactor):
+        self.protocol = protocol
+        self.capture = iter(capture)
+        self.speed = speed
+        self.clock = clock
+        self.finished = defer.Deferred()
+
+        # Time taken to handle each line
+        self.latencies = []
+        # Longest time a line was fed after it was due
+        self.max_lag = 0.0
+        self.started = None
+        self.elapsed = None
+        self.first = None
+        self.next = None
+
+    def start(self):
+        self.started = self.clock.seconds()
+        self.next = next(self.capture, None)
+        if self.next is not None:
+            self.first = self.next[0]
+        self.clock.callLater(0, self.feed)
+        return self.finished
+
+    def feed(self):
+        """Feed lines until one isn't due yet or the time slice is used up,
+        then schedule the next call.
+        """
+        deadline = self.clock.seconds() + self.SLICE
+        while self.next is not None:
+            timestamp, line = self.next
+            now = self.clock.seconds()
+            if self.speed:
+                due = self.started + (timestamp - self.first) / self.speed
+                if due > now:
+                    self.clock.callLater(due - now, self.feed)
+                    return
+                self.max_lag = max(self.max_lag, now - due)
+            elif now > deadline:
+                self.clock.callLater(0, self.feed)
+                return
+
+            start = time.time()
+            self.protocol.lineReceived(line)
+            self.latencies.append(time.time() - start)
+            self.next = next(self.capture, None)
+
+        self.elapsed = self.clock.seconds() - self.started
+        self.finished.callback(self)
+
+    def stats(self):
+        """Get a dictionary of replay statistics.
+
+        ``lines`` is the number of lines replayed, ``elapsed`` the time taken
+        and ``rate`` the lines per second.  ``latency`` maps percentiles
+        (50, 90, 99 and 100) to the time taken to handle a line, and
+        ``max_lag`` is the furthest behind schedule the replay got.
+        ``outbound`` maps IRC commands to the number of lines the bot sent.
+        """
+        ordered = sorted(self.latencies)
+        elapsed = self.elapsed or 0.0
+        transport = self.protocol.transport
+        return {
+            'lines': len(ordered),
+            'elapsed': elapsed,
+            'rate': len(ordered) / elapsed if elapsed > 0 else 0.0,
+            'latency': dict((p, percentile(ordered, p))
+                            for p in (50, 90, 99, 100)),
+            'max_lag': self.max_lag,
+            'outbound': dict(getattr(transport, 'commands', {})),
+            'outbound_bytes': getattr(transport, 'bytes', 0),
+        }
+
+    def report(self):
+        """Get a human-readable summary of :meth:`stats`."""
+        s = self.stats()
+        lines = [
+            'Replayed {lines} lines in {elapsed:.3f}s '
+            '({rate:,.0f} lines/sec)'.format(**s),
+            'Handler latency: ' + ', '.join(
+                'p{} {:.3f}ms'.format(p, s['latency'][p] * 1000)
+                for p in sorted(s['latency'])),
+        ]
+        if self.speed:
+            lines.append('Max lag behind schedule: {:.3f}ms'.format(
+                s['max_lag'] * 1000))
+        lines.append('Sent {} lines ({} bytes): {}'.format(
+            sum(s['outbound'].values()), s['outbound_bytes'],
+            ', '.join('{} {}'.format(c, n)
+                      for c, n in sorted(s['outbound'].iteritems()))))
+        return '\n'.join(lines)
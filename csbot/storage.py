@@ -0,0 +1,162 @@
+"""Non-blocking access to plugin databases.
+
+Plugins get a synchronous :mod:`pymongo` database from :attr:`.Plugin.db`, but
+any query made with it blocks the reactor until the server answers.
+:attr:`.Plugin.async_db` wraps the same database so that every operation runs
+on the bot's :class:`StoragePool` and returns a
+:class:`~twisted.internet.defer.Deferred` instead.
+"""
+import collections
+import threading
+import time
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import threadpool, log
+
+
+class StorageStats(object):
+    """Timing of storage operations, by label.
+
+    For each label the number of calls and the total and maximum time spent
+    queued for a worker and running are kept.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0.0])
+
+    def record(self, label, queued, running):
+        with self.lock:
+            s = self.calls[label]
+            s[0] += 1
+            s[1] += queued
+            s[2] = max(s[2], queued)
+            s[3] += running
+            s[4] = max(s[4], running)
+
+    def summary(self):
+        """Get a dictionary mapping from label to a dictionary of ``calls``,
+        ``mean_queued``, ``max_queued``, ``mean_time`` and ``max_time``.
+        """
+        with self.lock:
+            return dict((label, {
+                'calls': n,
+                'mean_queued': queued / n,
+                'max_queued': max_queued,
+                'mean_time': running / n,
+                'max_time': max_running,
+            }) for label, (n, queued, max_queued, running, max_running)
+                   in self.calls.iteritems())
+
+
+class StoragePool(object):
+    """A bounded pool of worker threads for blocking storage operations.
+
+    At most *size* operations run at once, the rest wait their turn.  If *size*
+    is 0 operations run immediately in the calling thread instead, which
+    blocks but is sometimes useful for debugging and tests.  Every operation is
+    timed (see :class:`StorageStats`), and any that take longer than *slow*
+    seconds are logged.
+    """
+    def __init__(self, size, slow=None):
+        self.size = size
+        self.slow = slow
+        self.stats = StorageStats()
+        self.threadpool = None
+
+    def start(self):
+        if self.threadpool is None and self.size > 0:
+            self.threadpool = threadpool.ThreadPool(0, self.size,
+                                                    'csbot-storage')
+            self.threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        if self.threadpool is not None:
+            self.threadpool.stop()
+            self.threadpool = None
+
+    def run(self, label, f, *args, **kwargs):
+        """Run ``f(*args, **kwargs)`` on the pool, returning a
+        :class:`~twisted.internet.defer.Deferred` that fires with the result.
+        """
+        submitted = time.time()
+
+        def timed():
+            started = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                finished = time.time()
+                self.stats.record(label, started - submitted,
+                                  finished - started)
+                if self.slow is not None and finished - started > self.slow:
+                    log.msg('Slow storage operation {}: {:.3f}s'.format(
+                        label, finished - started))
+
+        if self.size == 0:
+            return defer.maybeDeferred(timed)
+        self.start()
+        return threads.deferToThreadPool(reactor, self.threadpool, timed)
+
+
+class AsyncCollection(object):
+    """Wraps a :mod:`pymongo` collection so that operations run on a
+    :class:`StoragePool`.
+
+    The methods take the same arguments as their :mod:`pymongo` counterparts
+    but return a :class:`~twisted.internet.defer.Deferred`.  :meth:`find`
+    results are fetched in full by the worker, so the Deferred fires with a
+    list rather than a cursor.
+    """
+    def __init__(self, collection, pool, prefix):
+        self.collection = collection
+        self.pool = pool
+        self.prefix = prefix
+
+    def _run(self, operation, f, *args, **kwargs):
+        return self.pool.run(self.prefix + operation, f, *args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return self._run('find',
+                         lambda: list(self.collection.find(*args, **kwargs)))
+
+    def find_one(self, *args, **kwargs):
+        return self._run('find_one', self.collection.find_one,
+                         *args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        return self._run('count',
+                         lambda: self.collection.find(*args, **kwargs).count())
+
+    def insert(self, *args, **kwargs):
+        return self._run('insert', self.collection.insert, *args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        return self._run('save', self.collection.save, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._run('update', self.collection.update, *args, **kwargs)
+
+    def remove(self, *args, **kwargs):
+        return self._run('remove', self.collection.remove, *args, **kwargs)
+
+    def drop(self):
+        return self._run('drop', self.collection.drop)
+
+
+class AsyncDatabase(object):
+    """Wraps a :mod:`pymongo` database, giving access to its collections as
+    :class:`AsyncCollection` objects.
+    """
+    def __init__(self, database, pool):
+        self.database = database
+        self.pool = pool
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.database[name], self.pool,
+                               '{}.{}.'.format(self.database.name, name))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
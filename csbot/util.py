@@ -1,4 +1,5 @@
-import shlex
+import re
+import time
 
 
 def nick(user):
@@ -39,13 +40,40 @@ def is_channel(channel):
     return channel.startswith('#')
 
 
+class ParseError(ValueError):
+    """Raised by :func:`parse_arguments` when a string can't be parsed.
+
+    :attr:`position` is the index in the string of the character that caused
+    the problem: the unmatched quote, or the backslash with nothing after it.
+    """
+    def __init__(self, message, position):
+        ValueError.__init__(self, message)
+        self.position = position
+
+
+#: One piece of an argument string: whitespace, a comment, a run of ordinary
+#: characters, a backslash escape or a double-quoted string
+_ARGUMENT_PIECE = re.compile(r"""
+      (?P<whitespace>[ \t\r\n]+)
+    | (?P<comment>\#[^\n]*\n?)
+    | (?P<word>[^ \t\r\n\#"\\]+)
+    | (?P<escape>\\(?P<escaped>.)?)
+    | (?P<quoted>"(?P<body>(?:[^"\\]|\\.)*)(?P<close>"?))
+    """, re.VERBOSE | re.DOTALL)
+
+#: Escape sequences that have an effect inside double quotes
+_QUOTED_ESCAPE = re.compile(r'\\(["\\])')
+
+
 def parse_arguments(raw):
-    """Parse *raw* into a list of arguments using :mod:`shlex`.
+    """Parse *raw* into a list of arguments.
 
-    The :mod:`shlex` lexer is customised to be more appropriate for grouping
-    natural language arguments by only treating ``"`` as a quote character.
-    This allows ``'`` to be used naturally.  A :exc:`~exceptions.ValueError`
-    will be raised if the string couldn't be parsed.
+    Arguments are separated by whitespace, but only ``"`` is treated as a
+    quote character.  This allows ``'`` to be used naturally.  The rules are
+    otherwise the same as POSIX-mode :mod:`shlex`, which this used to be
+    implemented with: ``\\`` escapes the next character and ``#`` starts a
+    comment.  A :exc:`ParseError` (a :exc:`~exceptions.ValueError`) will be
+    raised if the string couldn't be parsed.
 
     >>> parse_arguments("a test string")
     ['a', 'test', 'string']
@@ -56,12 +84,195 @@ def parse_arguments(raw):
     >>> parse_arguments('just remember to "match your quotes')
     Traceback (most recent call last):
       File "<stdin>", line 1, in ?
-    ValueError: No closing quotation
+    ParseError: No closing quotation
+    """
+    args = []
+    # The argument being built, None between arguments
+    arg = None
+    pos = 0
+    end = len(raw)
+    match = _ARGUMENT_PIECE.match
+
+    while pos < end:
+        m = match(raw, pos)
+        kind = m.lastgroup
+        if kind == 'word':
+            arg = m.group() if arg is None else arg + m.group()
+        elif kind == 'whitespace' or kind == 'comment':
+            if arg is not None:
+                args.append(arg)
+                arg = None
+        elif kind == 'quoted':
+            if not m.group('close'):
+                if m.end() < end:
+                    # Stopped at a backslash at the very end of the string
+                    raise ParseError('No escaped character', end - 1)
+                raise ParseError('No closing quotation', pos)
+            body = m.group('body')
+            if '\\' in body:
+                body = _QUOTED_ESCAPE.sub(r'\1', body)
+            arg = body if arg is None else arg + body
+        else:
+            escaped = m.group('escaped')
+            if escaped is None:
+                raise ParseError('No escaped character', pos)
+            arg = escaped if arg is None else arg + escaped
+        pos = m.end()
+
+    if arg is not None:
+        args.append(arg)
+    return args
+
+
+class TokenBucket(object):
+    """A token bucket rate limiter.
+
+    The bucket holds up to *burst* tokens and refills at *rate* tokens per
+    second.  *clock* is a function returning the current time in seconds.
+
+    >>> now = [0.0]
+    >>> bucket = TokenBucket(1, 2, clock=lambda: now[0])
+    >>> bucket.consume(), bucket.consume(), bucket.consume()
+    (True, True, False)
+    >>> bucket.delay()
+    1.0
+    >>> now[0] = 1.0
+    >>> bucket.consume()
+    True
+    """
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def refill(self):
+        """Add the tokens accumulated since the last refill."""
+        now = self.clock()
+        if now > self.updated:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, n=1):
+        """Take *n* tokens if they are available, returning True if they
+        were.
+        """
+        self.refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def delay(self, n=1):
+        """Get the number of seconds until *n* tokens are available."""
+        self.refill()
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+class LRUCache(object):
+    """A mapping holding at most *maxsize* items, which forgets the least
+    recently used item to make room for a new one.
+
+    *on_evict*, if given, is called with the key and value of each item that
+    is forgotten.  :attr:`evictions` counts them.
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1; cache['b'] = 2
+    >>> cache['a']
+    1
+    >>> cache['c'] = 3
+    >>> sorted(cache.keys()), cache.evictions
+    (['a', 'c'], 1)
     """
-    # Start with a shlex instance similar to shlex.split
-    lex = shlex.shlex(raw, posix=True)
-    lex.whitespace_split = True
-    # Restrict quoting characters to "
-    lex.quotes = '"'
-    # Parse the string
-    return list(lex)
+    # Links in the circular list of items, least recently used first, are
+    # [previous, next, key, value].  Unlike with collections.OrderedDict,
+    # moving an item to the end is done in place, which makes lookups a lot
+    # cheaper.
+    def __init__(self, maxsize, on_evict=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.evictions = 0
+        # Key -> link
+        self.links = dict()
+        self.root = []
+        self.clear()
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __getitem__(self, key):
+        link = self.links[key]
+        # Move the link to the most recently used end
+        prev, next_ = link[0], link[1]
+        prev[1] = next_
+        next_[0] = prev
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return link[3]
+
+    def __setitem__(self, key, value):
+        if key in self.links:
+            # Move it to the end
+            self[key]
+            self.links[key][3] = value
+            return
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = self.links[key] = [last, root, key, value]
+        while len(self.links) > self.maxsize:
+            old_key, old_value = self.pop_oldest()
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key, old_value)
+
+    def __delitem__(self, key):
+        prev, next_, _, _ = self.links.pop(key)
+        prev[1] = next_
+        next_[0] = prev
+
+    def pop_oldest(self):
+        """Remove the least recently used item, returning its key and
+        value.
+        """
+        link = self.root[1]
+        del self[link[2]]
+        return link[2], link[3]
+
+    def get(self, key, default=None):
+        """Get the value for *key*, marking it as recently used, or *default*
+        if there isn't one.
+        """
+        if key in self.links:
+            return self[key]
+        return default
+
+    def iterlinks(self):
+        link = self.root[1]
+        while link is not self.root:
+            yield link
+            link = link[1]
+
+    def keys(self):
+        """Get the keys, least recently used first."""
+        return [link[2] for link in self.iterlinks()]
+
+    def values(self):
+        """Get the values, least recently used first."""
+        return [link[3] for link in self.iterlinks()]
+
+    def clear(self):
+        self.links.clear()
+        root = self.root
+        root[:] = [root, root, None, None]
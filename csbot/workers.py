@@ -0,0 +1,601 @@
+"""Running plugins in worker processes.
+
+Plugins named in the ``worker_plugins`` option are loaded into a pool of
+``plugin_workers`` child processes instead of into the bot, so that a plugin
+which does a lot of work, or which can't be trusted not to crash, doesn't hold
+up or take down everything else.  Nothing about the plugin changes: it is
+written against the normal :class:`.Plugin` API and moved into a worker by
+configuration alone.
+
+In the bot each worker plugin is represented by a :class:`RemotePlugin`, which
+has the same name, commands and hooks as the real plugin.  Its handlers pass
+each event to the plugin's :class:`Worker` as a message on the child's
+stdin, and each worker process (``python -m csbot.workers``) runs a
+:class:`WorkerBot` which turns the messages back into events and dispatches
+them to the real plugins.  Anything a plugin does with ``event.protocol``,
+e.g. replying, is sent back over the child's stdout and done by the bot's
+:class:`.BotProtocol` for the same network.  A worker that exits is restarted
+after a delay, and its plugins are loaded again.
+
+Messages are framed with a 4 byte length prefix.  Messages to a worker are
+pickled tuples; messages from a worker are JSON, so that a misbehaving plugin
+can't make the bot run arbitrary code, and may only call the protocol methods
+in :data:`PROTOCOL_METHODS`.
+
+There are some limitations compared to running plugins in the bot:
+
+- Other plugins can't call a worker plugin's methods through
+  :meth:`.Bot.get_plugin`.
+- Protocol methods return nothing, because they are run later by the bot.
+- Values stored with :meth:`.Plugin.set` must be JSON-compatible, and come
+  back from :meth:`.Plugin.get` with tuples as lists and unicode strings UTF-8
+  encoded.  The worker starts with a copy of the plugin's values and sends
+  changes to the bot, which owns the store.
+- Each worker has its own :attr:`.Bot.mongodb` connection, so the
+  ``:memory:`` database isn't shared with the bot.
+"""
+import os
+import sys
+import json
+import signal
+import cPickle as pickle
+from cStringIO import StringIO
+
+from zope.interface import implements
+from twisted.internet import reactor, protocol, defer, stdio
+from twisted.internet.interfaces import IHalfCloseableProtocol
+from twisted.protocols import basic
+from twisted.python import log
+
+import csbot
+import csbot.core as core
+import csbot.events as events
+
+
+#: :class:`.BotProtocol` methods that worker plugins may call
+PROTOCOL_METHODS = frozenset([
+    'msg', 'notice', 'describe', 'say', 'join', 'leave', 'part', 'kick',
+    'invite', 'topic', 'mode', 'setNick', 'away', 'back',
+])
+
+#: Directory containing the :mod:`csbot` package, for the workers' path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(csbot.__file__)))
+
+
+def _utf8(value):
+    """Recursively encode the unicode strings in *value* as UTF-8."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, (list, tuple)):
+        return [_utf8(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((_utf8(k), _utf8(v)) for k, v in value.iteritems())
+    return value
+
+
+def _latin1(value):
+    """Recursively turn the unicode strings from :func:`json.loads` back into
+    the byte strings they were made from.
+    """
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    elif isinstance(value, list):
+        return [_latin1(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((_latin1(k), _latin1(v)) for k, v in value.iteritems())
+    return value
+
+
+def encode_reply(message):
+    """Encode a message from a worker as JSON.
+
+    Byte strings, which needn't be valid UTF-8, are decoded as Latin-1 so
+    that :func:`decode_reply` gets back exactly the same bytes.
+
+    >>> decode_reply(encode_reply(['call', 'msg', ('#cs-york', u'caf\\xe9')]))
+    ['call', 'msg', ['#cs-york', 'caf\\xc3\\xa9']]
+    """
+    return json.dumps(_utf8(message), encoding='latin-1',
+                      separators=(',', ':'))
+
+
+def decode_reply(data):
+    """Decode a message from a worker, see :func:`encode_reply`."""
+    return _latin1(json.loads(data))
+
+
+class MessageReceiver(basic.Int32StringReceiver):
+    """Splits a stream into length-prefixed messages, passing each to
+    *handler*.
+    """
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def stringReceived(self, data):
+        self.handler(data)
+
+
+# In the bot
+
+
+class RemotePlugin(core.Plugin):
+    """Stands in for a plugin that runs in a :class:`Worker`.
+
+    Subclasses are created by :meth:`WorkerPool.remote_class`, with the name,
+    commands and hooks of the real plugin class, whose handlers forward
+    events to the worker.
+    """
+    #: The :class:`Worker` the plugin runs in
+    worker = None
+
+    def setup(self):
+        # Reloads the plugin if the worker already has it
+        self.worker.load(self.plugin_name())
+
+    def teardown(self):
+        # If this plugin has been reloaded, its replacement has already taken
+        # over in the worker
+        if self.bot.plugins.get(self.plugin_name()) is self:
+            self.worker.unload(self.plugin_name())
+
+    def forward_event(self, event):
+        self.worker.send_event('event', event)
+
+
+def _command_forwarder():
+    # Every command needs its own function, because PluginFeatures.command()
+    # sets the help text on it
+    def forward_command(self, event):
+        self.worker.send_event('command', event)
+    return forward_command
+
+
+class Worker(protocol.ProcessProtocol):
+    """A worker process in a :class:`WorkerPool`, and the plugins loaded into
+    it.
+
+    The process is started when the first plugin is loaded.  If it exits it
+    is started again after :attr:`RESTART_DELAY` seconds, doubling each time
+    it exits again soon after starting, up to :attr:`MAX_RESTART_DELAY`.
+    Events for a worker that isn't running are dropped.
+    """
+    RESTART_DELAY = 1
+    MAX_RESTART_DELAY = 60
+    #: Seconds to wait for the process to exit when stopping before killing
+    #: it
+    STOP_TIMEOUT = 5
+
+    def __init__(self, pool, number):
+        self.pool = pool
+        self.number = number
+        # Names of the plugins loaded into the worker
+        self.plugins = set()
+        self.receiver = None
+        self.started = None
+        self.restart_delay = self.RESTART_DELAY
+        self.restart_call = None
+        # Fires when the process exits after stop()
+        self.stopped = None
+
+        self.events_sent = 0
+        self.events_dropped = 0
+        self.restarts = 0
+
+    def __repr__(self):
+        return '<Worker {}>'.format(self.number)
+
+    @property
+    def running(self):
+        return self.transport is not None
+
+    def start(self):
+        self.restart_call = None
+        self.pool.spawn(self)
+        self.started = self.pool.clock.seconds()
+        bot = self.pool.bot
+        config = StringIO()
+        bot.config.write(config)
+        self.send(('init', bot.configpath, config.getvalue()))
+        for name in self.plugins:
+            self.send_load(name)
+
+    def connectionMade(self):
+        # A fresh receiver, so nothing left over from a crashed process
+        # gets mixed up with the new one's messages
+        self.receiver = MessageReceiver(self.messageReceived)
+        self.receiver.makeConnection(self.transport)
+
+    def processEnded(self, reason):
+        self.transport = None
+        if self.stopped is not None:
+            d, self.stopped = self.stopped, None
+            d.callback(self)
+            return
+        if self.pool.stopping:
+            return
+
+        if self.pool.clock.seconds() - self.started > self.MAX_RESTART_DELAY:
+            self.restart_delay = self.RESTART_DELAY
+        log.msg('{!r} exited ({}), restarting in {}s'.format(
+            self, reason.value, self.restart_delay))
+        self.restart_call = self.pool.clock.callLater(self.restart_delay,
+                                                      self.start)
+        self.restart_delay = min(self.restart_delay * 2,
+                                 self.MAX_RESTART_DELAY)
+        self.restarts += 1
+
+    def stop(self):
+        """Ask the process to unload its plugins and exit, returning a
+        :class:`~twisted.internet.defer.Deferred` that fires when it has.
+        """
+        if self.restart_call is not None and self.restart_call.active():
+            self.restart_call.cancel()
+        self.restart_call = None
+        if not self.running:
+            return defer.succeed(self)
+
+        self.stopped = defer.Deferred()
+        # The worker exits when its stdin is closed
+        self.transport.closeStdin()
+        kill = self.pool.clock.callLater(self.STOP_TIMEOUT, self.kill)
+
+        def cancel_kill(result):
+            if kill.active():
+                kill.cancel()
+            return result
+        return self.stopped.addBoth(cancel_kill)
+
+    def kill(self):
+        if self.running:
+            log.msg('{!r} did not exit, killing it'.format(self))
+            self.transport.signalProcess('KILL')
+
+    def send(self, message):
+        self.receiver.sendString(pickle.dumps(message, 2))
+
+    def send_load(self, name):
+        keyval = self.pool.bot.keyval
+        values = dict((key, keyval.get(name, key))
+                      for key in keyval.keys(name))
+        self.send(('load', name, values))
+
+    def send_event(self, kind, event):
+        """Send *event* to the worker, to be fired as an event if *kind* is
+        ``'event'`` or dispatched as a command if it is ``'command'``.
+        """
+        if not self.running:
+            self.events_dropped += 1
+            return
+        self.send((kind, event.event_type, event.attributes,
+                   tuple(getattr(event, a) for a in event.attributes),
+                   event.timestamp, event.network, event.protocol.nickname))
+        self.events_sent += 1
+
+    def load(self, name):
+        self.plugins.add(name)
+        if self.running:
+            self.send_load(name)
+        elif self.restart_call is None:
+            # Loads every plugin, including this one
+            self.start()
+
+    def unload(self, name):
+        self.plugins.discard(name)
+        if self.running:
+            self.send(('unload', name))
+
+    def reload_config(self, config_text):
+        if self.running:
+            self.send(('reload', config_text))
+
+    def outReceived(self, data):
+        self.receiver.dataReceived(data)
+
+    def messageReceived(self, data):
+        try:
+            message = decode_reply(data)
+            if message[0] == 'call':
+                self.pool.call(*message[1:])
+            elif message[0] == 'set':
+                section, key, value = message[1:]
+                if section not in self.plugins:
+                    raise ValueError('{} is not loaded in {!r}'.format(
+                        section, self))
+                self.pool.bot.keyval.set(section, key, value)
+            else:
+                raise ValueError('unknown message: {!r}'.format(message[0]))
+        except Exception:
+            log.err(None, 'Bad message from {!r}'.format(self))
+
+
+class WorkerPool(object):
+    """Runs plugins for *bot* in *size* worker processes.
+
+    Plugins are spread over the workers in the order they are first loaded,
+    and each stays in the same worker for as long as the bot runs.  *clock*
+    provides ``seconds()`` and ``callLater()``, and is normally the reactor.
+    """
+    def __init__(self, bot, size, clock=reactor):
+        self.bot = bot
+        self.clock = clock
+        self.workers = [Worker(self, i) for i in xrange(size)]
+        # Plugin name -> Worker
+        self.assigned = dict()
+        self.stopping = False
+
+    def worker_for(self, name):
+        """Get the :class:`Worker` that the plugin *name* runs in."""
+        if name not in self.assigned:
+            self.assigned[name] = self.workers[len(self.assigned) %
+                                               len(self.workers)]
+        return self.assigned[name]
+
+    def remote_class(self, P):
+        """Create a :class:`RemotePlugin` class standing in for plugin class
+        *P*, with the same name, commands and hooks.
+        """
+        features = core.PluginFeatures()
+        for command, f in P.features.commands.iteritems():
+            features.command(command, getattr(f, 'help', None))(
+                _command_forwarder())
+        for hook in P.features.hooks:
+            # With only one handler its filter can be applied here, and the
+            # worker doesn't need to be sent events it will ignore
+            hook_filters = [f for h, f in P.features.hook_filters(hook)]
+            arguments = {}
+            if len(hook_filters) == 1 and hook_filters[0] is not None:
+                arguments = hook_filters[0].arguments
+            features.hook(hook, **arguments)(
+                RemotePlugin.forward_event.im_func)
+        return type(P.__name__, (RemotePlugin,), {
+            '__module__': P.__module__,
+            '__doc__': P.__doc__,
+            'features': features,
+            'worker': self.worker_for(P.plugin_name()),
+        })
+
+    def spawn(self, worker):
+        """Start the process for *worker*."""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [ROOT] + filter(None, [env.get('PYTHONPATH')]))
+        # The worker's output goes to the bot's stderr
+        reactor.spawnProcess(worker, sys.executable,
+                             [sys.executable, '-m', 'csbot.workers'],
+                             env=env, childFDs={0: 'w', 1: 'r', 2: 2})
+
+    def call(self, network, method, args, kwargs):
+        """Call :class:`.BotProtocol` *method* on the protocol connected to
+        *network*, on behalf of a worker.
+        """
+        if method not in PROTOCOL_METHODS:
+            raise ValueError('{} is not an allowed method'.format(method))
+        for p in self.bot.protocols:
+            if p.network.name == network:
+                getattr(p, method)(*args, **kwargs)
+                return
+        log.msg('Not connected to {}, dropped {} from a worker'.format(
+            network, method))
+
+    def reload_config(self):
+        config = StringIO()
+        self.bot.config.write(config)
+        for worker in self.workers:
+            worker.reload_config(config.getvalue())
+
+    def stop(self):
+        """Stop every worker, returning a
+        :class:`~twisted.internet.defer.Deferred` that fires when they have
+        all exited.
+        """
+        self.stopping = True
+        return defer.DeferredList([w.stop() for w in self.workers])
+
+    def stats(self):
+        """Get a list of dictionaries describing each worker: its
+        ``plugins``, whether it's ``running``, and counts of
+        ``events_sent``, ``events_dropped`` and ``restarts``.
+        """
+        return [{'plugins': sorted(w.plugins),
+                 'running': w.running,
+                 'events_sent': w.events_sent,
+                 'events_dropped': w.events_dropped,
+                 'restarts': w.restarts}
+                for w in self.workers]
+
+
+# In a worker process
+
+
+class RemoteKeyVal(object):
+    """The plugin key/value store as seen from a worker.
+
+    Values are read from a copy of each plugin's section sent with the plugin,
+    and changes are sent to the bot.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.sections = dict()
+
+    def get(self, section, key):
+        return self.sections[section][key]
+
+    def set(self, section, key, value):
+        # Encode first, so the plugin finds out if the value can't be sent
+        self.channel.send(['set', section, key, value])
+        self.sections.setdefault(section, dict())[key] = value
+
+    def keys(self, section):
+        return self.sections.get(section, dict()).keys()
+
+    def start(self, interval):
+        pass
+
+    def close(self):
+        pass
+
+
+class WorkerProtocol(object):
+    """Stands in for the :class:`.BotProtocol` connected to *network* in a
+    worker process.
+
+    The methods in :data:`PROTOCOL_METHODS` are sent to the bot to run, and
+    like the real protocol it has a :attr:`command_matcher`, so that plugins
+    can tell commands apart from other messages.
+    """
+    def __init__(self, channel, network):
+        self.channel = channel
+        self.network = network
+        self.nickname = network.config['nickname']
+        self.build_command_matcher()
+
+    def build_command_matcher(self):
+        """See :meth:`.BotProtocol.build_command_matcher`."""
+        settings = self.network.config
+        self.command_matcher = events.CommandMatcher(
+                settings['command_prefix'],
+                [self.nickname] + settings['nick_aliases'])
+
+    def __getattr__(self, name):
+        if name not in PROTOCOL_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.channel.send(['call', self.network.name, name, args,
+                               kwargs])
+        return call
+
+
+class WorkerBot(core.Bot):
+    """The :class:`.Bot` in a worker process.
+
+    Its configuration comes from the bot rather than the file, every plugin
+    is loaded in-process, and it doesn't respond to events itself: the bot
+    has already joined channels and found commands.
+    """
+    signedOn = None
+    privmsg = None
+    command = None
+
+    def __init__(self, channel, configpath, config_text):
+        self.channel = channel
+        self.config_text = config_text
+        core.Bot.__init__(self, configpath)
+        self.keyval_ = RemoteKeyVal(channel)
+        # Network name -> WorkerProtocol
+        self.remote_protocols = dict()
+
+    def read_config(self):
+        self.config.readfp(StringIO(self.config_text))
+
+    def make_command_limiter(self):
+        # Commands have already been through the bot's limits
+        return None
+
+    def reload_config(self, config_text):
+        self.config_text = config_text
+        core.Bot.reload_config(self)
+        for p in self.remote_protocols.itervalues():
+            p.build_command_matcher()
+
+    @property
+    def keyval(self):
+        return self.keyval_
+
+    def is_worker_plugin(self, name):
+        return False
+
+    def protocol_for(self, network, nickname):
+        p = self.remote_protocols.get(network)
+        if p is None:
+            n = self.networks.get(network) or core.Network(self, network)
+            p = self.remote_protocols[network] = WorkerProtocol(self.channel,
+                                                                n)
+        if p.nickname != nickname:
+            p.nickname = nickname
+            p.build_command_matcher()
+        return p
+
+
+class WorkerChannel(basic.Int32StringReceiver):
+    """The worker process's end of the connection to the bot, over stdin and
+    stdout.
+    """
+    implements(IHalfCloseableProtocol)
+
+    MAX_LENGTH = MessageReceiver.MAX_LENGTH
+
+    def __init__(self):
+        self.bot = None
+
+    def send(self, message):
+        self.sendString(encode_reply(message))
+
+    def stringReceived(self, data):
+        message = pickle.loads(data)
+        try:
+            getattr(self, 'do_' + message[0])(*message[1:])
+        except Exception:
+            log.err(None, 'Error handling {} message'.format(message[0]))
+
+    def do_init(self, configpath, config_text):
+        self.bot = WorkerBot(self, configpath, config_text)
+
+    def do_load(self, name, values):
+        self.bot.keyval.sections[name] = values
+        if self.bot.has_plugin(name):
+            self.bot.reload_plugin(name)
+        else:
+            self.bot.load_plugin(name)
+
+    def do_unload(self, name):
+        self.bot.unload_plugin(name)
+        self.bot.keyval.sections.pop(name, None)
+
+    def do_reload(self, config_text):
+        self.bot.reload_config(config_text)
+
+    def make_event(self, event_type, attributes, values, timestamp, network,
+                   nickname):
+        if event_type == 'command':
+            cls = events.CommandEvent
+        else:
+            cls = events.event_class(event_type, attributes)
+        event = cls(self.bot, self.bot.protocol_for(network, nickname),
+                    *values)
+        event.timestamp = timestamp
+        return event
+
+    def do_event(self, *args):
+        self.bot.post_event(self.make_event(*args))
+
+    def do_command(self, *args):
+        self.bot.fire_command(self.make_event(*args))
+
+    def readConnectionLost(self):
+        # The bot closed our stdin, so tear down, letting the plugins save
+        # their data, then exit once everything has been written
+        if self.bot is not None:
+            self.bot.teardown(save_config=False)
+        self.transport.loseConnection()
+
+    def writeConnectionLost(self):
+        pass
+
+    def connectionLost(self, reason):
+        if reactor.running:
+            reactor.stop()
+
+
+def main():
+    log.startLogging(sys.stderr)
+    # Ctrl-C is for the bot, which will stop us when it exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stdio.StandardIO(WorkerChannel())
+    reactor.run(installSignalHandlers=False)
+
+
+if __name__ == '__main__':
+    main()
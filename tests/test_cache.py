@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task, defer
+
+from csbot.core import Bot, Plugin, PluginFeatures
+from csbot.cache import CachePolicy
+from csbot.events import CommandEvent
+from csbot.plugins.example import Example
+
+
+class Network(object):
+    name = 'default'
+
+
+class Protocol(object):
+    nickname = 'csyorkbot'
+    network = Network()
+
+    def __init__(self):
+        self.sent = []
+
+    def msg(self, target, message, priority=None):
+        self.sent.append((target, message))
+
+
+class Cached(Plugin):
+    features = PluginFeatures()
+
+    def setup(self):
+        self.calls = 0
+        self.pending = None
+
+    @features.command('answer', cache=CachePolicy(ttl=10))
+    def answer(self, event):
+        self.calls += 1
+        event.reply('{} is {}'.format(event.raw_data, self.calls))
+        event.reply('verbose', is_verbose=True)
+
+    @features.command('where', cache=CachePolicy(ttl=10, per_channel=True))
+    def where(self, event):
+        self.calls += 1
+        event.reply(event.channel)
+
+    @features.command('slow', cache=CachePolicy(ttl=10))
+    def slow(self, event):
+        self.calls += 1
+        self.pending = defer.Deferred()
+        self.pending.addCallback(event.reply)
+        return self.pending
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.discover_plugins = lambda: {'cached': Cached,
+                                             'example': Example}
+        self.bot.response_cache.clock = self.clock = task.Clock()
+        self.bot.load_plugin('cached')
+        self.plugin = self.bot.plugins['cached']
+        self.protocol = Protocol()
+
+    def command(self, command, raw_data, user='alan', channel='#cs-york'):
+        del self.protocol.sent[:]
+        self.bot.fire_command(CommandEvent(
+            self.bot, self.protocol, command, user + '!~user@host', channel,
+            False, raw_data))
+        return self.protocol.sent
+
+    def test_replay(self):
+        self.assertEqual(self.command('answer', 'x'),
+                         [('#cs-york', 'alan: x is 1')])
+        # Replayed to whoever asked, without calling the handler
+        self.assertEqual(self.command('answer', ' x ', user='bob',
+                                      channel='#other'),
+                         [('#other', 'bob: x is 1')])
+        self.assertEqual(self.command('answer', 'y'),
+                         [('#cs-york', 'alan: y is 2')])
+        # Verbose replies are still only sent when addressed directly
+        self.assertEqual(self.command('answer', 'x', channel='csyorkbot'),
+                         [('alan', 'x is 1'), ('alan', 'verbose')])
+        stats = self.bot.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (2, 2, 2))
+
+    def test_ttl(self):
+        self.command('answer', 'x')
+        self.clock.advance(10)
+        self.assertEqual(self.command('answer', 'x'),
+                         [('#cs-york', 'alan: x is 2')])
+        self.assertEqual(self.bot.response_cache.stats()['expired'], 1)
+
+    def test_per_channel(self):
+        self.command('where', '')
+        self.assertEqual(self.command('where', '', channel='#other'),
+                         [('#other', 'alan: #other')])
+        self.assertEqual(self.plugin.calls, 2)
+
+    def test_invalidate(self):
+        self.command('answer', 'x')
+        self.command('answer', 'y')
+        self.plugin.invalidate_cache('answer', 'x')
+        self.command('answer', 'x')
+        self.command('answer', 'y')
+        self.assertEqual(self.plugin.calls, 3)
+        self.plugin.invalidate_cache('answer')
+        self.command('answer', 'y')
+        self.assertEqual(self.plugin.calls, 4)
+
+    def test_set_invalidates_get(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.bot.config.set('DEFAULT', 'keyvalstore',
+                            os.path.join(tmp, 'keyval.db'))
+        self.bot.load_plugin('example')
+        self.command('set', 'foo 1')
+        self.assertEqual(self.command('get', 'FOO'),
+                         [('#cs-york', 'alan: FOO is 1.')])
+        self.command('get', 'foo extra')
+        self.command('set', 'foo 2')
+        self.assertEqual(self.command('get', 'FOO'),
+                         [('#cs-york', 'alan: FOO is 2.')])
+        self.assertEqual(self.command('get', 'foo extra'),
+                         [('#cs-york', 'alan: foo is 2.')])
+
+    def test_deferred(self):
+        self.command('slow', '')
+        # Not cached until the replies are complete
+        self.command('slow', '')
+        self.assertEqual(self.plugin.calls, 2)
+        self.plugin.pending.callback('done')
+        self.assertEqual(self.command('slow', ''),
+                         [('#cs-york', 'alan: done')])
+
+    def test_deferred_invalidated(self):
+        self.command('slow', '')
+        pending = self.plugin.pending
+        self.plugin.invalidate_cache('slow')
+        pending.callback('stale')
+        self.command('slow', '')
+        self.assertEqual(self.plugin.calls, 2)
+
+    def test_unload(self):
+        self.command('answer', 'x')
+        self.bot.unload_plugin('cached')
+        self.assertEqual(self.bot.response_cache.stats()['entries'], 0)
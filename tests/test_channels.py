@@ -0,0 +1,113 @@
+import unittest
+
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol
+from csbot.channels import ChannelState
+
+
+class TestChannelState(unittest.TestCase):
+    def setUp(self):
+        self.state = ChannelState()
+        self.state.joined('#cs-york', 'csyorkbot')
+        self.state.joined('#compsoc', 'csyorkbot')
+        self.state.set_names('#cs-york', [('csyorkbot', ''), ('Alan', 'o'),
+                                          ('bob', 'v')])
+        self.state.set_names('#compsoc', [('csyorkbot', ''), ('Alan', '')])
+
+    def test_lookup(self):
+        self.assertTrue('ALAN' in self.state['#CS-YORK'])
+        self.assertEqual(sorted(self.state['#cs-york']),
+                         ['Alan', 'bob', 'csyorkbot'])
+        self.assertTrue(self.state['#cs-york'].has_mode('Alan', 'o'))
+        self.assertFalse(self.state['#compsoc'].has_mode('Alan', 'o'))
+        self.assertEqual(sorted(self.state.channels_of('alan')),
+                         ['#compsoc', '#cs-york'])
+        self.assertEqual(self.state.channels_of('nobody'), ())
+
+    def test_quit_rename(self):
+        self.assertEqual(sorted(self.state.rename('Alan', 'Alan[m]')),
+                         ['#compsoc', '#cs-york'])
+        self.assertTrue('alan{m}' in self.state['#cs-york'])
+        self.assertEqual(self.state['#cs-york'].modes('alan[m]'), 'o')
+        self.assertEqual(sorted(self.state.quit('Alan[m]')),
+                         ['#compsoc', '#cs-york'])
+        self.assertFalse('Alan[m]' in self.state['#cs-york'])
+        self.assertFalse('alan{m}' in self.state.nicks)
+
+    def test_names_replace(self):
+        self.state.set_names('#cs-york', [('csyorkbot', ''), ('carol', '')])
+        self.assertEqual(self.state.channels_of('bob'), ())
+        self.assertFalse('bob' in self.state.nicks)
+        # Still in the other channel
+        self.assertEqual(self.state.channels_of('alan'), ('#compsoc',))
+
+    def test_left(self):
+        self.state.left('#cs-york')
+        self.assertFalse('#cs-york' in self.state)
+        self.assertEqual(sorted(self.state.nicks), ['alan', 'csyorkbot'])
+        self.state.left('#compsoc')
+        self.assertEqual((self.state.nicks, self.state.nick_channels),
+                         ({}, {}))
+
+    def test_interned(self):
+        self.state.add('ALAN', '#cs-york')
+        keys = [k for c in self.state for k in c.members if k == 'alan']
+        self.assertTrue(all(k is keys[0] for k in keys))
+        self.assertTrue(keys[0] is intern('alan'))
+
+    def test_modes(self):
+        self.state.set_mode('bob', '#cs-york', 'o', True)
+        self.assertEqual(self.state['#cs-york'].modes('bob'), 'ov')
+        self.state.set_mode('bob', '#cs-york', 'v', False)
+        self.assertTrue(self.state['#cs-york'].modes('bob')
+                        is self.state['#cs-york'].modes('alan'))
+
+
+class TestBotProtocolChannels(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+        self.events = []
+        for event_type in ('userQuit', 'userRenamed'):
+            self.bot.hooks[event_type] = [self.events.append]
+        self.lines([
+            ':csyorkbot!~bot@host JOIN #cs-york',
+            ':server 353 csyorkbot = #cs-york :csyorkbot @+Alan bob',
+            ':server 366 csyorkbot #cs-york :End of /NAMES list.',
+        ])
+        self.channels = self.protocol.channels
+
+    def lines(self, lines):
+        for line in lines:
+            self.protocol.lineReceived(line)
+
+    def test_names(self):
+        self.assertEqual(sorted(self.channels['#cs-york']),
+                         ['Alan', 'bob', 'csyorkbot'])
+        self.assertEqual(self.channels['#cs-york'].modes('alan'), 'ov')
+
+    def test_membership(self):
+        self.lines([
+            ':carol!~c@host JOIN #cs-york',
+            ':bob!~b@host PART #cs-york',
+            ':Alan!~a@host MODE #cs-york -o+v carol carol',
+            ':Alan!~a@host KICK #cs-york csyorkbot_ :bye',
+        ])
+        self.assertEqual(sorted(self.channels['#cs-york']),
+                         ['Alan', 'carol', 'csyorkbot'])
+        self.assertEqual(self.channels['#cs-york'].modes('carol'), 'v')
+
+    def test_events_carry_channels(self):
+        self.lines([':Alan!~a@host NICK :Alan_',
+                    ':Alan_!~a@host QUIT :gone'])
+        self.assertEqual([(e.event_type, e.channels) for e in self.events],
+                         [('userRenamed', ('#cs-york',)),
+                          ('userQuit', ('#cs-york',))])
+        self.assertFalse('Alan_' in self.channels['#cs-york'])
+
+    def test_cleanup(self):
+        self.lines([':Alan!~a@host KICK #cs-york csyorkbot :bye'])
+        self.assertFalse('#cs-york' in self.channels)
+        self.assertEqual(self.channels.nicks, {})
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from csbot.core import Bot, BotProtocol, Plugin
+from csbot.config import boolean
+
+
+class Configured(Plugin):
+    CONFIG_DEFAULTS = {'limit': '10', 'nickname': 'configured'}
+    CONFIG_TYPES = {'limit': int, 'enabled': boolean}
+
+
+CONFIG = """
+[DEFAULT]
+command_prefix = !
+enabled = no
+
+[configured]
+limit = {limit}
+"""
+
+
+class TestConfigView(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'csbot.cfg')
+        self.write(limit=5)
+        self.bot = Bot(self.path)
+        self.bot.discover_plugins = lambda: {'configured': Configured}
+        self.bot.load_plugin('configured')
+        self.plugin = self.bot.plugins['configured']
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, limit, prefix='!'):
+        with open(self.path, 'w') as f:
+            f.write(CONFIG.format(limit=limit).replace('= !', '= ' + prefix))
+
+    def test_precedence_and_types(self):
+        # Plugin section
+        self.assertEquals(self.plugin.cfg('limit'), 5)
+        # Plugin defaults override DEFAULT
+        self.assertEquals(self.plugin.cfg('nickname'), 'configured')
+        # DEFAULT, converted
+        self.assertEquals(self.plugin.cfg('enabled'), False)
+        self.assertEquals(self.plugin.cfg('irc_port'), '6667')
+        self.assertRaises(KeyError, self.plugin.cfg, 'nonexistent')
+
+    def test_read_only(self):
+        def assign():
+            self.plugin.config['limit'] = 3
+        self.assertRaises(TypeError, assign)
+
+    def test_reload(self):
+        protocol = BotProtocol(self.bot)
+        self.bot.protocols.add(protocol)
+        view = self.plugin.config
+        self.write(limit=7, prefix='?')
+        self.assertTrue(self.plugin.config is view)
+        self.bot.reload_config()
+        self.assertEquals(self.plugin.cfg('limit'), 7)
+        self.assertEquals(protocol.command_matcher.match('?help'),
+                          ('help', '', False))
+        self.assertEquals(protocol.command_matcher.match('!help'), None)
+
+    def test_bad_type(self):
+        self.write(limit='lots')
+        self.bot.reload_config()
+        self.assertRaises(ValueError, self.plugin.cfg, 'limit')
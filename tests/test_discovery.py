@@ -0,0 +1,127 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from csbot.core import Bot, PluginError
+
+
+PLUGIN_SOURCE = """
+from csbot.core import Plugin
+
+class {name}(Plugin):
+    VERSION = {version}
+"""
+
+
+class TestPluginDiscovery(unittest.TestCase):
+    PACKAGE = 'csbot_test_plugins'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.package_dir = os.path.join(self.dir, self.PACKAGE)
+        os.mkdir(self.package_dir)
+        open(os.path.join(self.package_dir, '__init__.py'), 'w').close()
+        sys.path.insert(0, self.dir)
+
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.plugin_cache.package = self.PACKAGE
+        self.scanned = []
+        scan = self.bot.plugin_cache.scan
+        self.bot.plugin_cache.scan = lambda name, stale: \
+            self.scanned.append(name) or scan(name, stale)
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for name in sys.modules.keys():
+            if name.split('.')[0] == self.PACKAGE:
+                del sys.modules[name]
+        shutil.rmtree(self.dir)
+
+    def write(self, module, source, mtime=None):
+        path = os.path.join(self.package_dir, module + '.py')
+        with open(path, 'w') as f:
+            f.write(source)
+        # Make sure the change is noticed even within the same second, and
+        # that Python doesn't use a stale .pyc
+        if os.path.exists(path + 'c'):
+            os.remove(path + 'c')
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_caching(self):
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1), 1000)
+        self.write('two', PLUGIN_SOURCE.format(name='Two', version=1), 1000)
+        self.assertEquals(sorted(self.bot.discover_plugins()), ['one', 'two'])
+        self.assertEquals(sorted(self.scanned), [self.PACKAGE + '.one',
+                                                 self.PACKAGE + '.two'])
+
+        # Nothing changed, nothing rescanned
+        del self.scanned[:]
+        self.bot.discover_plugins()
+        self.assertEquals(self.scanned, [])
+
+        # Only new modules are scanned: changed ones aren't reloaded behind
+        # the back of plugins that might be running from them
+        self.write('two', PLUGIN_SOURCE.format(name='Two', version=2), 2000)
+        self.write('three', PLUGIN_SOURCE.format(name='Three', version=1))
+        available = self.bot.discover_plugins()
+        self.assertEquals(self.scanned, [self.PACKAGE + '.three'])
+        self.assertEquals(available['two'].VERSION, 1)
+
+        # Changes are picked up by reloading the module
+        self.bot.plugin_cache.reload(self.PACKAGE + '.two')
+        del self.scanned[:]
+        available = self.bot.discover_plugins()
+        self.assertEquals(self.scanned, [])
+        self.assertEquals(available['two'].VERSION, 2)
+
+        # Deleted modules are forgotten
+        os.remove(os.path.join(self.package_dir, 'one.py'))
+        self.assertEquals(sorted(self.bot.discover_plugins()),
+                          ['three', 'two'])
+
+    def test_invalidate(self):
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1))
+        self.bot.discover_plugins()
+        del self.scanned[:]
+        self.bot.plugin_cache.invalidate(self.PACKAGE + '.one')
+        self.bot.discover_plugins()
+        self.assertEquals(self.scanned, [self.PACKAGE + '.one'])
+
+    def test_broken_module_fixed(self):
+        self.write('one', 'this is not python\n', 1000)
+        self.assertEquals(self.bot.discover_plugins().keys(), [])
+        # A module that failed to import is tried again once it changes
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1), 2000)
+        self.assertEquals(self.bot.discover_plugins().keys(), ['one'])
+
+    def test_duplicates(self):
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1))
+        # The same class imported elsewhere is not a duplicate...
+        self.write('reexport', 'from {}.one import One\n'.format(self.PACKAGE))
+        self.assertEquals(sorted(self.bot.discover_plugins()), ['one'])
+        # ... but a different class with the same name is
+        self.write('other', PLUGIN_SOURCE.format(name='One', version=2))
+        self.assertRaises(PluginError, self.bot.discover_plugins)
+
+    def test_broken_module(self):
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1))
+        self.write('broken', 'this is not python\n')
+        self.assertEquals(self.bot.discover_plugins().keys(), ['one'])
+
+    def test_load_plugins(self):
+        self.write('one', PLUGIN_SOURCE.format(name='One', version=1))
+        self.write('two', PLUGIN_SOURCE.format(name='Two', version=1))
+        self.bot.load_plugins(['one', 'two'])
+        self.assertEquals(sorted(self.bot.plugins), ['one', 'two'])
+        self.assertEquals(len(self.scanned), 2)
+        self.assertRaises(PluginError, self.bot.load_plugins, ['three'])
+
+
+class TestBuiltinPlugins(unittest.TestCase):
+    def test_discover(self):
+        available = Bot('nonexistent.cfg').discover_plugins()
+        for name in ('example', 'pluginmanager', 'tell', 'users'):
+            self.assertTrue(name in available)
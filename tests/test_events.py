@@ -0,0 +1,85 @@
+import unittest
+
+from csbot.core import Bot
+from csbot.events import event_class, CommandEvent, CommandMatcher
+
+
+class Protocol(object):
+    nickname = 'csyorkbot'
+    command_matcher = CommandMatcher(['!'], [nickname])
+
+
+class TestCommandEvent(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.protocol = Protocol()
+        self.Privmsg = event_class('privmsg', ('user', 'channel', 'message'))
+
+    def create(self, message, channel='#cs-york'):
+        event = self.Privmsg(self.bot, self.protocol, 'nick!~user@host',
+                             channel, message)
+        command = CommandEvent.create(event)
+        if command is not None:
+            self.assertEquals(command.timestamp, event.timestamp)
+            return (command.command, command.raw_data, command.direct)
+
+    def test_not_command(self):
+        for message in ('hello', '', '!', '!   ', 'csyorkbot', 'csyorkbot,',
+                        'csyorkbot is great', 'csyorkbotx: test',
+                        'the !test command'):
+            self.assertEquals(self.create(message), None, message)
+
+    def test_prefix(self):
+        self.assertEquals(self.create('!test'), ('test', '', False))
+        self.assertEquals(self.create('!test  a "b c" '),
+                          ('test', 'a "b c" ', False))
+        self.assertEquals(self.create('! test a'), ('test', 'a', False))
+
+    def test_nick(self):
+        self.assertEquals(self.create('csyorkbot: test a b'),
+                          ('test', 'a b', True))
+        self.assertEquals(self.create('csyorkbot ,:test'),
+                          ('test', '', True))
+        self.assertEquals(self.create('csyorkbot. !test'),
+                          ('!test', '', True))
+
+    def test_private(self):
+        self.assertEquals(self.create('test a b', channel='csyorkbot'),
+                          ('test', 'a b', True))
+        self.assertEquals(self.create('  ', channel='csyorkbot'), None)
+
+
+class TestCommandMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = CommandMatcher(['!', '!!', '~'],
+                                      ['csyorkbot', 'csbot'])
+
+    def test_prefixes(self):
+        self.assertEquals(self.matcher.match('~test a'), ('test', 'a', False))
+        self.assertEquals(self.matcher.match('!!test'), ('test', '', False))
+        self.assertEquals(self.matcher.match('!test'), ('test', '', False))
+
+    def test_aliases(self):
+        self.assertEquals(self.matcher.match('csbot: test'),
+                          ('test', '', True))
+        self.assertEquals(self.matcher.match('csyorkbot: test'),
+                          ('test', '', True))
+        self.assertEquals(self.matcher.match('csbots: test'), None)
+
+    def test_no_triggers(self):
+        matcher = CommandMatcher([], [])
+        self.assertEquals(matcher.match('!test'), None)
+        self.assertEquals(matcher.match('test', private=True),
+                          ('test', '', True))
+
+
+class TestEventClass(unittest.TestCase):
+    def test_slots(self):
+        Joined = event_class('joined', ('channel',))
+        e = Joined(None, None, '#cs-york')
+        self.assertFalse(hasattr(e, '__dict__'))
+        self.assertEquals(e.event_type, 'joined')
+        self.assertEquals(e.datetime, e.datetime)
+
+    def test_reserved(self):
+        self.assertRaises(ValueError, event_class, 'foo', ('datetime',))
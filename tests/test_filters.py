@@ -0,0 +1,150 @@
+import re
+import unittest
+
+from csbot.core import Bot, Plugin, PluginFeatures
+from csbot.events import event_class
+from csbot.filters import Filter, RegexSet, HookMatcher
+
+
+Privmsg = event_class('privmsg', ('user', 'channel', 'message'))
+UserJoined = event_class('userJoined', ('user', 'channel'))
+
+
+def privmsg(message, channel='#cs-york', user='alan!~alan@example.com'):
+    return Privmsg(None, None, user, channel, message)
+
+
+class Filtered(Plugin):
+    features = PluginFeatures()
+
+    def setup(self):
+        self.seen = []
+
+    @features.hook('privmsg', channel='#cs-york')
+    def york(self, event):
+        self.seen.append(('york', event.message))
+
+    @features.hook('privmsg', message=r'https?://')
+    def link(self, event):
+        self.seen.append(('link', event.message))
+
+    @features.hook('privmsg', user='*!*@*.york.ac.uk', message='^hi')
+    def hi(self, event):
+        self.seen.append(('hi', event.message))
+
+    @features.hook('privmsg')
+    def everything(self, event):
+        self.seen.append(('everything', event.message))
+
+
+class TestFilter(unittest.TestCase):
+    def test_channels(self):
+        f = Filter(channel=['#cs-york', '#Compsoc'])
+        self.assertTrue(f.matches(privmsg('x', channel='#compsoc')))
+        self.assertFalse(f.matches(privmsg('x', channel='#other')))
+        # No channel attribute
+        self.assertFalse(f.matches(UserJoined(None, None, 'alan', None)))
+
+    def test_user(self):
+        f = Filter(user=['alan', 'bob*'])
+        self.assertTrue(f.matches(privmsg('x', user='Alan!~a@host')))
+        self.assertTrue(f.matches(privmsg('x', user='bobby!~b@host')))
+        self.assertFalse(f.matches(privmsg('x', user='alanb!~a@host')))
+        self.assertFalse(f.matches(privmsg('x', user='xalan!~a@host')))
+
+    def test_message(self):
+        f = Filter(message=re.compile('HELLO', re.I))
+        self.assertTrue(f.matches(privmsg('well hello there')))
+        self.assertFalse(f.matches(privmsg('hi')))
+
+
+class TestRegexSet(unittest.TestCase):
+    def test_many(self):
+        # More groups than an alternation can hold
+        regexes = [(1 << i, '(w)(o{})rd'.format(i)) for i in xrange(200)]
+        s = RegexSet(regexes)
+        self.assertTrue(len(s.groups) > 1)
+        self.assertEqual(s.match('a wo7rd'), 1 << 7)
+        self.assertEqual(s.match('nothing'), 0)
+
+    def test_uncombinable(self):
+        s = RegexSet([(1, r'(a)\1'), (2, '(?P<x>b)(?P=x)'), (4, 'c'),
+                      (8, '(?i)D')])
+        self.assertEqual(s.match('aa bb'), 3)
+        self.assertEqual(s.match('a b c d'), 12)
+
+    def test_candidates(self):
+        s = RegexSet([(1, 'a'), (2, 'a'), (4, 'b')])
+        self.assertEqual(s.match('ab', 2 | 4), 6)
+        self.assertEqual(s.match('ab', 0), 0)
+
+    def test_anchored(self):
+        s = RegexSet([(1, 'a'), (2, 'b')], anchored=True)
+        self.assertEqual(s.match('ba'), 2)
+        # Expressions starting with ^ are only tried at the start
+        s = RegexSet([(1, '^a'), (2, '^b|c'), (4, '^(?m)d')])
+        self.assertEqual([use_match for a, m, r, use_match in s.groups],
+                         [False, False, True])
+        self.assertEqual(s.match('xca'), 2)
+        self.assertEqual(s.match('a\nd'), 5)
+
+
+class TestHookMatcher(unittest.TestCase):
+    def test_order(self):
+        entries = [(Filter(message='a'), 'first'),
+                   (Filter(channel='#cs-york'), 'second'),
+                   (Filter(message='b'), 'third')]
+        matcher = HookMatcher(entries)
+        self.assertEqual(matcher.match(privmsg('ab')),
+                         ['first', 'second', 'third'])
+        self.assertEqual(matcher.match(privmsg('b', channel='#other')),
+                         ['third'])
+
+    def test_same_as_filters(self):
+        filters = [Filter(), Filter(channel='#cs-york'),
+                   Filter(channel='#other', message='x'),
+                   Filter(user='alan', message='^x'),
+                   Filter(user=['bob', '*@*.york.ac.uk']),
+                   Filter(message=re.compile('X', re.I))]
+        matcher = HookMatcher([(f, i) for i, f in enumerate(filters)])
+        for e in (privmsg('x'), privmsg('yx', channel='#other'),
+                  privmsg('x', user='bob!~b@host', channel='#other'),
+                  privmsg('', user='a!~b@cs.york.ac.uk', channel='#other'),
+                  UserJoined(None, None, 'alan', '#cs-york')):
+            self.assertEqual(matcher.match(e),
+                             [i for i, f in enumerate(filters)
+                              if f.matches(e)])
+
+
+class TestFilteredHooks(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.discover_plugins = lambda: {'filtered': Filtered}
+        self.bot.load_plugin('filtered')
+        self.plugin = self.bot.plugins['filtered']
+        # Don't look for commands
+        self.bot.hooks['privmsg'].remove(self.bot.privmsg)
+
+    def fire(self, *args, **kwargs):
+        del self.plugin.seen[:]
+        self.bot.fire_hooks(privmsg(*args, **kwargs))
+        return [name for name, message in self.plugin.seen]
+
+    def test_dispatch(self):
+        self.assertEqual(self.fire('x', channel='#other'), ['everything'])
+        self.assertEqual(self.fire('see http://example.com'),
+                         ['everything', 'york', 'link'])
+        self.assertEqual(self.fire('hi', user='a!~a@cs.york.ac.uk',
+                                   channel='#other'),
+                         ['everything', 'hi'])
+
+    def test_index(self):
+        self.assertEqual(len(self.bot.filtered_hooks['privmsg'].entries), 3)
+        self.bot.unload_plugin('filtered')
+        self.assertFalse('privmsg' in self.bot.filtered_hooks)
+        self.assertEqual(self.bot.hooks['privmsg'], [])
+
+    def test_plugin_fire_hooks(self):
+        self.plugin.features.fire_hooks(privmsg('http://x', channel='#a'))
+        self.assertEqual(self.plugin.seen, [('link', 'http://x'),
+                                            ('everything', 'http://x')])
@@ -0,0 +1,164 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol
+from csbot.history import HistoryStore, Query, TooBroad
+
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = self.open()
+        # 95 messages, alternating between channels, with lecture notes in
+        # every 7th message
+        for i in xrange(95):
+            self.store.add(1000 + i, 'default',
+                           '#cs-york' if i % 2 else '#other',
+                           'user{}'.format(i % 5),
+                           'message {} {}'.format(
+                               i, 'about Lecture Notes' if i % 7 == 0
+                               else 'chat'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def open(self):
+        return HistoryStore(self.dir, flush_size=10, merge_factor=2,
+                            run_in_thread=defer.maybeDeferred)
+
+    def search(self, *args, **kwargs):
+        kwargs.setdefault('network', 'default')
+        max_scan = kwargs.pop('max_scan', None)
+        return [int(m.text.split()[1])
+                for m in self.store.search(Query(*args, **kwargs), max_scan)]
+
+    def test_segments(self):
+        stats = self.store.stats()
+        self.assertEqual((stats['messages'], stats['memtable'],
+                          stats['flushes']), (95, 5, 9))
+        self.assertTrue(stats['merges'] > 0)
+        # Merged down to one segment per size
+        sizes = [len(s) for s in self.store.segments]
+        self.assertEqual(sum(sizes), 90)
+        self.assertEqual(len(set(sizes)), len(sizes))
+
+    def test_search(self):
+        self.assertEqual(self.search(['lecture notes'])[:3], [91, 84, 77])
+        self.assertEqual(self.search(['notes lecture']), [])
+        self.assertEqual(self.search(['notes'], nick='USER0',
+                                     channel='#Other'), [70, 0])
+        self.assertEqual(self.search([], nick='user3', start=1050,
+                                     end=1070), [68, 63, 58, 53])
+        self.assertEqual(self.search(['nothing']), [])
+
+    def test_too_broad(self):
+        # Only the messages with the words are checked against the phrase
+        self.assertEqual(self.search(['lecture notes'], max_scan=14),
+                         [91, 84, 77, 70, 63, 56, 49, 42, 35, 28, 21, 14, 7,
+                          0])
+        self.assertRaises(TooBroad, self.search, ['notes lecture'],
+                          max_scan=13)
+        self.assertRaises(TooBroad, self.search, [], max_scan=10)
+
+    def test_reopen(self):
+        self.store.close()
+        self.store = self.open()
+        self.assertEqual(self.search(['chat'])[:2], [94, 93])
+        self.assertEqual(len(self.store), 95)
+        # Journals and merged-away segments are cleaned up
+        self.assertEqual(sorted(f.split('-')[0]
+                                for f in os.listdir(self.dir)),
+                         ['MANIFEST', 'journal'] +
+                         ['segment'] * len(self.store.segments))
+
+    def test_random(self):
+        rng = random.Random(0)
+        seen = set()
+        for _ in xrange(50):
+            m = self.store.random_match(Query(['lecture'], nick='user0'),
+                                        rng)
+            seen.add(m.text)
+        self.assertEqual(seen, set(['message {} about Lecture Notes'.format(i)
+                                    for i in (0, 35, 70)]))
+        self.assertEqual(self.store.random_match(Query(['zzz'])), None)
+
+
+class TestHistoryPlugin(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.add_section('history')
+        self.bot.config.set('history', 'history_dir', self.dir)
+        self.bot.load_plugin('history')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+        self.sent = []
+        self.protocol.msg = lambda target, message, priority=None: \
+            self.sent.append(message)
+        self.lines([
+            ':Alan!~a@host PRIVMSG #cs-york :has anybody seen the notes?',
+            ':bob!~b@host PRIVMSG #cs-york :\x01ACTION has the notes\x01',
+            ':bob!~b@host PRIVMSG #other :notes are here',
+            ':Alan!~a@host PRIVMSG #cs-york :thanks',
+        ])
+
+    def tearDown(self):
+        self.bot.teardown(save_config=False)
+        shutil.rmtree(self.dir)
+
+    def lines(self, lines):
+        for line in lines:
+            self.protocol.lineReceived(line)
+
+    def command(self, data, channel='#cs-york'):
+        del self.sent[:]
+        if channel == '#cs-york':
+            data = '!' + data
+        self.lines([':carol!~c@host PRIVMSG {} :{}'.format(channel, data)])
+        return [m.split('] ', 1)[-1] for m in self.sent]
+
+    def test_grep(self):
+        self.assertEqual(self.command('grep notes'), [
+            '#cs-york * bob has the notes',
+            '#cs-york <Alan> has anybody seen the notes?',
+        ])
+        self.assertEqual(self.command('grep notes channel:* nick:bob'), [
+            '#other <bob> notes are here',
+            '#cs-york * bob has the notes',
+        ])
+        self.assertEqual(self.command('grep notes channel:other'),
+                         ['#other <bob> notes are here'])
+        self.assertEqual(self.command('grep notes channel:"#other"'),
+                         ['#other <bob> notes are here'])
+        # Commands aren't added to the history
+        self.assertEqual(self.command('grep grep'), ['carol: Nothing found.'])
+        self.assertEqual(self.command('grep "seen notes"'),
+                         ['carol: Nothing found.'])
+
+    def test_too_broad(self):
+        # Errors are only sent in private
+        self.assertEqual(self.command('grep ???', 'csyorkbot'),
+                         ['Error: I can only look for text with words in it.'])
+        self.bot.plugins['history'].store.SEARCH_SCAN_LIMIT = 1
+        self.assertEqual(self.command('grep "the notes"', 'csyorkbot'),
+                         ["Error: That's too broad, try narrowing it down."])
+        self.assertEqual(self.command('quote channel:* "notes the"',
+                                      'csyorkbot'),
+                         ["Error: That's too broad, try narrowing it down."])
+
+    def test_last_quote(self):
+        self.assertEqual(self.command('last alan'),
+                         ['#cs-york <Alan> thanks'])
+        self.assertEqual(self.command('last alan notes'),
+                         ['#cs-york <Alan> has anybody seen the notes?'])
+        self.assertEqual(self.command('quote bob'),
+                         ['#cs-york * bob has the notes'])
+        self.assertEqual(self.command('last alan before:1d'),
+                         ["carol: I haven't seen alan say anything."])
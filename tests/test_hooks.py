@@ -0,0 +1,96 @@
+import unittest
+
+from csbot.core import Bot, Plugin, PluginFeatures
+from csbot import events
+
+
+class Recorder(Plugin):
+    features = PluginFeatures()
+
+    def setup(self):
+        self.seen = []
+
+    @features.hook('userJoined')
+    def userJoined(self, event):
+        self.seen.append(event)
+
+
+class Loader(Plugin):
+    features = PluginFeatures()
+
+    @features.hook('userJoined')
+    def userJoined(self, event):
+        event.bot.unload_plugin('loader')
+        event.bot.load_plugin('recorder')
+
+
+class TestHookIndex(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        available = {'recorder': Recorder, 'loader': Loader}
+        self.bot.discover_plugins = lambda: available
+
+    def event(self):
+        UserJoined = events.event_class('userJoined', ('user', 'channel'))
+        return UserJoined(self.bot, None, 'nick', '#cs-york')
+
+    def test_load_unload(self):
+        self.bot.load_plugin('recorder')
+        recorder = self.bot.get_plugin('recorder')
+        e = self.event()
+        self.bot.fire_hooks(e)
+        self.assertEquals(recorder.seen, [e])
+
+        self.bot.unload_plugin('recorder')
+        self.bot.fire_hooks(self.event())
+        self.assertEquals(recorder.seen, [e])
+        self.assertEquals(self.bot.hooks['userJoined'], [])
+
+    def test_bot_method_first(self):
+        self.bot.load_plugin('recorder')
+        handlers = self.bot.hooks_for('privmsg')
+        self.assertEquals(handlers, [self.bot.privmsg])
+
+    def test_load_during_dispatch(self):
+        # Plugins loaded while an event is being dispatched don't receive it
+        self.bot.load_plugin('loader')
+        self.bot.fire_hooks(self.event())
+        self.assertEquals(self.bot.get_plugin('recorder').seen, [])
+        self.assertFalse(self.bot.has_plugin('loader'))
+
+
+class Protocol(object):
+    def __init__(self, bot):
+        self.bot = bot
+        self.calls = 0
+
+    @events.proxy
+    def userJoined(self, user, channel):
+        self.calls += 1
+
+
+class TestProxySubscription(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.discover_plugins = lambda: {'recorder': Recorder}
+        self.protocol = Protocol(self.bot)
+
+    def test_no_subscribers(self):
+        self.assertFalse(self.bot.has_hooks('userJoined'))
+        posted = []
+        self.bot.post_event = posted.append
+        self.protocol.userJoined('nick', '#cs-york')
+        # The decorated method still runs, but no event is created
+        self.assertEquals(self.protocol.calls, 1)
+        self.assertEquals(posted, [])
+
+    def test_subscription_follows_plugins(self):
+        self.bot.load_plugin('recorder')
+        self.assertTrue(self.bot.has_hooks('userJoined'))
+        self.protocol.userJoined('nick', '#cs-york')
+        seen = self.bot.get_plugin('recorder').seen
+        self.assertEquals([(e.user, e.channel) for e in seen],
+                          [('nick', '#cs-york')])
+
+        self.bot.unload_plugin('recorder')
+        self.assertFalse(self.bot.has_hooks('userJoined'))
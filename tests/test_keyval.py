@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer
+
+from csbot.core import Bot, Plugin
+from csbot.keyval import LogStore
+
+
+class TestLogStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'keyval.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self):
+        return LogStore(self.path, run_in_thread=defer.maybeDeferred)
+
+    def test_typed_values(self):
+        store = self.open()
+        values = {'int': 3, 'str': 'x', 'unicode': u'\u2603', 'none': None,
+                  'list': [1, 2.5, True], 'dict': {'a': (1, 2)}}
+        for key, value in values.iteritems():
+            store.set('test', key, value)
+        store.close()
+
+        store = self.open()
+        for key, value in values.iteritems():
+            self.assertEquals(store.get('test', key), value)
+        self.assertRaises(KeyError, store.get, 'test', 'missing')
+        self.assertRaises(KeyError, store.get, 'missing', 'int')
+        self.assertRaises(ValueError, store.set, 'test', 'bad', object())
+        store.close()
+
+    def test_get_returns_copy(self):
+        store = self.open()
+        store.set('test', 'list', [1])
+        store.get('test', 'list').append(2)
+        self.assertEquals(store.get('test', 'list'), [1])
+        store.close()
+
+    def test_delete(self):
+        store = self.open()
+        store.set('test', 'a', 1)
+        store.set('test', 'b', 2)
+        store.delete('test', 'a')
+        self.assertRaises(KeyError, store.delete, 'test', 'a')
+        store.close()
+
+        store = self.open()
+        self.assertRaises(KeyError, store.get, 'test', 'a')
+        self.assertEquals(store.keys('test'), ['b'])
+        store.close()
+
+    def test_torn_tail(self):
+        store = self.open()
+        store.set('test', 'a', 1)
+        store.set('test', 'b', 2)
+        store.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3)
+
+        store = self.open()
+        self.assertEquals(store.get('test', 'a'), 1)
+        self.assertRaises(KeyError, store.get, 'test', 'b')
+        # New records follow the last good one
+        store.set('test', 'c', 3)
+        store.close()
+        store = self.open()
+        self.assertEquals(store.get('test', 'c'), 3)
+        store.close()
+
+    def test_should_compact(self):
+        store = self.open()
+        for i in xrange(LogStore.COMPACT_MIN_RECORDS - 1):
+            store.set('test', 'key{}'.format(i % 10), i)
+        self.assertFalse(store.should_compact())
+        store.set('test', 'key0', 'last')
+        self.assertTrue(store.should_compact())
+        store.close()
+
+    def test_compaction_replays_writes(self):
+        store = self.open()
+        for i in xrange(100):
+            store.set('test', 'key{}'.format(i % 10), i)
+        store.sync()
+        size = os.path.getsize(self.path)
+
+        threaded = []
+
+        def run_in_thread(f):
+            threaded.append(f)
+            return d
+        d = defer.Deferred()
+        store.run_in_thread = run_in_thread
+        store.compact()
+        store.set('test', 'key1', 'during')
+        store.delete('test', 'key2')
+        threaded[0]()
+        d.callback(None)
+
+        self.assertEquals(store.records, 12)
+        self.assertFalse(store.should_compact())
+        self.assertTrue(os.path.getsize(self.path) < size)
+        store.set('test', 'key3', 'after')
+        store.close()
+
+        store = self.open()
+        self.assertEquals(len(store), 9)
+        self.assertEquals(store.get('test', 'key1'), 'during')
+        self.assertEquals(store.get('test', 'key3'), 'after')
+        self.assertEquals(store.get('test', 'key9'), 99)
+        self.assertRaises(KeyError, store.get, 'test', 'key2')
+        store.close()
+
+    def test_close_during_compaction(self):
+        store = self.open()
+        for i in xrange(100):
+            store.set('test', 'key{}'.format(i % 10), i)
+
+        threaded = []
+
+        def run_in_thread(f):
+            threaded.append(f)
+            return d
+        d = defer.Deferred()
+        store.run_in_thread = run_in_thread
+        store.compact()
+        store.set('test', 'key1', 'during')
+        store.close()
+        threaded[0]()
+        d.callback(None)
+
+        # The compaction is abandoned, without reopening the log
+        self.assertTrue(store.file.closed)
+        self.assertEquals(os.listdir(self.dir), ['keyval.db'])
+        store = self.open()
+        self.assertEquals(store.records, 101)
+        self.assertEquals(store.get('test', 'key1'), 'during')
+        store.close()
+
+
+class TestPluginKeyValue(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.set('DEFAULT', 'keyvalfile',
+                            os.path.join(self.dir, 'keyval.cfg'))
+        self.bot.config.set('DEFAULT', 'keyvalstore',
+                            os.path.join(self.dir, 'keyval.db'))
+
+    def tearDown(self):
+        if self.bot.keyval_ is not None:
+            self.bot.keyval_.close()
+        shutil.rmtree(self.dir)
+
+    def test_import(self):
+        with open(os.path.join(self.dir, 'keyval.cfg'), 'w') as f:
+            f.write('[plugin]\nGreeting = hello\n')
+        p = Plugin(self.bot)
+        self.assertEquals(p.get('greeting'), 'hello')
+        self.assertEquals(p.get('Greeting'), 'hello')
+        p.set('count', 3)
+        self.assertEquals(p.get('count'), 3)
+        self.assertRaises(KeyError, p.get, 'missing')
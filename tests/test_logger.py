@@ -0,0 +1,117 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol
+from csbot.plugins.logger import ChannelLogs, Timestamps
+
+
+class TestChannelLogs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.logs = ChannelLogs(self.dir, buffer_size=100,
+                                run_in_thread=defer.maybeDeferred)
+        self.timestamps = Timestamps()
+
+    def tearDown(self):
+        self.logs.close()
+        shutil.rmtree(self.dir)
+
+    def path(self, date, channel='#cs-york'):
+        return os.path.join(self.dir, 'default', channel, date + '.log')
+
+    def read(self, date, channel='#cs-york'):
+        with open(self.path(date, channel)) as f:
+            return f.read()
+
+    def test_buffered(self):
+        self.logs.write('default', '#CS-York', 0, 'hello')
+        clock, date = self.timestamps(0)
+        # Nothing written until the buffer is full or flushed
+        self.assertEqual(self.logs.stats()['flushes'], 0)
+        self.logs.write('default', '#cs-york', 0, 'x' * 100)
+        self.assertEqual(self.read(date),
+                         '[{0}] hello\n[{0}] {1}\n'.format(clock, 'x' * 100))
+        self.logs.write('default', '#cs-york', 0, 'more')
+        self.logs.flush()
+        self.assertTrue(self.read(date).endswith('] more\n'))
+        self.assertEqual(self.logs.stats()['flushes'], 2)
+
+    def test_rotate(self):
+        day = 24 * 60 * 60
+        first = self.timestamps(0)[1]
+        second = self.timestamps(day)[1]
+        self.logs.write('default', '#cs-york', 0, 'one')
+        self.logs.write('default', '#cs-york', day, 'two')
+        # A late line for the old day goes in the new file
+        self.logs.write('default', '#cs-york', 0, 'late')
+        self.logs.flush()
+        self.assertFalse(os.path.exists(self.path(first)))
+        with gzip.open(self.path(first) + '.gz') as f:
+            self.assertTrue(f.read().endswith('] one\n'))
+        self.assertEqual([l.split('] ')[1] for l in
+                          self.read(second).splitlines()], ['two', 'late'])
+        self.assertEqual(self.logs.stats()['rotated'], 1)
+
+    def test_compress_stale(self):
+        self.logs.write('default', '#cs-york', 0, 'old')
+        self.logs.close()
+        date = self.timestamps(0)[1]
+        self.logs.compress_stale(date)
+        self.assertTrue(os.path.exists(self.path(date)))
+        self.logs.compress_stale()
+        self.assertTrue(os.path.exists(self.path(date) + '.gz'))
+        self.assertFalse(os.path.exists(self.path(date)))
+
+    def test_timestamps(self):
+        # Formatted once for each second
+        clock = self.timestamps(10.2)[0]
+        self.assertTrue(self.timestamps(10.7)[0] is clock)
+        self.assertFalse(self.timestamps(11)[0] is clock)
+
+
+class TestLoggerPlugin(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.add_section('logger')
+        self.bot.config.set('logger', 'log_dir', self.dir)
+        self.bot.config.set('logger', 'compress', 'false')
+        self.bot.load_plugin('logger')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+        for line in [
+            ':csyorkbot!~bot@host JOIN #cs-york',
+            ':server 353 csyorkbot = #cs-york :csyorkbot @Alan',
+            ':server 366 csyorkbot #cs-york :End of /NAMES list.',
+            ':Alan!~a@host PRIVMSG #cs-york :hello',
+            ':Alan!~a@host PRIVMSG csyorkbot :secret',
+            ':Alan!~a@host PRIVMSG #cs-york :\x01ACTION waves\x01',
+            ':Alan!~a@host NICK :Alan_',
+            ':Alan_!~a@host QUIT :gone',
+        ]:
+            self.protocol.lineReceived(line)
+
+    def tearDown(self):
+        self.bot.teardown(save_config=False)
+        shutil.rmtree(self.dir)
+
+    def test_log(self):
+        self.bot.plugins['logger'].logs.flush()
+        directory = os.path.join(self.dir, 'default', '#cs-york')
+        [filename] = os.listdir(directory)
+        with open(os.path.join(directory, filename)) as f:
+            lines = [l.split('] ', 1)[1] for l in f.read().splitlines()]
+        self.assertEqual(lines, [
+            '-!- csyorkbot has joined #cs-york',
+            '-!- Names: csyorkbot @Alan',
+            '<Alan> hello',
+            '* Alan waves',
+            '-!- Alan is now known as Alan_',
+            '-!- Alan_ has quit (gone)',
+        ])
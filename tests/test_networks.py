@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol
+from csbot.plugins.users import Users
+from csbot.plugins.tell import Tell
+
+
+CONFIG = """
+[DEFAULT]
+networks = freenode oftc
+channels = #cs-york
+mongodb_host = :memory:
+mongodb_threads = 0
+lineRate = 0
+
+[network:oftc]
+irc_host = irc.oftc.net
+nickname = otherbot
+channels = #cs-york #cs-york-dev
+command_prefix = ?
+"""
+
+
+class TestNetworks(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'csbot.cfg')
+        with open(path, 'w') as f:
+            f.write(CONFIG)
+        self.bot = Bot(path)
+        self.bot.discover_plugins = lambda: {'users': Users, 'tell': Tell}
+        self.bot.load_plugin('users')
+        self.bot.load_plugin('tell')
+        self.protocols = dict()
+        for name, network in self.bot.networks.iteritems():
+            p = BotProtocol(self.bot, network)
+            p.makeConnection(StringTransport())
+            self.protocols[name] = p
+        self.sent = []
+        for name, p in self.protocols.iteritems():
+            p.msg = lambda target, message, name=name, **kwargs: \
+                self.sent.append((name, target, message))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_settings(self):
+        freenode, oftc = self.bot.networks.values()
+        self.assertEquals(freenode.name, 'freenode')
+        self.assertEquals(freenode.config['irc_host'], 'irc.freenode.net')
+        self.assertEquals(oftc.config['irc_host'], 'irc.oftc.net')
+        self.assertEquals(oftc.config['irc_port'], 6667)
+        self.assertEquals(self.protocols['freenode'].nickname, 'csyorkbot')
+        self.assertEquals(self.protocols['oftc'].nickname, 'otherbot')
+        self.assertEquals(
+            self.protocols['oftc'].command_matcher.match('?help'),
+            ('help', '', False))
+
+    def test_join_channels(self):
+        for name, channels in (('freenode', ['#cs-york']),
+                               ('oftc', ['#cs-york', '#cs-york-dev'])):
+            p = self.protocols[name]
+            p.transport.clear()
+            p.irc_RPL_WELCOME('server', [p.nickname, 'Welcome'])
+            self.assertEquals(p.transport.value().splitlines(),
+                              ['JOIN ' + c for c in channels])
+
+    def test_events_carry_network(self):
+        seen = []
+        self.bot.hooks['userJoined'] = [seen.append]
+        self.protocols['oftc'].userJoined('Alan', '#cs-york')
+        self.assertEquals(seen[0].network, 'oftc')
+
+    def test_presence_per_network(self):
+        users = self.bot.get_plugin('users')
+        self.protocols['freenode'].userJoined('Alan', '#cs-york')
+        self.assertTrue(users.is_online('Alan', 'freenode'))
+        self.assertFalse(users.is_online('Alan', 'oftc'))
+        self.assertTrue(users.is_online('Alan'))
+        self.protocols['oftc'].userQuit('Alan', 'bye')
+        self.assertTrue(users.is_online('Alan', 'freenode'))
+
+    def test_tell_per_network(self):
+        tell = self.bot.get_plugin('tell')
+        self.protocols['freenode'].privmsg('Bob!~bob@host', '#cs-york',
+                                           '!tell alan hi')
+        self.assertEquals(tell.pending['freenode', 'alan'], 1)
+        self.assertEquals(tell.pending['oftc', 'alan'], 0)
+        del self.sent[:]
+        # A different alan on another network doesn't get the message
+        self.protocols['oftc'].userJoined('alan', '#cs-york')
+        self.assertEquals(self.sent, [])
+        self.protocols['oftc'].privmsg('alan!~a@host', '#cs-york',
+                                       '?messages')
+        self.assertEquals(self.sent[-1][2],
+                          'alan: You have no messages. Sorry.')
+        self.protocols['freenode'].userJoined('alan', '#cs-york')
+        self.assertEquals(self.sent[-1][:2], ('freenode', '#cs-york'))
+        self.assertTrue(self.sent[-1][2].startswith('alan, "hi" - Bob'))
+        self.assertEquals(tell.db.messages.count(), 0)
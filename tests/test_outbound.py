@@ -0,0 +1,80 @@
+import unittest
+
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+from csbot.core import Bot, BotProtocol
+from csbot.outbound import OutboundScheduler, split_message, PRIORITY_REPLY
+
+
+class TestOutboundScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.scheduler = OutboundScheduler(self.sent.append, 1, 2,
+                                           clock=self.clock)
+
+    def test_rate_limit(self):
+        self.scheduler.enqueue('#a', ['1', '2', '3', '4'])
+        self.assertEquals(self.sent, ['1', '2'])
+        self.assertEquals(self.scheduler.stats()['depth'], 2)
+        self.clock.advance(1)
+        self.assertEquals(self.sent, ['1', '2', '3'])
+        self.clock.advance(1)
+        self.assertEquals(self.sent, ['1', '2', '3', '4'])
+        stats = self.scheduler.stats()
+        self.assertEquals((stats['depth'], stats['sent']), (0, 4))
+        self.assertEquals(stats['max_wait'], 2)
+
+    def test_fairness_and_priority(self):
+        self.scheduler.enqueue('#a', ['a1', 'a2'])
+        self.scheduler.enqueue('#a', ['a3', 'a4'])
+        self.scheduler.enqueue('#b', ['b1', 'b2'])
+        self.scheduler.enqueue('#c', ['c1'], PRIORITY_REPLY)
+        self.clock.pump([1] * 6)
+        self.assertEquals(self.sent,
+                          ['a1', 'a2', 'c1', 'a3', 'b1', 'a4', 'b2'])
+        self.assertEquals(self.scheduler.target_depths(), {})
+
+    def test_unlimited(self):
+        scheduler = OutboundScheduler(self.sent.append, None, 1,
+                                      clock=self.clock)
+        scheduler.enqueue('#a', map(str, range(100)))
+        self.assertEquals(len(self.sent), 100)
+
+    def test_clear(self):
+        self.scheduler.enqueue('#a', ['1', '2', '3'])
+        self.scheduler.clear()
+        self.clock.advance(10)
+        self.assertEquals(self.sent, ['1', '2'])
+
+
+class TestSplitMessage(unittest.TestCase):
+    def test_utf8(self):
+        message = u'\u2603' * 10
+        for max_bytes in range(3, 20):
+            chunks = split_message(message, max_bytes)
+            self.assertTrue(all(len(c) <= max_bytes for c in chunks))
+            self.assertEquals(''.join(chunks).decode('utf-8'), message)
+
+    def test_words(self):
+        chunks = split_message('the quick brown fox', 10)
+        self.assertEquals(chunks, ['the quick', 'brown fox'])
+
+
+class TestBotProtocolMsg(unittest.TestCase):
+    def setUp(self):
+        self.protocol = BotProtocol(Bot('nonexistent.cfg'))
+        self.protocol.outbound.bucket = None
+        self.transport = proto_helpers.StringTransport()
+        self.protocol.makeConnection(self.transport)
+        self.transport.clear()
+
+    def test_line_limit(self):
+        self.protocol.msg('#cs-york', 'word ' * 300)
+        lines = self.transport.value().split('\r\n')[:-1]
+        self.assertTrue(len(lines) > 1)
+        prefix = len(self.protocol.source_prefix())
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #cs-york :'))
+            self.assertTrue(prefix + len(line) + 2 <= 512)
@@ -0,0 +1,141 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from twisted.test.proto_helpers import StringTransport
+
+from csbot.core import Bot, BotProtocol, Plugin, PluginFeatures
+from csbot.profiling import Profiler
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Slow(Plugin):
+    features = PluginFeatures()
+
+    @features.hook('privmsg')
+    def privmsg(self, event):
+        self.bot.clock.now += 1
+
+    @features.command('slow')
+    def slow(self, event):
+        self.bot.clock.now += 10
+        event.reply('done')
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.clock = Clock()
+        self.bot.discover_plugins = lambda: {'slow': Slow}
+        self.bot.load_plugin('slow')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+        self.protocol.msg = lambda target, message, priority=None: None
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lines(self, lines):
+        for line in lines:
+            self.protocol.lineReceived(line)
+
+    def profile(self):
+        self.bot.start_profiling()
+        self.bot.profiler.timer = self.bot.clock
+        self.lines([':Alan!~a@host PRIVMSG #cs-york :hello',
+                    ':Alan!~a@host PRIVMSG #cs-york :!slow'])
+        return self.bot.stop_profiling()
+
+    def test_attribution(self):
+        profiler = self.profile()
+        rows = dict((label, (calls, total))
+                    for label, calls, total, _ in profiler.by_handler())
+        self.assertEqual(rows['hook privmsg (slow.privmsg)'], (2, 2))
+        self.assertEqual(rows['command slow (slow.slow)'], (1, 10))
+        # The command's time isn't counted against the hook that ran it
+        self.assertEqual(rows['hook command (bot.command)'], (1, 0))
+        self.assertEqual(profiler.by_plugin()[0], ('slow', 3, 12))
+        self.assertEqual(profiler.summary(1)[1],
+                         'command slow (slow.slow): 1 calls, 10.000s, '
+                         '10000.00ms mean, 10000.00ms max')
+
+    def test_start_stop(self):
+        self.bot.start_profiling()
+        self.assertRaises(ValueError, self.bot.start_profiling)
+        self.assertTrue(isinstance(self.bot.stop_profiling(), Profiler))
+        self.assertEqual(self.bot.stop_profiling(), None)
+        self.assertEqual(self.bot.profiler, None)
+
+    def test_dump(self):
+        path = os.path.join(self.dir, 'profiles', 'handlers.prof')
+        self.profile().dump(path)
+        stats = pstats.Stats(path)
+        # Two of each privmsg hook, the command hook and the command
+        self.assertEqual(stats.total_calls, 6)
+        labels = [key[2] for key in stats.stats]
+        self.assertTrue('command slow (slow.slow)' in labels)
+
+    def test_dump_deterministic(self):
+        path = os.path.join(self.dir, 'full.prof')
+        self.bot.start_profiling(deterministic=True)
+        self.lines([':Alan!~a@host PRIVMSG #cs-york :!slow'])
+        self.bot.stop_profiling().dump(path)
+        functions = [key[2] for key in pstats.Stats(path).stats]
+        self.assertTrue('slow' in functions)
+
+
+class TestProfilerPlugin(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.add_section('profiler')
+        self.bot.config.set('profiler', 'admins', '*!*@admin.host')
+        self.bot.config.set('profiler', 'profile_dir', self.dir)
+        self.bot.load_plugin('profiler')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+        self.sent = []
+        self.protocol.msg = lambda target, message, priority=None: \
+            self.sent.append(message)
+
+    def tearDown(self):
+        self.bot.stop_profiling()
+        shutil.rmtree(self.dir)
+
+    def command(self, data, user='Alan!~a@admin.host'):
+        del self.sent[:]
+        self.protocol.lineReceived(':{} PRIVMSG csyorkbot :{}'.format(
+            user, data))
+        return self.sent
+
+    def test_admins_only(self):
+        self.assertEqual(self.command('profile.start', 'bob!~b@other.host'),
+                         ['Error: Only admins can do that.'])
+        self.assertEqual(self.bot.profiler, None)
+
+    def test_start_stop(self):
+        self.assertEqual(self.command('profile.start'),
+                         ['Profiling hooks and commands.'])
+        self.assertEqual(self.command('profile.start'),
+                         ['Error: Already profiling'])
+        self.assertEqual(len(self.command('profile.top 1')), 2)
+        replies = self.command('profile.stop')
+        self.assertTrue(replies[0].startswith('Profiled '))
+        self.assertTrue(replies[-1].startswith('Profile written to '))
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+        self.assertEqual(self.bot.profiler, None)
+        # The last profile can still be looked at
+        self.assertTrue(self.command('profile.top')[0].startswith(
+            'Profiled '))
+        self.assertEqual(self.command('profile.stop'),
+                         ['Error: Not profiling.'])
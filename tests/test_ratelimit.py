@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from csbot.core import Bot
+from csbot.ratelimit import CommandLimiter, DEFER
+from csbot.util import LRUCache
+
+
+class Command(object):
+    def __init__(self, command, user='nick!~user@host'):
+        self.command = command
+        self.user = user
+
+
+class TestCommandLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.run = []
+
+    def limiter(self, *args, **kwargs):
+        return CommandLimiter(*args, clock=self.clock, **kwargs)
+
+    def submit(self, limiter, *args, **kwargs):
+        command = Command(*args, **kwargs)
+        limiter.submit(command, self.run.append)
+        return command
+
+    def test_user_limit(self):
+        limiter = self.limiter(1, 2)
+        for _ in xrange(3):
+            self.submit(limiter, 'seen')
+        self.submit(limiter, 'seen', user='other!~user@host')
+        self.assertEqual(len(self.run), 3)
+        self.clock.advance(1)
+        self.submit(limiter, 'seen')
+        self.assertEqual(len(self.run), 4)
+        stats = limiter.stats()
+        self.assertEqual((stats['allowed'], stats['dropped'],
+                          stats['user_limited']), (4, 1, 1))
+
+    def test_command_limit(self):
+        limiter = self.limiter(None, None, 1, 1)
+        self.submit(limiter, 'seen', user='a')
+        self.submit(limiter, 'seen', user='b')
+        self.submit(limiter, 'tell', user='b')
+        self.assertEqual([c.user for c in self.run], ['a', 'b'])
+        self.assertEqual(limiter.stats()['command_limited'], 1)
+
+    def test_defer(self):
+        limiter = self.limiter(1, 1, action=DEFER, max_deferred=2)
+        commands = [self.submit(limiter, str(i)) for i in xrange(4)]
+        self.assertEqual(self.run, commands[:1])
+        self.clock.advance(1)
+        self.assertEqual(self.run, commands[:2])
+        self.clock.advance(1)
+        # The fourth command was dropped, since two were already waiting
+        self.assertEqual(self.run, commands[:3])
+        self.clock.advance(10)
+        self.assertEqual(self.run, commands[:3])
+        stats = limiter.stats()
+        self.assertEqual((stats['deferred'], stats['dropped'],
+                          stats['waiting']), (2, 1, 0))
+
+    def test_bounded(self):
+        limiter = self.limiter(1, 1, max_users=10, action=DEFER)
+        for i in xrange(100):
+            self.submit(limiter, 'seen', user=str(i))
+            self.submit(limiter, 'seen', user=str(i))
+        stats = limiter.stats()
+        self.assertEqual((stats['users'], stats['evictions']), (10, 90))
+        # Deferred commands of forgotten users are dropped
+        self.assertEqual((stats['dropped'], stats['waiting']), (90, 10))
+        self.clock.advance(1)
+        self.assertEqual(len(self.run), 110)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict(self):
+        evicted = []
+        cache = LRUCache(3, on_evict=lambda k, v: evicted.append((k, v)))
+        for i in xrange(3):
+            cache[i] = str(i)
+        cache.get(0)
+        cache[1] = 'one'
+        cache[3] = '3'
+        self.assertEqual(cache.keys(), [0, 1, 3])
+        self.assertEqual(evicted, [(2, '2')])
+        self.assertEqual(cache.get(2, 'missing'), 'missing')
+
+
+class TestBotLimits(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def bot(self, config):
+        path = os.path.join(self.dir, 'csbot.cfg')
+        with open(path, 'w') as f:
+            f.write('[DEFAULT]\n' + config)
+        return Bot(path)
+
+    def test_unlimited(self):
+        self.assertTrue(self.bot('').command_limiter is None)
+
+    def test_fire_command(self):
+        bot = self.bot('command_user_rate = 0.5\ncommand_user_burst = 1\n')
+        bot.command_limiter.clock = task.Clock()
+        run = []
+        bot.dispatch_command = run.append
+        bot.fire_command(Command('seen'))
+        bot.fire_command(Command('seen'))
+        self.assertEqual(len(run), 1)
+        self.assertEqual(bot.command_limiter.stats()['dropped'], 1)
+
+    def test_reload_config(self):
+        bot = self.bot('')
+        with open(bot.configpath, 'a') as f:
+            f.write('command_rate = 2\ncommand_limit_action = defer\n')
+        bot.reload_config()
+        self.assertEqual(bot.command_limiter.command_rate, 2.0)
+        self.assertEqual(bot.command_limiter.action, 'defer')
@@ -0,0 +1,174 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from csbot.core import Bot, PluginError
+from csbot.events import event_class
+
+
+PLUGIN_SOURCE = """
+from csbot.core import Plugin, PluginFeatures
+
+class Counter(Plugin):
+    features = PluginFeatures()
+    VERSION = {version}
+    torn_down = []
+
+    def setup(self):
+        self.count = 0
+
+    def teardown(self):
+        self.torn_down.append(self.VERSION)
+
+    @features.hook('userJoined')
+    def joined(self, event):
+        self.count += 1
+        event.seen.append(('joined', self.VERSION))
+
+    @features.command('{command}')
+    def command(self, event):
+        event.seen.append(('command', self.VERSION))
+{extra}
+"""
+
+HANDOVER = """
+    def snapshot(self):
+        return self.count
+
+    def restore(self, count):
+        self.count = count
+"""
+
+
+class Seen(event_class('userJoined', ('user', 'channel', 'seen'))):
+    __slots__ = ()
+
+
+class Command(object):
+    def __init__(self, command, seen):
+        self.command = command
+        self.seen = seen
+
+
+class TestReload(unittest.TestCase):
+    PACKAGE = 'csbot_test_reload'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.package_dir = os.path.join(self.dir, self.PACKAGE)
+        os.mkdir(self.package_dir)
+        open(os.path.join(self.package_dir, '__init__.py'), 'w').close()
+        sys.path.insert(0, self.dir)
+
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.plugin_cache.package = self.PACKAGE
+        self.mtime = 1000
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for name in sys.modules.keys():
+            if name.split('.')[0] == self.PACKAGE:
+                del sys.modules[name]
+        shutil.rmtree(self.dir)
+
+    def write(self, version, command='count', extra='', source=None):
+        path = os.path.join(self.package_dir, 'counter.py')
+        with open(path, 'w') as f:
+            f.write(source or PLUGIN_SOURCE.format(
+                version=version, command=command, extra=extra))
+        # Make sure the change is noticed, and that Python doesn't use a
+        # stale .pyc
+        if os.path.exists(path + 'c'):
+            os.remove(path + 'c')
+        self.mtime += 1
+        os.utime(path, (self.mtime, self.mtime))
+
+    def fire(self):
+        seen = []
+        self.bot.post_event(Seen(self.bot, None, 'nick', '#cs-york', seen))
+        return seen
+
+    def command(self, name):
+        seen = []
+        self.bot.fire_command(Command(name, seen))
+        return seen
+
+    def test_reload(self):
+        self.write(1)
+        self.bot.load_plugin('counter')
+        self.fire()
+        old = self.bot.plugins['counter']
+        self.write(2, command='count2')
+        self.bot.reload_plugin('counter')
+
+        p = self.bot.plugins['counter']
+        self.assertEqual(p.VERSION, 2)
+        # No state handed over, so the old plugin was torn down and the new
+        # one set up from scratch
+        self.assertEqual(old.torn_down, [1])
+        self.assertEqual(p.count, 0)
+        self.assertEqual(self.fire(), [('joined', 2)])
+        self.assertEqual(self.command('count2'), [('command', 2)])
+        self.assertFalse('count' in self.bot.commands)
+
+    def test_handover(self):
+        self.write(1, extra=HANDOVER)
+        self.bot.load_plugin('counter')
+        self.fire()
+        self.fire()
+        old = self.bot.plugins['counter']
+        self.write(2, extra=HANDOVER)
+        self.bot.reload_plugin('counter')
+
+        p = self.bot.plugins['counter']
+        self.assertEqual((p.VERSION, p.count), (2, 2))
+        self.assertEqual(old.torn_down, [])
+
+    def test_failed_reload(self):
+        self.write(1)
+        self.bot.load_plugin('counter')
+        old = self.bot.plugins['counter']
+
+        self.write(2, source='this is not python\n')
+        self.assertRaises(PluginError, self.bot.reload_plugin, 'counter')
+        self.write(2, extra='\n    def setup(self):\n        1 / 0\n')
+        self.assertRaises(PluginError, self.bot.reload_plugin, 'counter')
+
+        # The old plugin is still running
+        self.assertTrue(self.bot.plugins['counter'] is old)
+        self.assertEqual(old.torn_down, [])
+        self.assertEqual(self.fire(), [('joined', 1)])
+        self.assertEqual(self.command('count'), [('command', 1)])
+
+    def test_reload_during_event(self):
+        self.write(1)
+        self.bot.load_plugin('counter')
+        # A hook which reloads the plugin in the middle of an event
+        self.bot.hooks['userJoined'].insert(
+            0, lambda e: self.bot.reload_plugin('counter'))
+        self.write(2)
+        # The event in progress is handled by the old plugin, and later
+        # events by the new one
+        self.assertEqual(self.fire(), [('joined', 1)])
+        self.assertEqual(self.fire(), [('joined', 2)])
+
+    def test_watch(self):
+        self.write(1)
+        self.bot.load_plugin('counter')
+        self.bot.reload_changed_plugins()
+        self.assertEqual(self.bot.plugins['counter'].VERSION, 1)
+
+        self.write(2)
+        self.bot.reload_changed_plugins()
+        self.assertEqual(self.bot.plugins['counter'].VERSION, 2)
+
+        # A broken change is logged, and not retried until it changes again
+        self.write(3, source='this is not python\n')
+        self.bot.reload_changed_plugins()
+        self.assertEqual(self.bot.plugins['counter'].VERSION, 2)
+        reloads = []
+        self.bot.reload_plugins = reloads.append
+        self.bot.reload_changed_plugins()
+        self.assertEqual(reloads, [])
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from csbot.core import Bot, BotProtocol
+from csbot.replay import Recorder, Replayer, SinkTransport, read_capture
+
+
+LINES = [
+    ':server 001 csyorkbot :Welcome',
+    ':nick!~user@host PRIVMSG #cs-york :hello',
+    ':server PING :server',
+    ':nick!~user@host PRIVMSG csyorkbot :nonexistent',
+]
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'capture.log')
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.set('DEFAULT', 'lineRate', '0')
+        self.bot.config.set('DEFAULT', 'channels', '#cs-york')
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.transport = SinkTransport()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record(self):
+        self.protocol.recorder = Recorder(self.path)
+        for line in LINES:
+            self.protocol.lineReceived(line)
+        self.protocol.recorder.close()
+        capture = list(read_capture(self.path))
+        self.assertEquals([line for timestamp, line in capture], LINES)
+        self.assertEquals(sorted(capture), capture)
+
+    def test_replay(self):
+        clock = task.Clock()
+        capture = [(100.0 + i, line) for i, line in enumerate(LINES)]
+        replayer = Replayer(self.protocol, capture, speed=2, clock=clock)
+        finished = []
+        replayer.start().addCallback(finished.append)
+
+        # Lines are fed at twice the original rate
+        clock.advance(0)
+        self.assertEquals(len(replayer.latencies), 1)
+        clock.advance(0.5)
+        self.assertEquals(len(replayer.latencies), 2)
+        clock.advance(1)
+        self.assertEquals(finished, [replayer])
+
+        stats = replayer.stats()
+        self.assertEquals(stats['lines'], 4)
+        self.assertEquals(stats['elapsed'], 1.5)
+        # JOIN after signing on, PONG, and the reply to the unknown command
+        self.assertEquals(stats['outbound'],
+                          {'JOIN': 1, 'PONG': 1, 'PRIVMSG': 1})
+
+    def test_replay_fast(self):
+        clock = task.Clock()
+        capture = [(100.0 + i, line) for i, line in enumerate(LINES)]
+        replayer = Replayer(self.protocol, capture, speed=0, clock=clock)
+        finished = []
+        replayer.start().addCallback(finished.append)
+        clock.advance(0)
+        self.assertEquals(finished, [replayer])
+        self.assertEquals(replayer.stats()['lines'], 4)
@@ -0,0 +1,113 @@
+from datetime import datetime
+import unittest
+
+from csbot.core import Bot, BotProtocol
+from csbot.memorydb import Connection
+from csbot.plugins.users import Users
+from csbot.plugins.tell import Tell
+
+
+class TestMemoryDB(unittest.TestCase):
+    def setUp(self):
+        self.coll = Connection()['test'].things
+
+    def test_insert_find(self):
+        _id = self.coll.insert({'to': 'Alan', 'n': 1})
+        self.coll.insert([{'to': 'Bob', 'n': 2}, {'to': 'Alan', 'n': 3}])
+        self.assertEquals(self.coll.find({'to': 'Alan'}).count(), 2)
+        self.assertEquals(self.coll.find_one(_id)['n'], 1)
+        self.assertEquals([d['n'] for d in
+                           self.coll.find({'n': {'$gte': 2}}).sort('n', -1)],
+                          [3, 2])
+        self.assertEquals(self.coll.find_one({'to': 'Carol'}), None)
+
+    def test_update_remove(self):
+        self.coll.update({'user': 'Alan'}, {'user': 'Alan', 'n': 1},
+                         upsert=True)
+        self.coll.update({'user': 'Alan'}, {'$inc': {'n': 1}})
+        self.assertEquals(self.coll.find_one({'user': 'Alan'})['n'], 2)
+        ids = [self.coll.insert({'n': i}) for i in range(3)]
+        self.coll.remove({'_id': {'$in': ids[:2]}})
+        self.assertEquals(self.coll.count(), 2)
+
+    def test_isolation(self):
+        doc = {'to': 'Alan'}
+        self.coll.insert(doc)
+        doc['to'] = 'Bob'
+        found = self.coll.find_one()
+        found['to'] = 'Carol'
+        self.assertEquals(self.coll.find_one()['to'], 'Alan')
+
+
+class PluginTestCase(unittest.TestCase):
+    PLUGINS = ()
+
+    def setUp(self):
+        self.bot = Bot('nonexistent.cfg')
+        self.bot.config.set('DEFAULT', 'mongodb_host', ':memory:')
+        # Run database operations inline so they finish immediately
+        self.bot.config.set('DEFAULT', 'mongodb_threads', '0')
+        available = dict((P.plugin_name(), P) for P in self.PLUGINS)
+        self.bot.discover_plugins = lambda: available
+        for P in self.PLUGINS:
+            self.bot.load_plugin(P.plugin_name())
+        self.protocol = BotProtocol(self.bot)
+        self.sent = []
+        self.protocol.msg = lambda target, message, **kwargs: \
+            self.sent.append((target, message))
+
+
+class TestUsersTell(PluginTestCase):
+    PLUGINS = (Users, Tell)
+
+    def test_presence(self):
+        users = self.bot.get_plugin('users')
+        self.protocol.names('#cs-york', [('Alan', set()), ('Bob', set())], [])
+        self.protocol.privmsg('Alan!~alan@host', '#cs-york', 'hello')
+        self.protocol.userQuit('Alan', 'bye')
+        self.assertFalse(users.is_online('Alan'))
+        self.assertTrue(users.is_online('Bob!~bob@host'))
+
+        stored = self.bot.mongodb['csbot__users'].offline_users.find_one()
+        self.assertEquals((stored['user'], stored['last_said']),
+                          ('Alan', 'hello'))
+
+        # Offline history survives reloading the plugin
+        self.bot.reload_plugin('users')
+        offline = self.bot.get_plugin('users').offline['default']
+        self.assertEquals(offline['Alan']['user'], 'Alan')
+
+    def test_offline_without_network(self):
+        users = self.bot.get_plugin('users')
+        # A record from before multi-network support
+        users.db.offline_users.insert({
+            'user': 'Alan', 'time': datetime(2012, 1, 1),
+            'time_last_spoke': None, 'last_said': None})
+        self.protocol.userJoined('Alan', '#cs-york')
+        self.protocol.userQuit('Alan', 'bye')
+
+        # Load the offline history from the database, not from the old
+        # instance
+        self.bot.unload_plugin('users')
+        self.bot.load_plugin('users')
+        users = self.bot.get_plugin('users')
+        self.assertEquals(users.db.offline_users.find(
+            {'network': {'$exists': False}}).count(), 0)
+        self.assertTrue(users.offline['default']['Alan']['time'] >
+                        datetime(2012, 1, 1))
+
+    def test_tell(self):
+        self.protocol.privmsg('Bob!~bob@host', '#cs-york', '!tell Alan hi')
+        tell = self.bot.get_plugin('tell')
+        self.assertEquals(tell.pending['default', 'Alan'], 1)
+
+        # Joins by people without messages don't touch the database
+        self.protocol.userJoined('Carol', '#cs-york')
+        calls = self.bot.storage.stats.summary()['csbot__tell.messages.find']
+        self.assertEquals(calls['calls'], 1)
+
+        self.protocol.userJoined('Alan', '#cs-york')
+        self.assertEquals(self.sent[-1][0], '#cs-york')
+        self.assertTrue(self.sent[-1][1].startswith('Alan, "hi" - Bob'))
+        self.assertEquals(tell.pending['default', 'Alan'], 0)
+        self.assertEquals(tell.db.messages.count(), 0)
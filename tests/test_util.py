@@ -0,0 +1,59 @@
+import unittest
+import random
+import shlex
+
+from csbot.util import parse_arguments, ParseError
+
+
+def shlex_parse_arguments(raw):
+    """The shlex-based implementation that parse_arguments replaced."""
+    lex = shlex.shlex(raw, posix=True)
+    lex.whitespace_split = True
+    lex.quotes = '"'
+    return list(lex)
+
+
+def outcome(f, raw):
+    try:
+        return f(raw)
+    except ValueError as e:
+        return str(e)
+
+
+class TestParseArguments(unittest.TestCase):
+    #: Fragments that generated inputs are built from, chosen to exercise
+    #: quoting, escaping, comments and every kind of whitespace
+    FRAGMENTS = ['a', 'bc', "'", "aren't", ' ', '  ', '\t', '\r', '\n', '"',
+                 '""', '\\', '\\"', '\\\\', '#', 'x#y', '\x0b', '\xc3\xa9']
+
+    def test_differential(self):
+        rand = random.Random(1234)
+        for _ in xrange(20000):
+            raw = ''.join(rand.choice(self.FRAGMENTS)
+                          for _ in xrange(rand.randint(0, 12)))
+            self.assertEquals(outcome(parse_arguments, raw),
+                              outcome(shlex_parse_arguments, raw), repr(raw))
+
+    def test_examples(self):
+        for raw in ['', '   ', 'a b', '"a b" c', 'a"b c"d', '"" a', 'a\\ b',
+                    '"a \\" b"', '"a \\x"', 'a #b c\nd', '"#"', "it's",
+                    'a\\\nb', '"a\nb"']:
+            self.assertEquals(parse_arguments(raw),
+                              shlex_parse_arguments(raw), repr(raw))
+
+    def test_error_position(self):
+        try:
+            parse_arguments('say "hello" "world')
+        except ParseError as e:
+            self.assertEquals(str(e), 'No closing quotation')
+            self.assertEquals(e.position, 12)
+        else:
+            self.fail('ParseError not raised')
+
+        try:
+            parse_arguments('"a\\')
+        except ParseError as e:
+            self.assertEquals(str(e), 'No escaped character')
+            self.assertEquals(e.position, 2)
+        else:
+            self.fail('ParseError not raised')
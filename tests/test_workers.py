@@ -0,0 +1,257 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import cPickle as pickle
+
+from twisted.internet import task, error
+from twisted.python import failure
+from twisted.test.proto_helpers import StringTransport
+
+from csbot import workers
+from csbot.history import Query
+from csbot.core import Bot, BotProtocol
+from csbot.plugins.example import Example
+from csbot.plugins.history import History
+
+
+CONFIG = """
+[DEFAULT]
+mongodb_host = :memory:
+mongodb_threads = 0
+lineRate = 0
+worker_plugins = example
+"""
+
+USER = 'nick!~user@host'
+
+
+class ProcessTransport(StringTransport):
+    def closeStdin(self):
+        self.stdin_closed = True
+
+
+def frames(data):
+    """Split length-prefixed messages."""
+    messages = []
+    while data:
+        length, = struct.unpack('!I', data[:4])
+        messages.append(data[4:4 + length])
+        data = data[4 + length:]
+    return messages
+
+
+def frame(data):
+    return struct.pack('!I', len(data)) + data
+
+
+class TestWorkerPool(unittest.TestCase):
+    """The bot's side of worker plugins, with fake worker processes."""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'csbot.cfg')
+        with open(path, 'w') as f:
+            f.write(CONFIG)
+        self.bot = Bot(path)
+        self.bot.config.set('DEFAULT', 'keyvalstore',
+                            os.path.join(self.dir, 'keyval.db'))
+        self.bot.discover_plugins = lambda: {'example': Example}
+        self.clock = task.Clock()
+        self.bot.workers_ = self.pool = workers.WorkerPool(self.bot, 1,
+                                                           self.clock)
+        self.spawned = 0
+
+        def spawn(worker):
+            self.spawned += 1
+            worker.makeConnection(ProcessTransport())
+        self.pool.spawn = spawn
+
+        self.bot.keyval.set('example', 'foo', 'bar')
+        self.bot.load_plugin('example')
+        self.worker = self.pool.workers[0]
+        self.protocol = BotProtocol(self.bot)
+        self.protocol.makeConnection(StringTransport())
+
+    def tearDown(self):
+        self.bot.keyval.close()
+        shutil.rmtree(self.dir)
+
+    def sent(self):
+        """Get the messages sent to the worker since the last call."""
+        transport = self.worker.transport
+        messages = [pickle.loads(m) for m in frames(transport.value())]
+        transport.clear()
+        return messages
+
+    def reply(self, message):
+        self.worker.outReceived(frame(workers.encode_reply(message)))
+
+    def test_remote_plugin(self):
+        p = self.bot.plugins['example']
+        self.assertTrue(isinstance(p, workers.RemotePlugin))
+        self.assertEqual(p.plugin_name(), 'example')
+        self.assertEqual(sorted(self.bot.commands),
+                         ['cfg', 'get', 'set', 'test'])
+        self.assertEqual(self.spawned, 1)
+        messages = self.sent()
+        self.assertEqual(messages[0][0], 'init')
+        self.assertEqual(messages[1], ('load', 'example', {'foo': 'bar'}))
+
+    def test_forward(self):
+        self.sent()
+        self.protocol.lineReceived(':{} PRIVMSG #cs-york :!test 1'.format(
+            USER))
+        event, command = self.sent()
+        self.assertEqual(event[:4], ('event', 'privmsg',
+                                     ('user', 'channel', 'message'),
+                                     (USER, '#cs-york', '!test 1')))
+        self.assertEqual(command[:4], ('command', 'command',
+                                       ('command', 'user', 'channel',
+                                        'direct', 'raw_data'),
+                                       ('test', USER, '#cs-york', False,
+                                        '1')))
+        self.assertEqual(command[5:], ('default', 'csyorkbot'))
+        self.assertEqual(self.worker.events_sent, 2)
+
+    def test_call(self):
+        self.reply(['call', 'default', 'msg', ['#cs-york', 'hello'],
+                    {'priority': 1}])
+        self.assertEqual(self.protocol.transport.value().splitlines()[-1],
+                         'PRIVMSG #cs-york :hello')
+        # Other methods are refused
+        self.protocol.transport.clear()
+        self.reply(['call', 'default', 'quit', ['bye'], {}])
+        self.assertEqual(self.protocol.transport.value(), '')
+
+    def test_set(self):
+        self.reply(['set', 'example', 'foo', 'baz'])
+        self.assertEqual(self.bot.keyval.get('example', 'foo'), 'baz')
+        # Plugins can only change their own values
+        self.reply(['set', 'users', 'foo', 'baz'])
+        self.assertRaises(KeyError, self.bot.keyval.get, 'users', 'foo')
+
+    def test_restart(self):
+        self.sent()
+        self.worker.processEnded(failure.Failure(error.ProcessTerminated(1)))
+        self.assertFalse(self.worker.running)
+        self.protocol.lineReceived(':{} PRIVMSG #cs-york :hi'.format(USER))
+        self.assertEqual(self.worker.events_dropped, 1)
+
+        self.clock.advance(self.worker.RESTART_DELAY)
+        self.assertEqual(self.spawned, 2)
+        self.assertEqual(self.worker.restarts, 1)
+        self.assertEqual([m[0] for m in self.sent()], ['init', 'load'])
+        # Exiting again straight away backs off
+        self.worker.processEnded(failure.Failure(error.ProcessTerminated(1)))
+        self.assertEqual(self.worker.restart_delay,
+                         self.worker.RESTART_DELAY * 4)
+
+    def test_stop(self):
+        transport = self.worker.transport
+        d = self.pool.stop()
+        self.assertTrue(transport.stdin_closed)
+        stopped = []
+        d.addCallback(stopped.append)
+        self.worker.processEnded(failure.Failure(error.ProcessDone(0)))
+        self.assertEqual(len(stopped), 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class TestWorkerChannel(unittest.TestCase):
+    """The worker process's side, without a process."""
+    def setUp(self):
+        self.channel = workers.WorkerChannel()
+        self.channel.makeConnection(StringTransport())
+        self.send(('init', 'nonexistent.cfg', CONFIG))
+        self.channel.bot.discover_plugins = lambda: {'example': Example}
+        self.send(('load', 'example', {'foo': 'bar'}))
+
+    def send(self, message):
+        self.channel.dataReceived(frame(pickle.dumps(message, 2)))
+
+    def replies(self):
+        transport = self.channel.transport
+        messages = [workers.decode_reply(m) for m in frames(transport.value())]
+        transport.clear()
+        return messages
+
+    def command(self, command, data):
+        self.send(('command', 'command',
+                   ('command', 'user', 'channel', 'direct', 'raw_data'),
+                   (command, USER, '#cs-york', False, data),
+                   0.0, 'default', 'csyorkbot'))
+
+    def test_loaded(self):
+        bot = self.channel.bot
+        self.assertTrue(bot.has_plugin('example'))
+        self.assertFalse(isinstance(bot.plugins['example'],
+                                    workers.RemotePlugin))
+
+    def test_reply(self):
+        self.command('test', 'abc')
+        self.assertEqual(self.replies(), [
+            ['call', 'default', 'msg',
+             ['#cs-york', "nick: test invoked: nick!~user@host, #cs-york, "
+                          "['abc']"],
+             {'priority': 1}],
+        ])
+
+    def test_keyval(self):
+        self.command('get', 'foo')
+        self.assertEqual(self.replies()[0][3][1], 'nick: foo is bar.')
+        self.command('set', 'foo baz')
+        self.assertEqual(self.replies()[0], ['set', 'example', 'foo', 'baz'])
+        self.assertEqual(self.channel.bot.plugins['example'].get('foo'),
+                         'baz')
+
+    def test_no_bot_hooks(self):
+        # The bot has already found commands and joined channels
+        self.send(('event', 'privmsg', ('user', 'channel', 'message'),
+                   (USER, '#cs-york', '!test'), 0.0, 'default', 'csyorkbot'))
+        self.send(('event', 'signedOn', (), (), 0.0, 'default', 'csyorkbot'))
+        self.assertEqual(self.replies(), [])
+
+    def test_command_matcher(self):
+        bot = self.channel.bot
+        p = bot.protocol_for('default', 'csyorkbot')
+        self.assertEqual(p.command_matcher.match('!test abc'),
+                         ('test', 'abc', False))
+        # Rebuilt when the bot's nick changes
+        p = bot.protocol_for('default', 'otherbot')
+        self.assertEqual(p.command_matcher.match('otherbot: test'),
+                         ('test', '', True))
+
+
+class TestWorkerHistory(unittest.TestCase):
+    """History, which tells commands apart from other messages, in a
+    worker.
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.channel = workers.WorkerChannel()
+        self.channel.makeConnection(StringTransport())
+        self.channel.dataReceived(frame(pickle.dumps(
+            ('init', 'nonexistent.cfg', CONFIG), 2)))
+        bot = self.channel.bot
+        bot.config.add_section('history')
+        bot.config.set('history', 'history_dir', self.dir)
+        bot.discover_plugins = lambda: {'history': History}
+        bot.load_plugin('history')
+
+    def tearDown(self):
+        self.channel.bot.teardown(save_config=False)
+        shutil.rmtree(self.dir)
+
+    def privmsg(self, message):
+        self.channel.dataReceived(frame(pickle.dumps(
+            ('event', 'privmsg', ('user', 'channel', 'message'),
+             (USER, '#cs-york', message), 0.0, 'default', 'csyorkbot'), 2)))
+
+    def test_commands_not_added(self):
+        self.privmsg('the notes are here')
+        self.privmsg('!grep notes')
+        store = self.channel.bot.plugins['history'].store
+        self.assertEqual(
+            [m.text for m in store.search(Query(['notes']))],
+            ['the notes are here'])